@@ -53,12 +53,9 @@ def main():
     
     try:
         # Create the tester instance
-        tester = TongueVisionTest(data_dir=args.data_dir, output_dir=args.output_dir)
-        
-        # Override the client base_url if provided
-        if args.base_url:
-            tester.client.base_url = args.base_url
-            logger.info(f"Using base URL: {args.base_url}")
+        tester = TongueVisionTest(data_dir=args.data_dir, output_dir=args.output_dir,
+                                  model_name=args.model, base_url=args.base_url)
+        logger.info(f"Using base URL: {args.base_url}")
         
         # Run the pipeline
         output_files = tester.run_pipeline(sample_limit)
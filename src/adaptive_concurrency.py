@@ -0,0 +1,174 @@
+import json
+import time
+import logging
+from threading import Condition
+
+from api_errors import THROTTLED, SERVER_ERROR, TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Outcomes that signal an overloaded endpoint
+OVERLOAD_ERRORS = (THROTTLED, SERVER_ERROR, TIMEOUT)
+
+class AdaptiveConcurrencyController:
+    """AIMD concurrency limit driven by throttling, server errors and latency"""
+
+    def __init__(self, initial_limit=5, min_limit=1, max_limit=50, backoff_factor=0.5,
+                 latency_tolerance=2.0, latency_backoff_factor=0.9, smoothing=0.1):
+        """
+        Initialize the controller
+
+        The limit grows by one after each full window of successful requests
+        (one window = `limit` requests) and is multiplied by backoff_factor on a
+        429/5xx/timeout, or by latency_backoff_factor when a request takes more
+        than latency_tolerance times the smoothed latency. After a decrease,
+        further decreases are ignored until the requests in flight at that moment
+        have drained, so one burst of errors only backs off once.
+
+        Args:
+            initial_limit (int): Starting concurrency limit
+            min_limit (int): Lower bound of the limit
+            max_limit (int): Upper bound of the limit
+            backoff_factor (float): Multiplier applied on throttling or server errors
+            latency_tolerance (float): Latency spike threshold relative to the smoothed latency
+            latency_backoff_factor (float): Multiplier applied on a latency spike
+            smoothing (float): Weight of the newest sample in the smoothed latency
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.backoff_factor = backoff_factor
+        self.latency_tolerance = latency_tolerance
+        self.latency_backoff_factor = latency_backoff_factor
+        self.smoothing = smoothing
+
+        self.condition = Condition()
+        self.in_flight = 0
+        self.smoothed_latency = None
+        self.started_at = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        # Requests started before the last decrease; errors from them don't back off again
+        self._recovery_remaining = 0
+        self.history = []
+        self._record("start")
+
+    @property
+    def current_limit(self):
+        """Return the integer concurrency limit currently enforced"""
+        return max(self.min_limit, int(self.limit))
+
+    def _record(self, event):
+        """Append a sample of the controller state to the history"""
+        self.history.append({
+            "time": round(time.monotonic() - self.started_at, 3),
+            "event": event,
+            "limit": self.current_limit,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "smoothed_latency": self.smoothed_latency,
+        })
+
+    def try_acquire(self):
+        """
+        Take a concurrency slot if one is free
+
+        Returns:
+            bool: True if a slot was taken
+        """
+        with self.condition:
+            if self.in_flight >= self.current_limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        """Block until a concurrency slot is free and take it"""
+        with self.condition:
+            while self.in_flight >= self.current_limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, error_class=None):
+        """
+        Free a concurrency slot and adjust the limit from the request outcome
+
+        Args:
+            latency (float, optional): Request latency in seconds, for successful requests
+            error_class (str, optional): Error class from api_errors.classify_error, None on success
+        """
+        with self.condition:
+            self.in_flight -= 1
+            in_recovery = self._recovery_remaining > 0
+            if in_recovery:
+                self._recovery_remaining -= 1
+
+            if error_class is None:
+                self.completed += 1
+                self._on_success(latency, in_recovery)
+            else:
+                self.failed += 1
+                if error_class in OVERLOAD_ERRORS and not in_recovery:
+                    self._decrease(self.backoff_factor, error_class)
+
+            self.condition.notify_all()
+
+    def _on_success(self, latency, in_recovery):
+        """Grow the limit, or back off if the request was a latency spike"""
+        if latency is not None:
+            if (self.smoothed_latency is not None and not in_recovery
+                    and latency > self.latency_tolerance * self.smoothed_latency):
+                self._decrease(self.latency_backoff_factor, "latency")
+                return
+            if self.smoothed_latency is None:
+                self.smoothed_latency = latency
+            else:
+                self.smoothed_latency += self.smoothing * (latency - self.smoothed_latency)
+
+        previous_limit = self.current_limit
+        self.limit = min(self.max_limit, self.limit + 1.0 / self.current_limit)
+        if self.current_limit != previous_limit:
+            self._record("increase")
+
+    def _decrease(self, factor, reason):
+        """Shrink the limit multiplicatively and start a recovery window"""
+        previous_limit = self.current_limit
+        self.limit = max(self.min_limit, self.limit * factor)
+        self._recovery_remaining = self.in_flight
+        self._record(reason)
+        if self.current_limit != previous_limit:
+            logger.info(f"Concurrency limit {previous_limit} -> {self.current_limit} ({reason})")
+
+    def summary(self):
+        """
+        Summarize the run
+
+        Returns:
+            dict: Final, peak and time-weighted mean limit plus throughput
+        """
+        with self.condition:
+            elapsed = time.monotonic() - self.started_at
+            weighted_sum = 0.0
+            for sample, next_sample in zip(self.history, self.history[1:]):
+                weighted_sum += sample["limit"] * (next_sample["time"] - sample["time"])
+            if self.history:
+                weighted_sum += self.history[-1]["limit"] * max(0.0, elapsed - self.history[-1]["time"])
+            return {
+                "final_limit": self.current_limit,
+                "peak_limit": max(sample["limit"] for sample in self.history),
+                "mean_limit": weighted_sum / elapsed if elapsed > 0 else float(self.current_limit),
+                "completed": self.completed,
+                "failed": self.failed,
+                "throughput": self.completed / elapsed if elapsed > 0 else 0.0,
+            }
+
+    def save_history(self, path):
+        """
+        Write the limit history and summary to a JSON file
+
+        Args:
+            path (str or Path): Output file path
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"summary": self.summary(), "history": self.history}, f, ensure_ascii=False, indent=2)
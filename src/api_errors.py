@@ -0,0 +1,57 @@
+import openai
+
+# Error classes reported by classify_error
+THROTTLED = "throttled"
+SERVER_ERROR = "server_error"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+CLIENT_ERROR = "client_error"
+PARSE_ERROR = "parse_error"
+CACHE_MISS = "cache_miss"
+OTHER = "other"
+
+def classify_error(error):
+    """
+    Map an exception raised by an API call to an error class
+
+    Args:
+        error (Exception): Exception raised by the OpenAI client
+
+    Returns:
+        str: One of THROTTLED, SERVER_ERROR, TIMEOUT, CONNECTION, CLIENT_ERROR or OTHER
+    """
+    # APITimeoutError subclasses APIConnectionError, so check it first
+    if isinstance(error, openai.APITimeoutError):
+        return TIMEOUT
+    if isinstance(error, openai.APIConnectionError):
+        return CONNECTION
+    if isinstance(error, openai.RateLimitError):
+        return THROTTLED
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code == 429:
+            return THROTTLED
+        if error.status_code >= 500:
+            return SERVER_ERROR
+        return CLIENT_ERROR
+    return OTHER
+
+def retry_after_seconds(error):
+    """
+    Read the Retry-After header of a throttled response
+
+    Args:
+        error (Exception): Exception raised by the OpenAI client
+
+    Returns:
+        float: Seconds the server asked us to wait, or None if not given
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
@@ -0,0 +1,251 @@
+import time
+import asyncio
+import logging
+from concurrent.futures.process import BrokenProcessPool
+
+import httpx
+import openai
+
+from api_errors import classify_error, retry_after_seconds, OTHER, PARSE_ERROR
+from retry_policy import next_retry_delay
+from stage_timing import timed
+
+logger = logging.getLogger(__name__)
+
+class AsyncTokenBucket:
+    """A token bucket rate limiter for coroutines"""
+
+    def __init__(self, rate, capacity=None):
+        """
+        Initialize the token bucket
+
+        Callers reserve tokens up front and sleep off any deficit outside the
+        lock, so waiting coroutines never block each other. The burst defaults to
+        a single token, so calls are spaced 1/rate apart and even the first
+        window never admits more than the rate.
+
+        Args:
+            rate (float): Tokens added per second
+            capacity (float, optional): Maximum burst size (default: 1)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1):
+        """
+        Wait until the requested number of tokens is available
+
+        Args:
+            tokens (float): Number of tokens to consume
+        """
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            # Reserve the tokens even if that drives the bucket negative
+            self.tokens -= tokens
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+class AsyncEvaluationEngine:
+    """Runs the evaluation on a single event loop using the async OpenAI client"""
+
+    def __init__(self, tester, max_in_flight=100, max_calls_per_second=2, encode_executor=None, encode_func=None,
+                 max_calls_per_minute=None, max_tokens_per_minute=None, tokens_per_request=1000):
+        """
+        Initialize the engine
+
+        Args:
+            tester (TongueVisionTest): Tester providing data, prompts and result records
+            max_in_flight (int): Maximum number of concurrent requests
+            max_calls_per_second (float): Maximum API calls per second
+            encode_executor (concurrent.futures.Executor, optional): Executor running the image encoding
+            encode_func (callable, optional): Function mapping an image path to a base64 payload
+                (default: tester.encode_image_to_base64)
+            max_calls_per_minute (float, optional): Maximum API calls per minute
+            max_tokens_per_minute (float, optional): Maximum model tokens per minute
+            tokens_per_request (int): Estimated tokens per request, charged against the TPM budget
+        """
+        self.tester = tester
+        self.max_in_flight = max_in_flight
+        self.max_calls_per_second = max_calls_per_second
+        self.max_calls_per_minute = max_calls_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.tokens_per_request = tokens_per_request
+        self.encode_executor = encode_executor
+        self.encode_func = encode_func or tester.encode_image_to_base64
+
+    def run(self, items, pbar=None):
+        """
+        Process all items, passing each result to tester.record_result
+
+        Args:
+            items (list): (sid, row) tuples to evaluate
+            pbar (tqdm, optional): Progress bar updated as items complete
+
+        Returns:
+            tuple: (completed_sids, failed_sids)
+        """
+        return asyncio.run(self._run(items, pbar))
+
+    async def _run(self, items, pbar):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.slot_released = asyncio.Condition()
+        # (bucket, tokens charged per request)
+        buckets = []
+        if self.max_calls_per_second:
+            buckets.append((AsyncTokenBucket(self.max_calls_per_second), 1))
+        if self.max_calls_per_minute:
+            buckets.append((AsyncTokenBucket(self.max_calls_per_minute / 60.0), 1))
+        if self.max_tokens_per_minute:
+            buckets.append((AsyncTokenBucket(self.max_tokens_per_minute / 60.0, self.tokens_per_request),
+                            self.tokens_per_request))
+        limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+
+        async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(600.0, connect=10.0)) as http_client:
+            client = openai.AsyncOpenAI(
+                api_key=self.tester.api_key,
+                base_url=str(self.tester.client.base_url),
+                http_client=http_client,
+                max_retries=0
+            )
+
+            completed_sids = []
+            failed_sids = []
+            tasks = [
+                asyncio.create_task(self._process_item(client, item, semaphore, buckets))
+                for item in items
+            ]
+            for task in asyncio.as_completed(tasks):
+                sid, result = await task
+                if result is not None:
+                    self.tester.record_result(result)
+                    completed_sids.append(sid)
+                else:
+                    failed_sids.append(sid)
+                if pbar is not None:
+                    pbar.update(1)
+
+        return completed_sids, failed_sids
+
+    async def _process_item(self, client, item, semaphore, buckets):
+        """Encode one image, call the model with retries and build its result record"""
+        sid, row = item
+        if sid not in self.tester.image_paths:
+            logger.warning(f"Skipping SID {sid}: No image found.")
+            return sid, None
+
+        base64_image = None
+        attempt = 0
+        while True:
+            attempt += 1
+            # Backoff sleeps happen outside the semaphore so they don't hold a slot
+            async with semaphore:
+                result, base64_image, error_class, message, retry_after = await self._attempt_item(
+                    client, sid, row, buckets, base64_image)
+            if result is not None:
+                self.tester.dead_letters.discard(sid)
+                return sid, result
+
+            delay = next_retry_delay(self.tester.retry_policies, error_class, attempt, retry_after)
+            if delay is None:
+                logger.warning(f"Skipping SID {sid} after {attempt} attempt(s): {message}")
+                self.tester.dead_letters.add(sid, error_class, message, attempt)
+                return sid, None
+
+            logger.info(f"Retrying SID {sid} in {delay:.1f}s ({error_class}, attempt {attempt})")
+            await asyncio.sleep(delay)
+
+    async def _attempt_item(self, client, sid, row, buckets, base64_image):
+        """
+        Make one attempt at calling the model for an image
+
+        Returns:
+            tuple: (result, base64_image, error_class, message, retry_after); result is None on failure
+        """
+        controller = self.tester.concurrency_controller
+        slot_acquired = False
+        latency = None
+        api_error_class = None
+        loop = asyncio.get_running_loop()
+        try:
+            if base64_image is None:
+                base64_image = await loop.run_in_executor(
+                    self.encode_executor, self.encode_func, self.tester.image_paths[sid])
+
+            # Cache hits don't count against the concurrency or rate limits. The cache
+            # is SQLite, so lookups and stores run off the event loop
+            cached = await loop.run_in_executor(None, self.tester.attempt_from_cache, sid, row, base64_image)
+            if cached is not None:
+                return cached
+
+            if controller is not None:
+                await self._acquire_adaptive_slot(controller)
+                slot_acquired = True
+
+            with timed("rate_limit_wait"):
+                for bucket, tokens in buckets:
+                    await bucket.acquire(tokens)
+            start = time.monotonic()
+            try:
+                with timed("network"):
+                    response = await self.request_completion(client, base64_image)
+            except Exception as e:
+                api_error_class = classify_error(e)
+                logger.error(f"API call failed for SID {sid}: {e}")
+                return None, base64_image, api_error_class, str(e), retry_after_seconds(e)
+            latency = time.monotonic() - start
+            await loop.run_in_executor(None, self.tester.cache_response, base64_image, response)
+
+            if response is None:
+                return None, base64_image, PARSE_ERROR, "Model response is None", None
+
+            with timed("parse"):
+                predictions = self.tester.extract_predictions(response)
+            if predictions is None:
+                return None, base64_image, PARSE_ERROR, "Failed to extract predictions", None
+
+            return self.tester.build_result(sid, row, predictions, response), base64_image, None, None, None
+        except BrokenProcessPool:
+            # The encoding workers failed to start: retrying cannot help, so fail the run
+            raise
+        except Exception as e:
+            logger.error(f"Error processing SID {sid}: {e}")
+            if latency is None and api_error_class is None:
+                api_error_class = OTHER
+            return None, base64_image, OTHER, str(e), None
+        finally:
+            if slot_acquired:
+                controller.release(latency=latency, error_class=api_error_class)
+                async with self.slot_released:
+                    self.slot_released.notify_all()
+
+    async def _acquire_adaptive_slot(self, controller):
+        """Wait until the adaptive controller admits another request"""
+        async with self.slot_released:
+            while not controller.try_acquire():
+                await self.slot_released.wait()
+
+    async def request_completion(self, client, base64_image):
+        """
+        Call the vision model with the async client, raising on API errors
+
+        Args:
+            client (openai.AsyncOpenAI): Async API client
+            base64_image (str): Base64 encoded image
+
+        Returns:
+            str: The model's response
+        """
+        response = await client.chat.completions.create(
+            model=self.tester.model_name,
+            messages=self.tester.build_messages(base64_image),
+            max_tokens=self.tester.max_tokens,
+            temperature=self.tester.temperature,
+        )
+        return response.choices[0].message.content
@@ -1,5 +1,6 @@
 import os
 import json
+import mmap
 import base64
 import pandas as pd
 import numpy as np
@@ -8,15 +9,31 @@ import logging
 from datetime import datetime
 from tqdm import tqdm
 import openai
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, classification_report
 import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import collections
 import time
 import queue
 from threading import Lock
-import random
 import argparse
-import cv2
-from image_preprocessing import load_and_preprocess_image, preprocess_image
+from image_preprocessing import (PREPROCESS_CONFIG, DENOISE_MODES, load_and_preprocess_image, preprocess_image,
+                                 roi_options)
+from rate_limiter import RateLimiter
+from api_errors import classify_error, retry_after_seconds, OTHER, PARSE_ERROR, CACHE_MISS
+from retry_policy import default_retry_policies, next_retry_delay, DeadLetterQueue, load_failed_sids
+from adaptive_concurrency import AdaptiveConcurrencyController
+from preprocess_profiles import PreprocessProfile, get_profile, registered_profiles
+from image_cache import (PreprocessCache, encode_preprocessed_image, encode_jpeg, apply_worker_config,
+                         pipeline_fingerprint, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE_MB)
+from async_engine import AsyncEvaluationEngine
+from stage_timing import timed
+from checkpoint import (CheckpointWriter, checkpoint_paths, read_checkpoint, write_json_array,
+                        save_run_metadata, load_run_metadata)
+from response_cache import ResponseCache, DEFAULT_RESPONSE_CACHE, text_sha256
+from dataset_index import DatasetIndex
+from phenotype_cache import load_phenotype_table
+from metrics_engine import EncodedResults, compute_metrics, standardize_label, INDICATORS
+from significance import bootstrap_metrics, format_interval, DEFAULT_RESAMPLES, DEFAULT_CONFIDENCE
 
 # Configure logging
 logging.basicConfig(
@@ -26,60 +43,163 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class RateLimiter:
-    """A rate limiter to prevent exceeding API limits"""
+# Alibaba Cloud Dashscope OpenAI-compatible endpoint
+DEFAULT_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+# Decoding parameters sent with every request
+MAX_TOKENS = 500
+TEMPERATURE = 0.2  # Lower temperature for more consistent results
+
+# Prompts sent with every image
+SYSTEM_PROMPT = "你是一位经验丰富的中医（老中医），尤其擅长舌诊。你的任务是运用你专业的视觉判断标准，仔细分析提供的舌头图像，并根据中医（TCM）的经典视觉特征对舌象进行分类。请严格专注于图像本身的视觉信息，并严格遵循下面提供的标签选项和输出格式要求。最终仅输出JSON对象。"
+
+USER_PROMPT = """请根据中医舌诊的视觉判断标准，仔细分析下图，并对以下五个指标进行分类。对于每个指标，请从下面提供的选项中选择**唯一一个**最符合图像视觉特征的**英文标签**。括号中的中文描述了该英文标签对应的中医视觉标准，请以此作为你这位老中医进行视觉判断的核心依据。
+
+1.  **`coating_label` (舌苔的质地视觉特征):**
+    选项 (Options): [
+      `greasy` (视觉上，苔质颗粒细腻致密、或伴有黏液、显得油亮、不清爽。对应中医【腻苔】的典型视觉),
+      `greasy_thick` (视觉上，苔质特征同'greasy'，但明显更厚、更密实、刮之不去感更强。对应中医【厚腻苔】的典型视觉),
+      `non_greasy` (视觉上，苔质不具备'greasy'的油腻、黏厚感，可能呈现薄、净、颗粒相对清晰或略干的状态。对应中医视觉上非腻苔，如薄苔、正常苔等的质地)
+    ]
+
+2.  **`tai_label` (舌苔的主要颜色视觉特征):**
+    选项 (Options): [
+      `white` (视觉上，舌苔整体呈现清晰的白色。对应中医【白苔】的视觉),
+      `light_yellow` (视觉上，舌苔整体呈现淡淡的、浅浅的黄色调。对应中医【淡黄苔/薄黄苔】的视觉),
+      `yellow` (视觉上，舌苔整体呈现明显、较深的黄色调。对应中医【黄苔】的视觉)
+    ]
+
+3.  **`zhi_label` (舌头的本体颜色视觉特征，即舌质颜色):**
+    选项 (Options): [
+      `regular` (视觉上，舌体颜色是健康的淡红色或鲜活的粉红色。对应中医【淡红舌】的标准视觉),
+      `dark` (视觉上，舌体颜色明显深红、暗红、绛红，或呈现明显的紫色、青紫色。对应中医【红绛舌/紫暗舌】等的视觉),
+      `light` (视觉上，舌体颜色明显浅淡、发白，缺乏红润光泽，呈"缺血"外观。对应中医【淡白舌】的视觉)
+    ]
+
+4.  **`fissure_label` (舌面上的裂纹视觉特征):**
+    选项 (Options): [
+      `NaN` (视觉上，舌面上完全没有裂纹或明显的沟壑。对应中医【无裂纹】的视觉),
+      `light` (视觉上，舌面可见少量裂纹，或裂纹形态较浅、较细。对应中医【少许/浅裂纹】的视觉),
+      `severe` (视觉上，舌面可见较多裂纹，或裂纹形态明显较深、较粗、范围较广。对应中医【多/深裂纹】的视觉)
+    ]
+    (如果视觉上完全看不到裂纹，请选择 `NaN`。)
+
+5.  **`tooth_mk_label` (舌头边缘的齿痕视觉特征):**
+    选项 (Options): [
+      `NaN` (视觉上，舌头边缘光滑或形态自然，没有牙齿压迫形成的印痕。对应中医【无齿痕】的视觉),
+      `light` (视觉上，舌头边缘可见轻微的、较浅的波浪状压痕。对应中医【轻微/浅齿痕】的视觉),
+      `severe` (视觉上，舌头边缘可见非常明显的、较深的波浪状压痕，舌体可能显得胖大。对应中医【明显/深齿痕】的视觉)
+    ]
+    (如果视觉上完全看不到齿痕，请选择 `NaN`。)
+
+请严格按照老中医的视觉判断标准进行评估。你的整个回答**必须**仅仅是一个JSON对象，其中包含这五个**英文**键（`coating_label`, `tai_label`, `zhi_label`, `fissure_label`, `tooth_mk_label`）和它们对应的、你根据视觉判断所选择的**英文**标签值。确保输出的JSON格式正确，不要包含任何括号中的中文描述或其他解释性文字。
+
+输出格式示例 (Example Format):
+```json
+{"coating_label": "greasy", "tai_label": "white", "zhi_label": "regular", "fissure_label": "NaN", "tooth_mk_label": "light"}
+```"""
+
+# Values of the preprocess option besides profile names: "none" uploads the original
+# file bytes, "full" runs the chain configured by PREPROCESS_CONFIG
+PREPROCESS_MODES = ("none", "full")
+
+def raw_image_base64(image_path):
+    """
+    Base64-encode the original bytes of an image file
     
-    def __init__(self, max_calls_per_second=1, max_concurrent_requests=5):
-        """
-        Initialize the rate limiter
+    The file is memory-mapped and encoded directly, without decoding the JPEG
+    or copying it into an intermediate bytes object.
+    
+    Args:
+        image_path (Path): Path to the image file
         
-        Args:
-            max_calls_per_second (int): Maximum number of calls allowed per second
-            max_concurrent_requests (int): Maximum number of concurrent requests
-        """
-        self.max_calls_per_second = max_calls_per_second
-        self.max_concurrent_requests = max_concurrent_requests
-        self.call_timestamps = queue.Queue()
-        self.lock = Lock()
-        self.active_requests = 0
+    Returns:
+        str: Base64 encoded file contents
+    """
+    with open(image_path, "rb") as image_file:
+        try:
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return base64.b64encode(mapped).decode('ascii')
+        except ValueError:
+            # Empty files cannot be mapped
+            return base64.b64encode(image_file.read()).decode('ascii')
+
+def encode_image_file(image_path, image_cache=None, roi=None, preprocess="full"):
+    """
+    Preprocess an image and encode it as base64 for upload
+    
+    Falls back to the original file bytes if preprocessing fails, but not if
+    a stage of the profile is not registered in this process.
+    
+    Args:
+        image_path (Path): Path to the image file
+        image_cache (PreprocessCache, optional): On-disk cache of preprocessed images
+        roi (dict, optional): Region-of-interest options from image_preprocessing.roi_options
+        preprocess (str or PreprocessProfile): "full" runs the preprocessing pipeline, "none" sends
+            the original file, a profile runs that profile
         
-    def acquire(self):
-        """
-        Acquires permission to make an API call, blocking if necessary.
-        """
-        with self.lock:
-            # Wait until we have a free slot for concurrent requests
-            while self.active_requests >= self.max_concurrent_requests:
-                time.sleep(0.1)
-            
-            # Enforce the rate limit based on calls per second
-            now = time.time()
-            
-            # If we've made max_calls_per_second calls in the last second, wait
-            if self.call_timestamps.qsize() >= self.max_calls_per_second:
-                oldest_timestamp = self.call_timestamps.get()
-                time_since_oldest = now - oldest_timestamp
-                
-                if time_since_oldest < 1.0:
-                    # Sleep to respect the rate limit
-                    sleep_time = 1.0 - time_since_oldest + random.uniform(0.1, 0.3)  # Add jitter
-                    time.sleep(sleep_time)
+    Returns:
+        str: Base64 encoded image
+    """
+    if preprocess == "none":
+        with timed("encode"):
+            return raw_image_base64(image_path)
+    profile = preprocess if isinstance(preprocess, PreprocessProfile) else None
+    if profile is not None and profile.missing_stages():
+        # Uploading the original image would silently evaluate a different pipeline
+        raise ValueError(f"Profile {profile.name}: stages {profile.missing_stages()} are not registered")
+    try:
+        if image_cache is not None:
+            jpeg_bytes = image_cache.get_or_create(
+                image_path, lambda: encode_preprocessed_image(image_path, roi, profile))
+            if jpeg_bytes is not None:
+                with timed("encode"):
+                    return base64.b64encode(jpeg_bytes).decode('utf-8')
+        
+        # Load and preprocess the image
+        image = load_and_preprocess_image(image_path, roi=roi, profile=profile)
+        
+        if image is None:
+            logger.warning(f"Failed to preprocess image {image_path}, using original image")
+            # Fallback to original image if preprocessing fails
+            return raw_image_base64(image_path)
             
-            # Record this call timestamp
-            self.call_timestamps.put(time.time())
-            self.active_requests += 1
-    
-    def release(self):
-        """
-        Releases a request slot.
-        """
-        with self.lock:
-            self.active_requests -= 1
+        # Encode the preprocessed image
+        with timed("encode"):
+            buffer = encode_jpeg(image)
+            if buffer is None:
+                raise ValueError("JPEG encoding failed")
+            return base64.b64encode(buffer).decode('utf-8')
+    except Exception as e:
+        logger.warning(f"Error preprocessing and encoding image: {e}. Using original image.")
+        # Fallback to original image if there's an error
+        return raw_image_base64(image_path)
+
+# Per-process state of the preprocessing pool used by run_evaluation
+_worker_image_cache = None
+_worker_roi = None
+_worker_preprocess = "full"
+
+def _init_encode_worker(cache_dir, fingerprint, roi=None, preprocess="full", config=None):
+    """Initializer for preprocessing worker processes"""
+    global _worker_image_cache, _worker_roi, _worker_preprocess
+    if config is not None:
+        apply_worker_config(config, fingerprint, roi, preprocess if isinstance(preprocess, PreprocessProfile) else None)
+    _worker_roi = roi
+    _worker_preprocess = preprocess
+    if cache_dir is not None:
+        # Eviction is left to the parent process so workers don't rescan the cache
+        _worker_image_cache = PreprocessCache(cache_dir, max_size_mb=None, fingerprint=fingerprint, roi=roi)
+
+def _encode_worker(image_path):
+    """Preprocessing worker entry point: encode one image in a worker process"""
+    return encode_image_file(image_path, _worker_image_cache, _worker_roi, _worker_preprocess)
 
 class TongueVisionTest:
     """Class for testing the VL-MAX model on tongue images"""
     
-    def __init__(self, data_dir="data/TonguExpertDatabase", output_dir="out_put/baseline_results", model_name="qwen-vl-max"):
+    def __init__(self, data_dir="data/TonguExpertDatabase", output_dir="out_put/baseline_results", model_name="qwen-vl-max",
+                 image_cache=None, base_url=DEFAULT_BASE_URL, response_cache=None, roi=None, preprocess="full"):
         """
         Initialize the tester
         
@@ -87,6 +207,15 @@ class TongueVisionTest:
             data_dir (str): Path to the data directory
             output_dir (str): Path to the output directory
             model_name (str): Name of the model to use for API calls
+            image_cache (PreprocessCache, optional): On-disk cache of preprocessed images
+            base_url (str): Base URL of the OpenAI-compatible API
+            response_cache (ResponseCache, optional): Cache of model responses; in replay-only
+                mode no request is sent and no API key is needed
+            roi (dict, optional): Region-of-interest options from image_preprocessing.roi_options;
+                images are cropped to the tongue mask and/or downscaled before preprocessing
+            preprocess (str or PreprocessProfile): One of PREPROCESS_MODES, a registered profile
+                name or a profile file (see preprocess_profiles); "none" uploads the original
+                JPEG bytes without decoding, so image_cache and roi are not used
         """
         self.data_dir = Path(data_dir)
         logger.info(f"Using data directory: {self.data_dir.absolute()}")
@@ -98,10 +227,49 @@ class TongueVisionTest:
         self.phenotypes_dir = self.data_dir / "Phenotypes"
         self.images_dir = self.data_dir / "TongueImage" / "Raw"
         
-        # Store the model name
+        # Store the model name and decoding parameters
         self.model_name = model_name
+        self.max_tokens = MAX_TOKENS
+        self.temperature = TEMPERATURE
         logger.info(f"Using model: {self.model_name}")
         
+        self.image_cache = image_cache
+        self.roi = roi
+        if isinstance(preprocess, str) and preprocess not in PREPROCESS_MODES:
+            preprocess = get_profile(preprocess)
+        self.preprocess = preprocess
+        self.profile = preprocess if isinstance(preprocess, PreprocessProfile) else None
+        if self.profile is not None:
+            logger.info(f"Using preprocessing profile {self.profile.name} ({self.profile.fingerprint[:12]})")
+        if self.image_cache is not None:
+            cache_profile = self.image_cache.profile
+            if (cache_profile.fingerprint if cache_profile is not None else None) != \
+                    (self.profile.fingerprint if self.profile is not None else None):
+                raise ValueError("The preprocess cache was created for a different preprocessing profile")
+        if preprocess == "none" and (image_cache is not None or roi is not None):
+            raise ValueError("preprocess='none' sends the original files; image_cache and roi do not apply")
+        if self.image_cache is not None and self.image_cache.roi != roi:
+            raise ValueError("The preprocess cache was created with different ROI options")
+        if self.roi is not None:
+            logger.info(f"Using ROI options: {self.roi}")
+        # Set by run_evaluation when adaptive concurrency is enabled
+        self.concurrency_controller = None
+        
+        # Retries are handled by self.retry_policies rather than the client
+        self.retry_policies = default_retry_policies()
+        self.dead_letters = DeadLetterQueue()
+        if self.image_cache is not None:
+            logger.info(f"Using preprocess cache: {self.image_cache.entries_dir.absolute()}")
+        
+        self.response_cache = response_cache
+        self.replay_only = response_cache is not None and response_cache.replay_only
+        if self.response_cache is not None:
+            logger.info(f"Using response cache: {self.response_cache.path.absolute()}"
+                        f"{' (replay-only)' if self.replay_only else ''}")
+        if self.replay_only:
+            # Replayed outcomes are deterministic, so there is nothing to retry
+            self.retry_policies = {}
+        
         # Check if directories exist
         if not self.data_dir.exists():
             logger.error(f"Data directory does not exist: {self.data_dir.absolute()}")
@@ -117,6 +285,9 @@ class TongueVisionTest:
         
         # Initialize OpenAI API for Dashscope
         self.api_key = os.environ.get("DASHCOPE_API_KEY")
+        if not self.api_key and self.replay_only:
+            # The client is never used in replay-only mode
+            self.api_key = "replay-only"
         if not self.api_key:
             logger.error("DASHCOPE_API_KEY environment variable not set.")
             raise ValueError("DASHCOPE_API_KEY environment variable not set.")
@@ -124,14 +295,30 @@ class TongueVisionTest:
         # Initialize OpenAI client with Alibaba Cloud Dashscope base URL
         self.client = openai.OpenAI(
             api_key=self.api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+            base_url=base_url,
+            max_retries=0
         )
         
+        # Identifies the prompt template in response cache keys
+        self.prompt_hash = text_sha256(json.dumps(self.build_messages(""), ensure_ascii=False, sort_keys=True))
+        
         # Data structures
         self.labels_df = None  # To store ground truth labels
         self.image_paths = {}  # Map SID to image path
+        self.dataset_index = None  # DatasetIndex of the image directory, built by load_data
         self.predictions = []  # To store predictions
         self.results = {}  # To store evaluation results
+        self.encoded_results = None  # Integer-coded results, set by calculate_metrics
+        
+        # Bootstrap confidence intervals of the metrics; 0 resamples disables them
+        self.bootstrap_resamples = DEFAULT_RESAMPLES
+        self.bootstrap_confidence = DEFAULT_CONFIDENCE
+        self.bootstrap_workers = None
+        
+        # Set by run_evaluation when results are streamed to a JSONL checkpoint
+        self.run_id = None
+        self.checkpoint = None
+        self.checkpoint_path = None
         
     def load_data(self):
         """Load labels and image paths"""
@@ -143,28 +330,20 @@ class TongueVisionTest:
             logger.error(f"Labels file does not exist: {labels_path}")
             raise FileNotFoundError(f"Labels file does not exist: {labels_path}")
         
-        self.labels_df = pd.read_csv(labels_path, sep='\t')
+        # Parsed once into the binary phenotype cache, then loaded from it
+        self.labels_df = load_phenotype_table(labels_path)
         logger.info(f"Loaded {len(self.labels_df)} labels.")
         
-        # Get image paths
-        image_files = list(self.images_dir.glob("*.*"))
-        logger.info(f"Found {len(image_files)} image files.")
-        
-        # Map SID to image path
-        for img_path in image_files:
-            # Extract SID from filename (assuming the SID is the filename without extension)
-            sid = img_path.stem
-            self.image_paths[sid] = img_path
+        # Get image paths from the dataset index (one directory scan, then a cached manifest);
+        # the SID is the filename without extension
+        self.dataset_index = DatasetIndex(self.images_dir)
+        self.image_paths = self.dataset_index.paths()
+        logger.info(f"Found {len(self.image_paths)} image files.")
         
         # Check if all SIDs in the labels file have corresponding images
-        missing_images = 0
-        for sid in self.labels_df['SID']:
-            if sid not in self.image_paths:
-                missing_images += 1
-                logger.warning(f"No image found for SID: {sid}")
-        
-        if missing_images > 0:
-            logger.warning(f"Missing images for {missing_images} SIDs.")
+        missing_sids = self.dataset_index.missing(self.labels_df['SID'])
+        if missing_sids:
+            logger.warning(f"Missing images for {len(missing_sids)} SIDs. First 10: {missing_sids[:10]}")
         
         logger.info("Data loading completed.")
     
@@ -178,115 +357,149 @@ class TongueVisionTest:
         Returns:
             str: Base64 encoded image
         """
-        try:
-            # Load and preprocess the image
-            image = load_and_preprocess_image(image_path)
-            
-            if image is None:
-                logger.warning(f"Failed to preprocess image {image_path}, using original image")
-                # Fallback to original image if preprocessing fails
-                with open(image_path, "rb") as image_file:
-                    return base64.b64encode(image_file.read()).decode('utf-8')
+        return encode_image_file(image_path, self.image_cache, self.roi, self.preprocess)
+    
+    def build_messages(self, base64_image):
+        """
+        Build the chat messages sent to the vision model
+        
+        Args:
+            base64_image (str): Base64 encoded image
             
-            # Encode the preprocessed image
-            _, buffer = cv2.imencode(".jpg", image)
-            return base64.b64encode(buffer).decode('utf-8')
-        except Exception as e:
-            logger.warning(f"Error preprocessing and encoding image: {e}. Using original image.")
-            # Fallback to original image if there's an error
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+        Returns:
+            list: Messages in OpenAI chat format
+        """
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": USER_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                    }
+                ]
+            }
+        ]
     
-    def call_vision_model(self, image_path):
+    def call_vision_model(self, image_path, base64_image=None):
         """
         Call the Tongyi Qianwen VL-MAX model using OpenAI's compatible interface
         
         Args:
             image_path (Path): Path to the image file
+            base64_image (str, optional): Pre-encoded image payload; encoded from image_path if omitted
             
         Returns:
             str: The model's response
         """
         try:
             # Encode the image as base64
-            base64_image = self.encode_image_to_base64(image_path)
-            
-            # Make the API call
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-              messages = [
-    {
-        "role": "system",
-        "content": "你是一位经验丰富的中医（老中医），尤其擅长舌诊。你的任务是运用你专业的视觉判断标准，仔细分析提供的舌头图像，并根据中医（TCM）的经典视觉特征对舌象进行分类。请严格专注于图像本身的视觉信息，并严格遵循下面提供的标签选项和输出格式要求。最终仅输出JSON对象。"
-    },
-    {
-        "role": "user",
-        "content": [
-            {
-                "type": "text",
-                "text": """请根据中医舌诊的视觉判断标准，仔细分析下图，并对以下五个指标进行分类。对于每个指标，请从下面提供的选项中选择**唯一一个**最符合图像视觉特征的**英文标签**。括号中的中文描述了该英文标签对应的中医视觉标准，请以此作为你这位老中医进行视觉判断的核心依据。
-
-1.  **`coating_label` (舌苔的质地视觉特征):**
-    选项 (Options): [
-      `greasy` (视觉上，苔质颗粒细腻致密、或伴有黏液、显得油亮、不清爽。对应中医【腻苔】的典型视觉),
-      `greasy_thick` (视觉上，苔质特征同'greasy'，但明显更厚、更密实、刮之不去感更强。对应中医【厚腻苔】的典型视觉),
-      `non_greasy` (视觉上，苔质不具备'greasy'的油腻、黏厚感，可能呈现薄、净、颗粒相对清晰或略干的状态。对应中医视觉上非腻苔，如薄苔、正常苔等的质地)
-    ]
-
-2.  **`tai_label` (舌苔的主要颜色视觉特征):**
-    选项 (Options): [
-      `white` (视觉上，舌苔整体呈现清晰的白色。对应中医【白苔】的视觉),
-      `light_yellow` (视觉上，舌苔整体呈现淡淡的、浅浅的黄色调。对应中医【淡黄苔/薄黄苔】的视觉),
-      `yellow` (视觉上，舌苔整体呈现明显、较深的黄色调。对应中医【黄苔】的视觉)
-    ]
-
-3.  **`zhi_label` (舌头的本体颜色视觉特征，即舌质颜色):**
-    选项 (Options): [
-      `regular` (视觉上，舌体颜色是健康的淡红色或鲜活的粉红色。对应中医【淡红舌】的标准视觉),
-      `dark` (视觉上，舌体颜色明显深红、暗红、绛红，或呈现明显的紫色、青紫色。对应中医【红绛舌/紫暗舌】等的视觉),
-      `light` (视觉上，舌体颜色明显浅淡、发白，缺乏红润光泽，呈"缺血"外观。对应中医【淡白舌】的视觉)
-    ]
-
-4.  **`fissure_label` (舌面上的裂纹视觉特征):**
-    选项 (Options): [
-      `NaN` (视觉上，舌面上完全没有裂纹或明显的沟壑。对应中医【无裂纹】的视觉),
-      `light` (视觉上，舌面可见少量裂纹，或裂纹形态较浅、较细。对应中医【少许/浅裂纹】的视觉),
-      `severe` (视觉上，舌面可见较多裂纹，或裂纹形态明显较深、较粗、范围较广。对应中医【多/深裂纹】的视觉)
-    ]
-    (如果视觉上完全看不到裂纹，请选择 `NaN`。)
-
-5.  **`tooth_mk_label` (舌头边缘的齿痕视觉特征):**
-    选项 (Options): [
-      `NaN` (视觉上，舌头边缘光滑或形态自然，没有牙齿压迫形成的印痕。对应中医【无齿痕】的视觉),
-      `light` (视觉上，舌头边缘可见轻微的、较浅的波浪状压痕。对应中医【轻微/浅齿痕】的视觉),
-      `severe` (视觉上，舌头边缘可见非常明显的、较深的波浪状压痕，舌体可能显得胖大。对应中医【明显/深齿痕】的视觉)
-    ]
-    (如果视觉上完全看不到齿痕，请选择 `NaN`。)
-
-请严格按照老中医的视觉判断标准进行评估。你的整个回答**必须**仅仅是一个JSON对象，其中包含这五个**英文**键（`coating_label`, `tai_label`, `zhi_label`, `fissure_label`, `tooth_mk_label`）和它们对应的、你根据视觉判断所选择的**英文**标签值。确保输出的JSON格式正确，不要包含任何括号中的中文描述或其他解释性文字。
-
-输出格式示例 (Example Format):
-```json
-{"coating_label": "greasy", "tai_label": "white", "zhi_label": "regular", "fissure_label": "NaN", "tooth_mk_label": "light"}
-```"""
-            },
-            {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-            }
-        ]
-    }
-],
-                max_tokens=500,
-                temperature=0.2,  # Lower temperature for more consistent results
-            )
+            if base64_image is None:
+                base64_image = self.encode_image_to_base64(image_path)
+            
+            response = self.cached_response(base64_image)
+            if response is not None:
+                return response
+            if self.replay_only:
+                logger.warning(f"No cached response for {image_path} (replay-only mode)")
+                return None
             
-            return response.choices[0].message.content
+            response = self.request_completion(base64_image)
+            self.cache_response(base64_image, response)
+            return response
             
         except Exception as e:
             logger.error(f"API call failed: {e}")
             return None
     
+    def request_completion(self, base64_image):
+        """
+        Send one request to the vision model, raising on API errors
+        
+        Args:
+            base64_image (str): Base64 encoded image
+            
+        Returns:
+            str: The model's response
+        """
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=self.build_messages(base64_image),
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+        )
+        
+        return response.choices[0].message.content
+    
+    def response_cache_key(self, base64_image):
+        """
+        Build the response cache key of a request for an image payload
+        
+        Args:
+            base64_image (str): Base64 encoded image
+            
+        Returns:
+            tuple: (key, fields) as returned by ResponseCache.make_key
+        """
+        return ResponseCache.make_key(self.model_name, self.prompt_hash, text_sha256(base64_image),
+                                      self.temperature, self.max_tokens, str(self.client.base_url))
+    
+    def cached_response(self, base64_image):
+        """
+        Look up the cached model response for an image payload
+        
+        Args:
+            base64_image (str): Base64 encoded image
+            
+        Returns:
+            str: Cached raw response, or None on a miss or without a response cache
+        """
+        if self.response_cache is None:
+            return None
+        key, _ = self.response_cache_key(base64_image)
+        with timed("response_cache"):
+            return self.response_cache.get(key)
+    
+    def cache_response(self, base64_image, response):
+        """
+        Store a model response in the response cache
+        
+        Args:
+            base64_image (str): Base64 encoded image
+            response (str): Raw model response
+        """
+        if self.response_cache is None or response is None:
+            return
+        key, fields = self.response_cache_key(base64_image)
+        self.response_cache.put(key, fields, response)
+    
+    def attempt_from_cache(self, sid, row, base64_image):
+        """
+        Answer an attempt from the response cache
+        
+        A cached response that no longer parses is ignored so the request is sent
+        again, except in replay-only mode where it fails the attempt.
+        
+        Returns:
+            tuple: The attempt outcome (see _attempt_image), or None if the API must be called
+        """
+        response = self.cached_response(base64_image)
+        if response is None:
+            if self.replay_only:
+                return None, base64_image, CACHE_MISS, "No cached response (replay-only mode)", None
+            return None
+        
+        with timed("parse"):
+            predictions = self.extract_predictions(response)
+        if predictions is None:
+            if self.replay_only:
+                return None, base64_image, PARSE_ERROR, "Failed to extract predictions from cached response", None
+            return None
+        
+        return self.build_result(sid, row, predictions, response), base64_image, None, None, None
+    
     def extract_predictions(self, raw_response):
         """
         Extract predictions from the model's response
@@ -325,14 +538,18 @@ class TongueVisionTest:
             logger.error(f"Failed to extract predictions: {e}")
             return None
     
-    def process_image(self, item, rate_limiter=None):
+    def process_image(self, item, rate_limiter=None, base64_image=None):
         """
         Process a single image with API rate limiting
         
+        Failed attempts are retried according to self.retry_policies; SIDs that
+        exhaust their retries are recorded in self.dead_letters.
+        
         Args:
             item (tuple): A tuple containing (sid, row) where sid is the image identifier
                          and row is the dataframe row with labels
             rate_limiter (RateLimiter, optional): Rate limiter instance to control API call frequency
+            base64_image (str, optional): Pre-encoded image payload from the preprocessing stage
             
         Returns:
             dict: Result dictionary or None if processing failed
@@ -344,67 +561,162 @@ class TongueVisionTest:
             logger.warning(f"Skipping SID {sid}: No image found.")
             return None
         
-        # Get image path
+        attempt = 0
+        while True:
+            attempt += 1
+            result, base64_image, error_class, message, retry_after = self._attempt_image(
+                sid, row, rate_limiter, base64_image)
+            if result is not None:
+                self.dead_letters.discard(sid)
+                return result
+            
+            delay = next_retry_delay(self.retry_policies, error_class, attempt, retry_after)
+            if delay is None:
+                logger.warning(f"Skipping SID {sid} after {attempt} attempt(s): {message}")
+                self.dead_letters.add(sid, error_class, message, attempt)
+                return None
+            
+            logger.info(f"Retrying SID {sid} in {delay:.1f}s ({error_class}, attempt {attempt})")
+            time.sleep(delay)
+    
+    def _attempt_image(self, sid, row, rate_limiter, base64_image):
+        """
+        Make one attempt at calling the model for an image
+        
+        Returns:
+            tuple: (result, base64_image, error_class, message, retry_after); result is None on failure
+        """
         image_path = self.image_paths[sid]
+        controller = self.concurrency_controller
+        slot_acquired = False
+        limiter_acquired = False
+        latency = None
+        api_error_class = None
         
         try:
+            if base64_image is None:
+                base64_image = self.encode_image_to_base64(image_path)
+            
+            # Cache hits don't count against the concurrency or rate limits
+            cached = self.attempt_from_cache(sid, row, base64_image)
+            if cached is not None:
+                return cached
+            
+            # Wait for a slot under the adaptive concurrency limit if enabled
+            if controller:
+                controller.acquire()
+                slot_acquired = True
+            
             # Acquire permission from rate limiter if provided
             if rate_limiter:
-                rate_limiter.acquire()
+                with timed("rate_limit_wait"):
+                    rate_limiter.acquire()
+                limiter_acquired = True
             
             # Call the model
-            response = self.call_vision_model(image_path)
+            start = time.monotonic()
+            try:
+                with timed("network"):
+                    response = self.request_completion(base64_image)
+            except Exception as e:
+                api_error_class = classify_error(e)
+                logger.error(f"API call failed for SID {sid}: {e}")
+                return None, base64_image, api_error_class, str(e), retry_after_seconds(e)
+            latency = time.monotonic() - start
+            self.cache_response(base64_image, response)
             
             if response is None:
-                logger.warning(f"Skipping SID {sid}: Model response is None.")
-                return None
+                return None, base64_image, PARSE_ERROR, "Model response is None", None
             
             # Extract predictions
-            predictions = self.extract_predictions(response)
+            with timed("parse"):
+                predictions = self.extract_predictions(response)
             
             if predictions is None:
-                logger.warning(f"Skipping SID {sid}: Failed to extract predictions.")
-                return None
-            
-            # Store result with standardized ground truth values
-            result = {
-                "SID": sid,
-                "ground_truth": {
-                    "coating_label": self.standardize_label(row["coating_label"] if not pd.isna(row["coating_label"]) else None),
-                    "tai_label": self.standardize_label(row["tai_label"] if not pd.isna(row["tai_label"]) else None),
-                    "zhi_label": self.standardize_label(row["zhi_label"] if not pd.isna(row["zhi_label"]) else None),
-                    "fissure_label": self.standardize_label(row["fissure_label"] if not pd.isna(row["fissure_label"]) else None),
-                    "tooth_mk_label": self.standardize_label(row["tooth_mk_label"] if not pd.isna(row["tooth_mk_label"]) else None)
-                },
-                "predictions": {
-                    "coating_label": self.standardize_label(predictions["coating_label"]),
-                    "tai_label": self.standardize_label(predictions["tai_label"]),
-                    "zhi_label": self.standardize_label(predictions["zhi_label"]),
-                    "fissure_label": self.standardize_label(predictions["fissure_label"]),
-                    "tooth_mk_label": self.standardize_label(predictions["tooth_mk_label"])
-                },
-                "raw_response": response
-            }
+                return None, base64_image, PARSE_ERROR, "Failed to extract predictions", None
             
-            return result
+            return self.build_result(sid, row, predictions, response), base64_image, None, None, None
         
         except Exception as e:
             logger.error(f"Error processing SID {sid}: {e}")
-            return None
+            if latency is None and api_error_class is None:
+                api_error_class = OTHER
+            return None, base64_image, OTHER, str(e), None
         
         finally:
             # Release the rate limiter if provided
-            if rate_limiter:
+            if limiter_acquired:
                 rate_limiter.release()
+            if slot_acquired:
+                controller.release(latency=latency, error_class=api_error_class)
+    
+    def build_result(self, sid, row, predictions, response):
+        """
+        Build the result record stored in self.predictions
+        
+        Args:
+            sid (str): Image identifier
+            row (pandas.Series): Dataframe row with the ground truth labels
+            predictions (dict): Predictions extracted from the model response
+            response (str): Raw model response
+            
+        Returns:
+            dict: Result with standardized ground truth and predicted labels
+        """
+        # Store result with standardized ground truth values
+        result = {
+            "SID": sid,
+            "ground_truth": {
+                "coating_label": self.standardize_label(row["coating_label"] if not pd.isna(row["coating_label"]) else None),
+                "tai_label": self.standardize_label(row["tai_label"] if not pd.isna(row["tai_label"]) else None),
+                "zhi_label": self.standardize_label(row["zhi_label"] if not pd.isna(row["zhi_label"]) else None),
+                "fissure_label": self.standardize_label(row["fissure_label"] if not pd.isna(row["fissure_label"]) else None),
+                "tooth_mk_label": self.standardize_label(row["tooth_mk_label"] if not pd.isna(row["tooth_mk_label"]) else None)
+            },
+            "predictions": {
+                "coating_label": self.standardize_label(predictions["coating_label"]),
+                "tai_label": self.standardize_label(predictions["tai_label"]),
+                "zhi_label": self.standardize_label(predictions["zhi_label"]),
+                "fissure_label": self.standardize_label(predictions["fissure_label"]),
+                "tooth_mk_label": self.standardize_label(predictions["tooth_mk_label"])
+            },
+            "raw_response": response
+        }
+        
+        return result
     
-    def run_evaluation(self, sample_limit=None, max_workers=5, max_calls_per_second=2):
+    def run_evaluation(self, sample_limit=None, max_workers=5, max_calls_per_second=2,
+                       preprocess_workers=0, queue_size=None, engine="thread",
+                       max_calls_per_minute=None, max_tokens_per_minute=None, tokens_per_request=1000,
+                       adaptive_max_workers=None, sids=None, requeue_rounds=1, run_id=None, resume=False):
         """
         Run the evaluation on the dataset with concurrent processing
         
+        With preprocess_workers > 0 the run is split into two stages: a process pool
+        preprocesses and encodes images into a bounded queue, and max_workers API
+        threads consume the queue and call the model.
+        
+        With engine="async" all requests run on one event loop with the async
+        OpenAI client, and max_workers is the number of requests in flight.
+        
         Args:
             sample_limit (int, optional): Limit the number of samples to process (for testing)
             max_workers (int): Maximum number of concurrent workers
             max_calls_per_second (int): Maximum API calls per second
+            preprocess_workers (int): Number of preprocessing processes (0 preprocesses on the API threads;
+                ignored with preprocess="none", which only reads the files)
+            queue_size (int, optional): Capacity of the encoded image queue (default: 2 * max_workers)
+            engine (str): "thread" or "async"
+            max_calls_per_minute (int, optional): Maximum API calls per minute
+            max_tokens_per_minute (int, optional): Maximum model tokens per minute
+            tokens_per_request (int): Estimated tokens per request, charged against the TPM budget
+            adaptive_max_workers (int, optional): Enables AIMD concurrency control starting at
+                max_workers and growing up to this limit
+            sids (list, optional): Evaluate exactly these SIDs instead of sampling
+            requeue_rounds (int): Extra passes over dead-lettered SIDs with retryable errors
+            run_id (str, optional): Stream results to the JSONL checkpoint run_<run_id>.jsonl
+                instead of keeping them in memory
+            resume (bool): Continue the checkpointed run run_id, skipping SIDs it already completed
         """
         logger.info("Starting evaluation...")
         
@@ -412,34 +724,265 @@ class TongueVisionTest:
         if self.labels_df is None:
             self.load_data()
         
-        # Select samples to evaluate
-        if sample_limit is not None and sample_limit < len(self.labels_df):
-            sample_indices = np.random.choice(len(self.labels_df), sample_limit, replace=False)
-            eval_df = self.labels_df.iloc[sample_indices].copy()
-            logger.info(f"Using {sample_limit} random samples for evaluation.")
-        else:
-            eval_df = self.labels_df.copy()
-            logger.info(f"Using all {len(eval_df)} samples for evaluation.")
+        self.run_id = run_id
+        self.checkpoint_path = None
+        self.predictions = []
+        if run_id is not None:
+            self.checkpoint_path, metadata_path = checkpoint_paths(self.output_dir, run_id)
+            if resume:
+                if not metadata_path.exists():
+                    raise FileNotFoundError(f"No checkpointed run {run_id} in {self.output_dir}")
+                metadata = load_run_metadata(metadata_path)
+                if metadata.get("model_name") != self.model_name:
+                    logger.warning(f"Run {run_id} was started with model {metadata.get('model_name')}, "
+                                   f"resuming with {self.model_name}")
+                # Evaluate the same sample the run was started with
+                sids = metadata["sids"]
+                logger.info(f"Resuming run {run_id} ({len(sids)} SIDs).")
+        
+        items = self.select_items(sample_limit, sids)
+        
+        if preprocess_workers > 0 and self.preprocess == "none":
+            # Uploading the original bytes leaves nothing for a process pool to do
+            logger.info("Not starting preprocessing workers: preprocess='none' uploads the original files.")
+            preprocess_workers = 0
+        
+        # Create the adaptive concurrency controller; the pools are sized for its upper bound
+        self.concurrency_controller = None
+        if adaptive_max_workers:
+            self.concurrency_controller = AdaptiveConcurrencyController(
+                initial_limit=max_workers,
+                max_limit=max(adaptive_max_workers, max_workers)
+            )
+            max_workers = self.concurrency_controller.max_limit
+            logger.info(f"Adaptive concurrency enabled: starting at {self.concurrency_controller.current_limit}, "
+                        f"up to {max_workers}")
         
         # Create a rate limiter
         rate_limiter = RateLimiter(
             max_calls_per_second=max_calls_per_second,
-            max_concurrent_requests=max_workers
+            max_concurrent_requests=max_workers,
+            max_calls_per_minute=max_calls_per_minute,
+            max_tokens_per_minute=max_tokens_per_minute,
+            tokens_per_request=tokens_per_request
         )
         
-        # Prepare items for processing
-        items = [(row['SID'], row) for _, row in eval_df.iterrows()]
+        if run_id is not None:
+            if not resume:
+                save_run_metadata(metadata_path, self.run_metadata(run_id, [item[0] for item in items]))
+            self.checkpoint = CheckpointWriter(self.checkpoint_path)
+            done = self.checkpoint.sids
+            if done:
+                items = [item for item in items if item[0] not in done]
+                logger.info(f"Skipping {len(done)} SIDs already in {self.checkpoint_path}.")
+            logger.info(f"Streaming results to checkpoint: {self.checkpoint_path}")
         total_items = len(items)
         
         logger.info(f"Processing {total_items} images with {max_workers} workers " 
                    f"and {max_calls_per_second} calls per second limit...")
         
-        # Prepare results storage
-        evaluation_results = []
-        failed_sids = []
-        
         # Create a progress bar for the entire process
         pbar = tqdm(total=total_items, desc="Processing images")
+        self.dead_letters = DeadLetterQueue()
+        
+        def run_items(run_items_list):
+            if engine == "async":
+                return self._run_async(run_items_list, pbar, max_workers, rate_limiter, preprocess_workers)
+            if preprocess_workers > 0:
+                logger.info(f"Preprocessing with {preprocess_workers} worker processes.")
+                return self._run_two_stage(
+                    run_items_list, rate_limiter, pbar, max_workers, preprocess_workers,
+                    queue_size or 2 * max_workers)
+            return self._run_thread_pool(run_items_list, rate_limiter, pbar, max_workers)
+        
+        try:
+            completed_sids, failed_sids = run_items(items)
+            
+            # Requeue SIDs that exhausted their retries on transient errors
+            for requeue_round in range(requeue_rounds):
+                requeue_sids = set(self.dead_letters.sids(self.retry_policies.keys()))
+                if not requeue_sids:
+                    break
+                requeue_items = [item for item in items if item[0] in requeue_sids]
+                logger.info(f"Requeueing {len(requeue_items)} dead-lettered SIDs (round {requeue_round + 1}).")
+                pbar.total += len(requeue_items)
+                pbar.refresh()
+                recovered, _ = run_items(requeue_items)
+                completed_sids.extend(recovered)
+                recovered = set(recovered)
+                failed_sids = [sid for sid in failed_sids if sid not in recovered]
+        finally:
+            pbar.close()
+            if self.checkpoint is not None:
+                self.checkpoint.close()
+                logger.info(f"Checkpoint {self.checkpoint_path} holds {len(self.checkpoint)} results.")
+                self.checkpoint = None
+        
+        # Log statistics
+        if engine != "async":
+            limiter_stats = rate_limiter.stats()
+            logger.info(f"Rate limiter: mean wait {limiter_stats['mean_wait_time']:.3f}s, "
+                        f"max wait {limiter_stats['max_wait_time']:.3f}s, "
+                        f"peak queue depth {limiter_stats['max_queue_depth']}")
+        if self.response_cache is not None:
+            cache_stats = self.response_cache.stats()
+            logger.info(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+        if self.concurrency_controller is not None:
+            summary = self.concurrency_controller.summary()
+            logger.info(f"Adaptive concurrency: final limit {summary['final_limit']}, "
+                        f"peak {summary['peak_limit']}, mean {summary['mean_limit']:.1f}, "
+                        f"{summary['throughput']:.2f} requests/s")
+            history_file = self.output_dir / f"concurrency_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            self.concurrency_controller.save_history(history_file)
+            logger.info(f"Concurrency limit history saved to: {history_file}")
+        success_count = len(completed_sids)
+        failure_count = len(failed_sids)
+        logger.info(f"Evaluation completed. Successfully processed {success_count} images.")
+        
+        if failure_count > 0:
+            logger.warning(f"Failed to process {failure_count} images.")
+            
+            # Log the first few failed SIDs as examples
+            if failed_sids:
+                logger.warning(f"Examples of failed SIDs: {failed_sids[:min(5, len(failed_sids))]}")
+                
+                # Save failed SIDs to a file for reference
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                failed_file = self.output_dir / f"failed_sids_{timestamp}.json"
+                with open(failed_file, 'w', encoding='utf-8') as f:
+                    json.dump(failed_sids, f)
+                logger.info(f"List of failed SIDs saved to: {failed_file}")
+                
+                if len(self.dead_letters) > 0:
+                    dead_letter_file = self.output_dir / f"dead_letter_{timestamp}.json"
+                    self.dead_letters.save(dead_letter_file)
+                    logger.info(f"Dead-lettered SIDs with their last errors saved to: {dead_letter_file}")
+    
+    def select_items(self, sample_limit=None, sids=None):
+        """
+        Select the samples to evaluate
+        
+        Args:
+            sample_limit (int, optional): Number of random samples
+            sids (list, optional): Evaluate exactly these SIDs instead of sampling
+            
+        Returns:
+            list: (sid, row) items
+        """
+        if sids is not None:
+            eval_df = self.labels_df[self.labels_df['SID'].isin(set(sids))].copy()
+            logger.info(f"Using {len(eval_df)} of {len(sids)} requested SIDs for evaluation.")
+        elif sample_limit is not None and sample_limit < len(self.labels_df):
+            sample_indices = np.random.choice(len(self.labels_df), sample_limit, replace=False)
+            eval_df = self.labels_df.iloc[sample_indices].copy()
+            logger.info(f"Using {sample_limit} random samples for evaluation.")
+        else:
+            eval_df = self.labels_df.copy()
+            logger.info(f"Using all {len(eval_df)} samples for evaluation.")
+        return [(row['SID'], row) for _, row in eval_df.iterrows()]
+    
+    def run_metadata(self, run_id, sids):
+        """
+        Return the settings of a run, stored next to its checkpoint
+        
+        Args:
+            run_id (str): Run identifier
+            sids (list): SIDs selected for the run
+            
+        Returns:
+            dict: JSON-serializable run metadata
+        """
+        return {
+            "run_id": run_id,
+            "model_name": self.model_name,
+            "roi": self.roi,
+            "profile": self.profile.to_dict() if self.profile is not None else None,
+            **self.preprocess_settings(),
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "sids": list(sids),
+        }
+    
+    def preprocess_settings(self):
+        """
+        Return the preprocessing settings that determine the uploaded images
+        
+        Recorded in the run metadata and in the metrics, so runs without a
+        checkpoint still identify their profile.
+        
+        Returns:
+            dict: preprocess (mode or profile name), profile_fingerprint, denoise_mode and jpeg_quality
+        """
+        return {
+            "preprocess": self.profile.name if self.profile is not None else self.preprocess,
+            "profile_fingerprint": self.profile.fingerprint if self.profile is not None else None,
+            "denoise_mode": PREPROCESS_CONFIG["denoise_mode"],
+            "jpeg_quality": PREPROCESS_CONFIG["jpeg_quality"],
+        }
+    
+    def record_result(self, result):
+        """
+        Store one result record, in the checkpoint if the run has one
+        
+        Called by the engines from their collecting thread or event loop.
+        
+        Args:
+            result (dict): Result record built by build_result
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.write(result)
+        else:
+            self.predictions.append(result)
+    
+    def iter_predictions(self):
+        """
+        Iterate over the result records of the last run
+        
+        Checkpointed runs are streamed from their JSONL file.
+        
+        Yields:
+            dict: Result records
+        """
+        if self.checkpoint_path is not None:
+            yield from read_checkpoint(self.checkpoint_path)
+        else:
+            yield from self.predictions
+    
+    def merge_predictions(self, previous_predictions):
+        """
+        Merge the current predictions into those of an earlier run
+        
+        Results of the current run replace earlier results for the same SID.
+        
+        Args:
+            previous_predictions (list): Result records of an earlier run
+        """
+        if self.checkpoint_path is not None:
+            # Append the earlier results that the checkpoint doesn't supersede
+            with CheckpointWriter(self.checkpoint_path) as writer:
+                current_count = len(writer)
+                for result in previous_predictions:
+                    if result["SID"] not in writer.sids:
+                        writer.write(result)
+                logger.info(f"Merged {current_count} new results into {len(previous_predictions)} "
+                            f"earlier results ({len(writer)} total).")
+            return
+        
+        merged = {result["SID"]: result for result in previous_predictions}
+        for result in self.predictions:
+            merged[result["SID"]] = result
+        logger.info(f"Merged {len(self.predictions)} new results into {len(previous_predictions)} "
+                    f"earlier results ({len(merged)} total).")
+        self.predictions = list(merged.values())
+    
+    def _run_thread_pool(self, items, rate_limiter, pbar, max_workers):
+        """
+        Preprocess and call the model for every item on a single thread pool
+        
+        Returns:
+            tuple: (completed_sids, failed_sids)
+        """
+        completed_sids = []
+        failed_sids = []
         
         # Process images using concurrent workers
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
@@ -457,34 +1000,153 @@ class TongueVisionTest:
                 try:
                     result = future.result()
                     if result is not None:
-                        evaluation_results.append(result)
+                        self.record_result(result)
+                        completed_sids.append(sid)
                     else:
                         failed_sids.append(sid)
                 except Exception as e:
                     logger.error(f"Task for SID {sid} generated an exception: {e}")
                     failed_sids.append(sid)
         
-        pbar.close()
+        return completed_sids, failed_sids
+    
+    def _run_two_stage(self, items, rate_limiter, pbar, max_workers, preprocess_workers, queue_size):
+        """
+        Preprocess on a process pool and call the model on a separate thread pool
         
-        # Log statistics
-        success_count = len(evaluation_results)
-        failure_count = len(failed_sids)
-        logger.info(f"Evaluation completed. Successfully processed {success_count} images.")
+        The producer keeps at most queue_size encodings in flight and blocks on the
+        bounded queue when the API stage falls behind, so memory stays bounded.
         
-        if failure_count > 0:
-            logger.warning(f"Failed to process {failure_count} images.")
-            
-            # Log the first few failed SIDs as examples
-            if failed_sids:
-                logger.warning(f"Examples of failed SIDs: {failed_sids[:min(5, len(failed_sids))]}")
-                
-                # Save failed SIDs to a file for reference
-                failed_file = self.output_dir / f"failed_sids_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                with open(failed_file, 'w', encoding='utf-8') as f:
-                    json.dump(failed_sids, f)
-                logger.info(f"List of failed SIDs saved to: {failed_file}")
+        Returns:
+            tuple: (completed_sids, failed_sids)
+        """
+        completed_sids = []
+        failed_sids = []
+        results_lock = Lock()
+        encoded_queue = queue.Queue(maxsize=queue_size)
+        sentinel = object()
+        
+        def produce(pool):
+            pending = collections.deque()
+            try:
+                for item in items:
+                    sid = item[0]
+                    if sid not in self.image_paths:
+                        encoded_queue.put((item, None))
+                        continue
+                    pending.append((item, pool.submit(_encode_worker, self.image_paths[sid])))
+                    # Keep the pool busy without encoding the whole dataset ahead of the API stage
+                    if len(pending) >= queue_size:
+                        self._enqueue_encoded(pending.popleft(), encoded_queue)
+                while pending:
+                    self._enqueue_encoded(pending.popleft(), encoded_queue)
+            finally:
+                for _ in range(max_workers):
+                    encoded_queue.put(sentinel)
+        
+        def consume():
+            while True:
+                entry = encoded_queue.get()
+                if entry is sentinel:
+                    return
+                item, base64_image = entry
+                try:
+                    result = self.process_image(item, rate_limiter, base64_image)
+                except Exception as e:
+                    logger.error(f"Task for SID {item[0]} generated an exception: {e}")
+                    result = None
+                with results_lock:
+                    if result is not None:
+                        self.record_result(result)
+                        completed_sids.append(item[0])
+                    else:
+                        failed_sids.append(item[0])
+                    pbar.update(1)
+        
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=preprocess_workers,
+                initializer=_init_encode_worker,
+                initargs=self._encode_worker_initargs()) as pool:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers + 1) as executor:
+                consumers = [executor.submit(consume) for _ in range(max_workers)]
+                producer = executor.submit(produce, pool)
+                producer.result()
+                for consumer in consumers:
+                    consumer.result()
+        
+        if self.image_cache is not None:
+            self.image_cache.evict()
+        
+        return completed_sids, failed_sids
+    
+    def _encode_worker_initargs(self):
+        """
+        Arguments of _init_encode_worker for the preprocessing pool
+        
+        The current PREPROCESS_CONFIG is passed along, since spawned workers
+        would otherwise run the module defaults.
+        
+        Returns:
+            tuple: (cache_dir, fingerprint, roi, preprocess, config)
+        """
+        if self.image_cache is not None:
+            cache_dir = self.image_cache.cache_dir
+            fingerprint = self.image_cache.fingerprint
+        else:
+            cache_dir = None
+            fingerprint = pipeline_fingerprint(roi=self.roi, profile=self.profile)
+        return (cache_dir, fingerprint, self.roi, self.preprocess, dict(PREPROCESS_CONFIG))
+    
+    def _run_async(self, items, pbar, max_in_flight, rate_limiter, preprocess_workers):
+        """
+        Run the API stage on an event loop with AsyncEvaluationEngine
+        
+        Returns:
+            tuple: (completed_sids, failed_sids)
+        """
+        logger.info(f"Using async engine with up to {max_in_flight} requests in flight.")
+        
+        if preprocess_workers > 0:
+            encode_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=preprocess_workers,
+                initializer=_init_encode_worker,
+                initargs=self._encode_worker_initargs())
+            encode_func = _encode_worker
+        else:
+            encode_executor = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+            encode_func = self.encode_image_to_base64
         
-        self.predictions = evaluation_results
+        with encode_executor:
+            engine = AsyncEvaluationEngine(
+                self,
+                max_in_flight=max_in_flight,
+                max_calls_per_second=rate_limiter.max_calls_per_second,
+                max_calls_per_minute=rate_limiter.max_calls_per_minute,
+                max_tokens_per_minute=rate_limiter.max_tokens_per_minute,
+                tokens_per_request=rate_limiter.tokens_per_request,
+                encode_executor=encode_executor,
+                encode_func=encode_func
+            )
+            results = engine.run(items, pbar)
+        
+        if self.image_cache is not None:
+            self.image_cache.evict()
+        
+        return results
+    
+    def _enqueue_encoded(self, pending_entry, encoded_queue):
+        """Wait for a preprocessing future and hand its payload to the API stage"""
+        item, future = pending_entry
+        try:
+            base64_image = future.result()
+        except BrokenProcessPool:
+            # A worker failed to start (e.g. its pipeline fingerprint differs from ours): fail the run
+            raise
+        except Exception as e:
+            # Let the API stage retry the encoding in-thread
+            logger.warning(f"Preprocessing failed for SID {item[0]}: {e}")
+            base64_image = None
+        encoded_queue.put((item, base64_image))
     
     def standardize_label(self, value):
         """
@@ -496,108 +1158,39 @@ class TongueVisionTest:
         Returns:
             str: Standardized label value
         """
-        # Convert to string for consistent comparison
-        if value is None:
-            return "NaN"  # Use "NaN" as the standard representation for null/None
-        
-        # Convert to string and handle other variations
-        value_str = str(value)
-        
-        # Handle various null-like representations
-        if value_str.lower() in ["nan", "none", "null"]:
-            return "NaN"
-            
-        return value_str
+        # "NaN" is the standard representation for null/None
+        return standardize_label(value)
     
     def calculate_metrics(self):
-        """Calculate evaluation metrics"""
+        """
+        Calculate evaluation metrics
+        
+        The results are read in a single streaming pass and kept only as
+        integer-coded ground truth and predictions (see metrics_engine), from
+        which every metric is derived with one bincount per indicator.
+        The encoded run is kept in self.encoded_results.
+        
+        Unless self.bootstrap_resamples is 0, percentile bootstrap confidence
+        intervals are added to the accuracies ("accuracy_ci") and macro F1
+        scores ("f1_macro_ci").
+        """
         logger.info("Calculating metrics...")
         
-        if not self.predictions:
+        encoded = EncodedResults.from_results(self.iter_predictions(), INDICATORS, self.standardize_label)
+        if len(encoded) == 0:
             logger.error("No predictions available. Run evaluation first.")
             return
         
-        # Prepare data for metric calculation
-        metrics = {}
-        indicators = ["coating_label", "tai_label", "zhi_label", "fissure_label", "tooth_mk_label"]
-        
-        for indicator in indicators:
-            y_true = []
-            y_pred = []
-            
-            for result in self.predictions:
-                ground_truth = result["ground_truth"][indicator]
-                prediction = result["predictions"][indicator]
-                
-                # Standardize both values for proper comparison
-                standardized_truth = self.standardize_label(ground_truth)
-                standardized_pred = self.standardize_label(prediction)
-                
-                # Add to lists for metrics calculation
-                y_true.append(standardized_truth)
-                y_pred.append(standardized_pred)
-            
-            if len(y_true) > 0:
-                try:
-                    # Calculate metrics with zero_division=0 to avoid warnings
-                    metrics[indicator] = {
-                        "accuracy": accuracy_score(y_true, y_pred),
-                        "sample_count": len(y_true),
-                        "detailed_report": classification_report(y_true, y_pred, output_dict=True, zero_division=0)
-                    }
-                    
-                    # Calculate these metrics with zero_division=0 to avoid warnings
-                    metrics[indicator]["precision_macro"] = precision_score(y_true, y_pred, average='macro', zero_division=0)
-                    metrics[indicator]["recall_macro"] = recall_score(y_true, y_pred, average='macro', zero_division=0)
-                    metrics[indicator]["f1_macro"] = f1_score(y_true, y_pred, average='macro', zero_division=0)
-                except Exception as e:
-                    logger.warning(f"Could not calculate metrics for {indicator}: {e}")
-                    metrics[indicator] = {
-                        "accuracy": None,
-                        "sample_count": len(y_true),
-                        "error": str(e)
-                    }
-            else:
-                metrics[indicator] = {
-                    "accuracy": None,
-                    "sample_count": 0,
-                    "note": "No valid predictions found"
-                }
-        
-        # Calculate overall accuracy (if all indicators are correct for a sample, it's counted as correct)
-        overall_correct = 0
-        overall_total = 0
-        
-        for result in self.predictions:
-            all_correct = True
-            
-            for indicator in indicators:
-                ground_truth = result["ground_truth"][indicator]
-                prediction = result["predictions"][indicator]
-                
-                # Standardize both values for proper comparison
-                standardized_truth = self.standardize_label(ground_truth)
-                standardized_pred = self.standardize_label(prediction)
-                
-                if standardized_truth != standardized_pred:
-                    all_correct = False
-                    break
-            
-            overall_total += 1
-            if all_correct:
-                overall_correct += 1
-        
-        if overall_total > 0:
-            metrics["overall"] = {
-                "accuracy": overall_correct / overall_total,
-                "sample_count": overall_total
-            }
-        else:
-            metrics["overall"] = {
-                "accuracy": None,
-                "sample_count": 0,
-                "note": "No valid samples found"
-            }
+        self.encoded_results = encoded
+        metrics = compute_metrics(encoded)
+        if self.bootstrap_resamples:
+            intervals = bootstrap_metrics(encoded, self.bootstrap_resamples, self.bootstrap_confidence,
+                                          self.bootstrap_workers)
+            for key, interval in intervals.items():
+                metrics[key].update(interval)
+            metrics["overall"]["bootstrap"] = {"resamples": self.bootstrap_resamples,
+                                               "confidence": self.bootstrap_confidence}
+        metrics["overall"]["preprocess"] = self.preprocess_settings()
         
         self.results = metrics
         logger.info("Metrics calculation completed.")
@@ -608,8 +1201,7 @@ class TongueVisionTest:
         
         # Save raw predictions
         predictions_file = self.output_dir / f"predictions_{timestamp}.json"
-        with open(predictions_file, 'w', encoding='utf-8') as f:
-            json.dump(self.predictions, f, ensure_ascii=False, indent=2)
+        write_json_array(self.iter_predictions(), predictions_file)
         logger.info(f"Predictions saved to: {predictions_file}")
         
         # Save metrics
@@ -624,27 +1216,41 @@ class TongueVisionTest:
             f.write("# Tongue Vision Model Baseline Test Report\n\n")
             f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
             
-            f.write("## Overall Performance\n\n")
             overall = self.results.get("overall", {})
+            preprocess = overall.get("preprocess")
+            if preprocess is not None:
+                f.write(f"Preprocessing: {preprocess['preprocess']}")
+                if preprocess["profile_fingerprint"] is not None:
+                    # The profile's own denoise stage applies, not denoise_mode
+                    f.write(f" (profile fingerprint {preprocess['profile_fingerprint']})")
+                else:
+                    f.write(f", denoise mode {preprocess['denoise_mode']}")
+                f.write(f", JPEG quality {preprocess['jpeg_quality']}\n\n")
+            
+            f.write("## Overall Performance\n\n")
             if overall.get("accuracy") is not None:
-                f.write(f"Overall Accuracy: {overall['accuracy']:.4f}\n")
+                f.write(f"Overall Accuracy: {overall['accuracy']:.4f}{format_interval(overall.get('accuracy_ci'))}\n")
                 f.write(f"Sample Count: {overall['sample_count']}\n\n")
+                if "bootstrap" in overall:
+                    f.write(f"Intervals are {overall['bootstrap']['confidence']:.0%} percentile bootstrap intervals "
+                            f"({overall['bootstrap']['resamples']} resamples).\n\n")
             else:
                 f.write("No valid samples found for overall accuracy calculation.\n\n")
             
             f.write("## Performance by Indicator\n\n")
-            for indicator in ["coating_label", "tai_label", "zhi_label", "fissure_label", "tooth_mk_label"]:
+            for indicator in INDICATORS:
                 metrics = self.results.get(indicator, {})
                 f.write(f"### {indicator}\n\n")
                 
                 if metrics.get("accuracy") is not None:
-                    f.write(f"Accuracy: {metrics['accuracy']:.4f}\n")
+                    f.write(f"Accuracy: {metrics['accuracy']:.4f}{format_interval(metrics.get('accuracy_ci'))}\n")
                     f.write(f"Sample Count: {metrics['sample_count']}\n")
                     
                     if "precision_macro" in metrics:
                         f.write(f"Precision (Macro): {metrics['precision_macro']:.4f}\n")
                         f.write(f"Recall (Macro): {metrics['recall_macro']:.4f}\n")
-                        f.write(f"F1 Score (Macro): {metrics['f1_macro']:.4f}\n")
+                        f.write(f"F1 Score (Macro): {metrics['f1_macro']:.4f}"
+                                f"{format_interval(metrics.get('f1_macro_ci'))}\n")
                     
                     f.write("\nDetailed Classification Report:\n\n")
                     f.write("| Class | Precision | Recall | F1 Score | Support |\n")
@@ -701,44 +1307,185 @@ def main():
     parser = argparse.ArgumentParser(description="Run tongue vision evaluation with concurrent API calls")
     parser.add_argument("--sample", type=int, default=10, 
                       help="Number of samples to process. Set to -1 for all samples.")
+    parser.add_argument("--engine", choices=["thread", "async"], default="thread",
+                      help="Evaluation engine: OS threads with the blocking client, or one event loop with the async client")
     parser.add_argument("--workers", type=int, default=5, 
-                      help="Maximum number of concurrent workers")
-    parser.add_argument("--rate", type=int, default=2, 
+                      help="Maximum number of concurrent API workers (requests in flight with --engine async)")
+    parser.add_argument("--preprocess-workers", type=int, default=0,
+                      help="Number of preprocessing processes (e.g. the CPU count). "
+                           "The default 0 preprocesses on the API workers.")
+    parser.add_argument("--queue-size", type=int, default=None,
+                      help="Capacity of the preprocessed image queue (default: 2 x workers)")
+    parser.add_argument("--rate", type=float, default=2, 
                       help="Maximum API calls per second")
+    parser.add_argument("--adaptive-max-workers", type=int, default=None,
+                      help="Enable adaptive (AIMD) concurrency starting at --workers and growing up to this limit")
+    parser.add_argument("--max-retries", type=int, default=None,
+                      help="Override the attempt count of every retry policy")
+    parser.add_argument("--requeue-rounds", type=int, default=1,
+                      help="Extra passes over dead-lettered SIDs with retryable errors")
+    parser.add_argument("--retry-failed", type=str, default=None,
+                      help="Reprocess only the SIDs in this failed_sids_*.json or dead_letter_*.json file")
+    parser.add_argument("--predictions", type=str, default=None,
+                      help="Predictions file (.json or checkpoint .jsonl) to merge --retry-failed results into "
+                           "(default: latest predictions_*.json in the output directory)")
+    parser.add_argument("--resume", type=str, default=None, metavar="RUN_ID",
+                      help="Resume the checkpointed run RUN_ID (run_<RUN_ID>.jsonl in the output directory), "
+                           "skipping SIDs it already completed")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                      help="Keep results in memory instead of streaming them to a JSONL checkpoint")
+    parser.add_argument("--rpm", type=int, default=None,
+                      help="Maximum API calls per minute")
+    parser.add_argument("--tpm", type=int, default=None,
+                      help="Maximum model tokens per minute")
+    parser.add_argument("--tokens-per-request", type=int, default=1000,
+                      help="Estimated tokens per request, charged against the --tpm budget")
     parser.add_argument("--model", type=str, default="qwen-vl-max", 
                       help="Model name to use")
+    parser.add_argument("--base-url", type=str, default=DEFAULT_BASE_URL,
+                      help="Base URL for the API calls")
     parser.add_argument("--output", type=str, default="out_put/baseline_results", 
                       help="Output directory for results")
+    parser.add_argument("--cache-dir", type=str, default=str(DEFAULT_CACHE_DIR),
+                      help="Directory of the preprocessed image cache")
+    parser.add_argument("--cache-size-mb", type=float, default=DEFAULT_MAX_SIZE_MB,
+                      help="Maximum size of the preprocessed image cache in megabytes")
+    parser.add_argument("--no-cache", action="store_true",
+                      help="Disable the preprocessed image cache")
+    parser.add_argument("--preprocess", type=str, default="full",
+                      help="\"full\" preprocesses images before upload, \"none\" sends the original JPEG bytes, "
+                           "any other value is a preprocessing profile name "
+                           f"({', '.join(registered_profiles())}) or a profile file (.json/.yaml/.py)")
+    parser.add_argument("--jpeg-quality", type=int, default=PREPROCESS_CONFIG["jpeg_quality"],
+                      help="JPEG quality (0-100) of preprocessed images; lower values shrink the payload")
+    parser.add_argument("--denoise-mode", choices=DENOISE_MODES, default=None,
+                      help="Denoiser backend of the preprocessing pipeline (see benchmark_denoise.py; "
+                           f"default: {PREPROCESS_CONFIG['denoise_mode']}); profiles set their own")
+    parser.add_argument("--roi-crop", action="store_true",
+                      help="Crop each image to the bounding box of its tongue mask before preprocessing")
+    parser.add_argument("--roi-margin", type=float, default=0.05,
+                      help="Margin around the mask bounding box, as a fraction of its size")
+    parser.add_argument("--max-edge", type=int, default=None,
+                      help="Downscale images so the longer edge is at most this many pixels")
+    parser.add_argument("--response-cache", type=str, default=str(DEFAULT_RESPONSE_CACHE),
+                      help="SQLite file caching model responses by endpoint, model, prompt, image and decoding parameters")
+    parser.add_argument("--no-response-cache", action="store_true",
+                      help="Disable the model response cache")
+    parser.add_argument("--replay-only", action="store_true",
+                      help="Answer every request from the response cache and never call the API; "
+                           "images without a cached response fail")
+    parser.add_argument("--bootstrap", type=int, default=DEFAULT_RESAMPLES,
+                      help="Bootstrap resamples for the confidence intervals of the metrics (0 disables them)")
+    parser.add_argument("--bootstrap-workers", type=int, default=None,
+                      help="Processes computing the bootstrap resamples")
     
     args = parser.parse_args()
     
-    # Check for environment variable
-    if "DASHCOPE_API_KEY" not in os.environ:
+    if args.replay_only and args.no_response_cache:
+        parser.error("--replay-only needs the response cache")
+    if args.preprocess == "none" and (args.roi_crop or args.max_edge):
+        parser.error("--roi-crop and --max-edge need preprocessing; they cannot be used with --preprocess none")
+    if not 0 <= args.jpeg_quality <= 100:
+        parser.error("--jpeg-quality must be between 0 and 100")
+    profile = None
+    if args.preprocess not in PREPROCESS_MODES:
+        try:
+            profile = get_profile(args.preprocess)
+        except (ValueError, OSError, ImportError) as e:
+            parser.error(str(e))
+        if args.denoise_mode is not None:
+            # The profile's own denoise stage would silently win
+            parser.error("--denoise-mode does not apply to preprocessing profiles; set the mode in the profile")
+    if args.denoise_mode is None:
+        args.denoise_mode = PREPROCESS_CONFIG["denoise_mode"]
+    
+    # Check for environment variable (not needed when replaying cached responses)
+    if "DASHCOPE_API_KEY" not in os.environ and not args.replay_only:
         logger.error("DASHCOPE_API_KEY environment variable not set.")
         logger.error("Please set the environment variable with your Alibaba Cloud Dashscope API key.")
         return
     
     try:
         # Create the tester instance with the specified model
-        tester = TongueVisionTest(output_dir=args.output, model_name=args.model)
+        # Set before the preprocess cache is opened so its fingerprint includes the mode
+        PREPROCESS_CONFIG["denoise_mode"] = args.denoise_mode
+        PREPROCESS_CONFIG["jpeg_quality"] = args.jpeg_quality
+        roi = roi_options(args.roi_crop, args.roi_margin, args.max_edge)
+        image_cache = None
+        if not args.no_cache and args.preprocess != "none":
+            image_cache = PreprocessCache(args.cache_dir, max_size_mb=args.cache_size_mb, roi=roi, profile=profile)
+        response_cache = None
+        if not args.no_response_cache:
+            response_cache = ResponseCache(args.response_cache, replay_only=args.replay_only)
+        tester = TongueVisionTest(output_dir=args.output, model_name=args.model, image_cache=image_cache,
+                                  base_url=args.base_url, response_cache=response_cache, roi=roi,
+                                  preprocess=profile or args.preprocess)
+        
+        if args.max_retries is not None and not args.replay_only:
+            tester.retry_policies = default_retry_policies(args.max_retries)
+        tester.bootstrap_resamples = args.bootstrap
+        tester.bootstrap_workers = args.bootstrap_workers
         
         # Determine sample limit
         sample_limit = None if args.sample < 0 else args.sample
         
+        # Load the SIDs and earlier predictions for --retry-failed
+        retry_sids = None
+        previous_predictions = None
+        if args.retry_failed:
+            retry_sids = load_failed_sids(args.retry_failed)
+            predictions_file = args.predictions
+            if predictions_file is None:
+                candidates = sorted(Path(args.output).glob("predictions_*.json"))
+                if not candidates:
+                    logger.error(f"No predictions_*.json found in {args.output}; pass --predictions.")
+                    return
+                predictions_file = candidates[-1]
+            if Path(predictions_file).suffix == ".jsonl":
+                previous_predictions = list(read_checkpoint(predictions_file))
+            else:
+                with open(predictions_file, 'r', encoding='utf-8') as f:
+                    previous_predictions = json.load(f)
+            logger.info(f"Retrying {len(retry_sids)} failed SIDs from {args.retry_failed}, "
+                        f"merging into {predictions_file}")
+        
+        # Every run streams to a checkpoint unless disabled; --resume reuses an existing one
+        run_id = None
+        if args.resume:
+            run_id = args.resume
+        elif not args.no_checkpoint:
+            run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        
         # Log the concurrency settings
         logger.info(f"Starting evaluation with settings:")
         logger.info(f"  Sample limit: {sample_limit if sample_limit is not None else 'All samples'}")
+        logger.info(f"  Engine: {args.engine}")
         logger.info(f"  Max workers: {args.workers}")
+        logger.info(f"  Preprocess workers: {args.preprocess_workers}")
         logger.info(f"  API rate limit: {args.rate} calls per second")
         logger.info(f"  Model: {args.model}")
+        logger.info(f"  Run ID: {run_id if run_id is not None else 'no checkpoint'}")
         
         # Run the evaluation with concurrent processing
         tester.load_data()
         tester.run_evaluation(
             sample_limit=sample_limit,
             max_workers=args.workers,
-            max_calls_per_second=args.rate
+            max_calls_per_second=args.rate,
+            preprocess_workers=args.preprocess_workers,
+            queue_size=args.queue_size,
+            engine=args.engine,
+            max_calls_per_minute=args.rpm,
+            max_tokens_per_minute=args.tpm,
+            tokens_per_request=args.tokens_per_request,
+            adaptive_max_workers=args.adaptive_max_workers,
+            sids=retry_sids,
+            requeue_rounds=args.requeue_rounds,
+            run_id=run_id,
+            resume=args.resume is not None
         )
+        if previous_predictions is not None:
+            tester.merge_predictions(previous_predictions)
         tester.calculate_metrics()
         output_files = tester.save_results()
         
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import argparse
+import logging
+from pathlib import Path
+from datetime import datetime
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from image_cache import read_sid_list
+from image_preprocessing import (PREPROCESS_CONFIG, DENOISE_MODES, FusedPreprocessor, denoise_image,
+                                 load_mask)
+from response_cache import ResponseCache, DEFAULT_RESPONSE_CACHE
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BENCHMARK_DIR = Path("out_put/benchmarks")
+# Backend every other mode is compared against
+REFERENCE_MODE = "nlm"
+
+def psnr(image, reference, mask=None):
+    """
+    Peak signal-to-noise ratio of an image against a reference
+
+    Args:
+        image (numpy.ndarray): Image to score
+        reference (numpy.ndarray): Reference image of the same shape
+        mask (numpy.ndarray, optional): Only score pixels where the mask is bright
+
+    Returns:
+        float: PSNR in dB (inf for identical images)
+    """
+    difference = image.astype(np.float64) - reference
+    if mask is not None:
+        difference = difference[mask > 127]
+    mse = float(np.mean(difference * difference)) if difference.size else 0.0
+    return float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+def measure_modes(image_paths, modes):
+    """
+    Time each denoiser and compare its pipeline output with the reference
+
+    The reference is the full pipeline with non-local means denoising. Every
+    image is decoded once and shared by all modes.
+
+    Args:
+        image_paths (list): Raw image paths
+        modes (list): Denoise modes to measure
+
+    Returns:
+        dict: Mode -> timing, fidelity and payload size summary
+    """
+    preprocessors = {mode: FusedPreprocessor(config={"denoise_mode": mode})
+                     for mode in set(modes) | {REFERENCE_MODE}}
+    strength = PREPROCESS_CONFIG["denoise_strength"]
+    samples = {mode: {"denoise": [], "pipeline": [], "psnr": [], "psnr_tongue": [], "jpeg_bytes": []}
+               for mode in modes}
+    # Denoise time of the reference mode, measured separately when it is not compared itself
+    reference_times = samples[REFERENCE_MODE]["denoise"] if REFERENCE_MODE in samples else []
+
+    for image_path in tqdm(image_paths, desc="Measuring denoisers"):
+        image = cv2.imread(str(image_path))
+        if image is None:
+            logger.warning(f"Could not read image: {image_path}")
+            continue
+        mask = load_mask(image_path, image.shape)
+        reference = preprocessors[REFERENCE_MODE].process(image, mask=mask)
+        if REFERENCE_MODE not in samples:
+            start = time.perf_counter()
+            denoise_image(image, strength, REFERENCE_MODE, mask)
+            reference_times.append(time.perf_counter() - start)
+
+        for mode in modes:
+            start = time.perf_counter()
+            denoise_image(image, strength, mode, mask)
+            samples[mode]["denoise"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            output = preprocessors[mode].process(image, mask=mask)
+            samples[mode]["pipeline"].append(time.perf_counter() - start)
+
+            samples[mode]["psnr"].append(min(psnr(output, reference), 100.0))
+            if mask is not None:
+                samples[mode]["psnr_tongue"].append(min(psnr(output, reference, mask), 100.0))
+            samples[mode]["jpeg_bytes"].append(len(cv2.imencode(".jpg", output)[1]))
+
+    reference_time = np.mean(reference_times) if reference_times else None
+    summary = {}
+    for mode, values in samples.items():
+        if not values["denoise"]:
+            continue
+        denoise_mean = float(np.mean(values["denoise"]))
+        summary[mode] = {
+            "images": len(values["denoise"]),
+            "denoise_ms_mean": denoise_mean * 1000,
+            "denoise_ms_p95": float(np.percentile(values["denoise"], 95)) * 1000,
+            "pipeline_ms_mean": float(np.mean(values["pipeline"])) * 1000,
+            "speedup": float(reference_time / denoise_mean) if reference_time else None,
+            # Capped at 100 dB, which the reference mode reaches against itself
+            "psnr_db": float(np.mean(values["psnr"])),
+            "psnr_tongue_db": float(np.mean(values["psnr_tongue"])) if values["psnr_tongue"] else None,
+            "jpeg_kb_mean": float(np.mean(values["jpeg_bytes"])) / 1024,
+        }
+    return summary
+
+def evaluate_modes(sids, modes, data_dir, output_dir, model_name, base_url, response_cache,
+                   workers, rate):
+    """
+    Run the model evaluation once per denoise mode
+
+    Args:
+        sids (list): SIDs to evaluate
+        modes (list): Denoise modes
+        data_dir (str): Path to the data directory
+        output_dir (Path): Directory for the per-mode results
+        model_name (str): Model name
+        base_url (str): Base URL of the OpenAI-compatible API
+        response_cache (ResponseCache, optional): Response cache; replay-only runs never call the API
+        workers (int): Concurrent API workers
+        rate (float): Calls-per-second limit
+
+    Returns:
+        dict: Mode -> overall and per-indicator accuracy
+    """
+    from baseline_test import TongueVisionTest
+
+    original_mode = PREPROCESS_CONFIG["denoise_mode"]
+    accuracy = {}
+    try:
+        for mode in modes:
+            PREPROCESS_CONFIG["denoise_mode"] = mode
+            logger.info(f"Evaluating denoise mode {mode} on {len(sids)} SIDs")
+            tester = TongueVisionTest(data_dir=data_dir, output_dir=output_dir / f"denoise_{mode}",
+                                      model_name=model_name, base_url=base_url,
+                                      response_cache=response_cache)
+            tester.load_data()
+            tester.run_evaluation(max_workers=workers, max_calls_per_second=rate, sids=sids)
+            tester.calculate_metrics()
+            if not tester.results:
+                continue
+            tester.save_results()
+            accuracy[mode] = {indicator: metrics.get("accuracy")
+                              for indicator, metrics in tester.results.items()}
+    finally:
+        PREPROCESS_CONFIG["denoise_mode"] = original_mode
+    return accuracy
+
+def print_table(summary, accuracy=None):
+    """Print the quality/speed table"""
+    accuracy = accuracy or {}
+    print(f"\n{'mode':>16} {'denoise ms':>11} {'speedup':>8} {'pipeline ms':>12} "
+          f"{'PSNR dB':>8} {'tongue dB':>10} {'JPEG KB':>8} {'accuracy':>9}")
+    for mode, row in summary.items():
+        overall = accuracy.get(mode, {}).get("overall")
+        print(f"{mode:>16} {row['denoise_ms_mean']:>11.1f} "
+              + (f"{row['speedup']:>7.1f}x" if row['speedup'] else f"{'n/a':>8}")
+              + f" {row['pipeline_ms_mean']:>12.1f} {row['psnr_db']:>8.2f} "
+              + (f"{row['psnr_tongue_db']:>10.2f}" if row['psnr_tongue_db'] is not None else f"{'n/a':>10}")
+              + f" {row['jpeg_kb_mean']:>8.1f} "
+              + (f"{overall:>9.3f}" if overall is not None else f"{'-':>9}"))
+
+def main():
+    """Build the quality/speed table of the denoiser backends"""
+    parser = argparse.ArgumentParser(description="Compare the speed and output quality of the denoiser backends")
+    parser.add_argument("--sids", type=str, default="data/test.txt",
+                      help="File listing the SIDs (default: the test split)")
+    parser.add_argument("--sample", type=int, default=None,
+                      help="Only use the first N SIDs")
+    parser.add_argument("--modes", nargs="+", choices=DENOISE_MODES, default=list(DENOISE_MODES),
+                      help="Denoise modes to compare")
+    parser.add_argument("--data-dir", type=str, default="data/TonguExpertDatabase",
+                      help="Path to the data directory")
+    parser.add_argument("--output", type=str, default=None,
+                      help="Result file (default: out_put/benchmarks/denoise_<timestamp>.json)")
+    parser.add_argument("--evaluate", action="store_true",
+                      help="Also run the model evaluation once per mode to measure label accuracy")
+    parser.add_argument("--replay-only", action="store_true",
+                      help="With --evaluate, answer from the response cache only")
+    parser.add_argument("--response-cache", type=str, default=str(DEFAULT_RESPONSE_CACHE),
+                      help="Response cache used with --evaluate")
+    parser.add_argument("--model", type=str, default="qwen-vl-max",
+                      help="Model name used with --evaluate")
+    parser.add_argument("--base-url", type=str, default=None,
+                      help="Base URL for the API calls (default: the baseline_test default)")
+    parser.add_argument("--workers", type=int, default=5,
+                      help="Concurrent API workers with --evaluate")
+    parser.add_argument("--rate", type=float, default=2,
+                      help="API calls per second with --evaluate")
+
+    args = parser.parse_args()
+
+    sids = read_sid_list(args.sids)
+    if args.sample is not None:
+        sids = sids[:args.sample]
+    images_dir = Path(args.data_dir) / "TongueImage" / "Raw"
+    image_paths = [images_dir / f"{sid}.jpg" for sid in sids]
+    image_paths = [path for path in image_paths if path.exists()]
+    if len(image_paths) < len(sids):
+        logger.warning(f"No image found for {len(sids) - len(image_paths)} SIDs")
+    logger.info(f"Measuring {len(args.modes)} denoise modes on {len(image_paths)} images")
+
+    result = {
+        "sids": args.sids,
+        "images": len(image_paths),
+        "reference_mode": REFERENCE_MODE,
+        "denoise_strength": PREPROCESS_CONFIG["denoise_strength"],
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "modes": measure_modes(image_paths, args.modes),
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+    }
+
+    accuracy = None
+    if args.evaluate:
+        if "DASHCOPE_API_KEY" not in os.environ and not args.replay_only:
+            logger.error("DASHCOPE_API_KEY environment variable not set; use --replay-only or set the key.")
+            return
+        from baseline_test import DEFAULT_BASE_URL
+        response_cache = ResponseCache(args.response_cache, replay_only=args.replay_only)
+        try:
+            accuracy = evaluate_modes([path.stem for path in image_paths], args.modes, args.data_dir,
+                                      DEFAULT_BENCHMARK_DIR, args.model, args.base_url or DEFAULT_BASE_URL,
+                                      response_cache, args.workers, args.rate)
+        finally:
+            response_cache.close()
+        result["accuracy"] = accuracy
+
+    output_file = Path(args.output) if args.output else \
+        DEFAULT_BENCHMARK_DIR / f"denoise_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output_file.parent.mkdir(exist_ok=True, parents=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    logger.info(f"Denoise benchmark saved to: {output_file}")
+
+    print_table(result["modes"], accuracy)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import logging
+from pathlib import Path
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from stage_timing import StageTimer, set_active_timer
+from image_cache import PreprocessCache, read_sid_list
+from image_preprocessing import PREPROCESS_CONFIG, roi_options
+from preprocess_profiles import get_profile
+from response_cache import ResponseCache, DEFAULT_RESPONSE_CACHE
+from mock_vision_server import MockVisionServer, LatencyModel
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BENCHMARK_DIR = Path("out_put/benchmarks")
+
+# Stages in pipeline order for the report
+STAGE_ORDER = ["cache_read", "imread", "roi", "preprocess", "encode", "response_cache",
+               "rate_limit_wait", "network", "parse"]
+
+# Metrics compared against the baseline: (path, higher_is_better)
+COMPARED_METRICS = [
+    (("images_per_second",), True),
+    (("peak_rss_mb",), False),
+]
+COMPARED_STAGE_STATS = ["p50", "p95", "p99"]
+# Stage latencies below this are timer noise and never flagged
+MIN_COMPARED_SECONDS = 0.001
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of this process
+
+    Returns:
+        float: Peak RSS in megabytes, or None where the resource module is unavailable
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def select_sids(labels_df, sid_file=None, sample=100):
+    """
+    Choose the fixed SID set of the benchmark
+
+    Args:
+        labels_df (pandas.DataFrame): Ground truth labels with a SID column
+        sid_file (str, optional): File listing the SIDs (see image_cache.read_sid_list)
+        sample (int): Number of SIDs taken in sorted order when no file is given
+
+    Returns:
+        list: SIDs
+    """
+    if sid_file is not None:
+        return read_sid_list(sid_file)
+    return sorted(labels_df['SID'].astype(str))[:sample]
+
+def run_benchmark(tester, sids, engine="thread", workers=8, rate=1000, adaptive_max_workers=None):
+    """
+    Evaluate a SID set and measure the pipeline
+
+    Preprocessing runs on the API workers (preprocess_workers=0) so every stage
+    is timed in this process.
+
+    Args:
+        tester (TongueVisionTest): Configured tester with data loaded
+        sids (list): SIDs to evaluate
+        engine (str): "thread" or "async"
+        workers (int): Concurrent workers / requests in flight
+        rate (float): Client-side calls-per-second limit
+        adaptive_max_workers (int, optional): Enables adaptive concurrency up to this limit
+
+    Returns:
+        dict: Throughput, peak RSS and per-stage latency statistics
+    """
+    timer = StageTimer()
+    set_active_timer(timer)
+    start = time.perf_counter()
+    try:
+        tester.run_evaluation(
+            max_workers=workers,
+            max_calls_per_second=rate,
+            preprocess_workers=0,
+            engine=engine,
+            adaptive_max_workers=adaptive_max_workers,
+            sids=sids,
+            requeue_rounds=0
+        )
+    finally:
+        set_active_timer(None)
+    elapsed = time.perf_counter() - start
+
+    completed = len(tester.predictions)
+    return {
+        "images": len(sids),
+        "completed": completed,
+        "failed": len(sids) - completed,
+        "elapsed": elapsed,
+        "images_per_second": completed / elapsed if elapsed > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": timer.summary(),
+    }
+
+def compare_with_baseline(result, baseline, tolerance=0.1):
+    """
+    Flag metrics that got worse than the baseline by more than a tolerance
+
+    Args:
+        result (dict): Benchmark result
+        baseline (dict): Stored benchmark result
+        tolerance (float): Allowed relative degradation
+
+    Returns:
+        list: One dict per compared metric with baseline, current, relative change and regression flag
+    """
+    comparisons = []
+
+    def compare(name, current, previous, higher_is_better):
+        if current is None or previous is None or previous == 0:
+            return
+        change = (current - previous) / previous
+        regression = change < -tolerance if higher_is_better else change > tolerance
+        comparisons.append({
+            "metric": name,
+            "baseline": previous,
+            "current": current,
+            "change": change,
+            "regression": regression,
+        })
+
+    for path, higher_is_better in COMPARED_METRICS:
+        current, previous = result, baseline
+        for key in path:
+            current = current.get(key) if isinstance(current, dict) else None
+            previous = previous.get(key) if isinstance(previous, dict) else None
+        compare(".".join(path), current, previous, higher_is_better)
+
+    for stage, stats in result["stages"].items():
+        baseline_stats = baseline.get("stages", {}).get(stage)
+        if baseline_stats is None:
+            continue
+        for stat in COMPARED_STAGE_STATS:
+            if max(stats[stat], baseline_stats[stat]) < MIN_COMPARED_SECONDS:
+                continue
+            compare(f"stages.{stage}.{stat}", stats[stat], baseline_stats[stat], False)
+
+    return comparisons
+
+def print_report(result, comparisons=None):
+    """Print the stage table and the baseline comparison"""
+    print(f"\n{result['completed']}/{result['images']} images in {result['elapsed']:.2f}s "
+          f"({result['images_per_second']:.2f} images/s), peak RSS "
+          + (f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else "n/a"))
+    print(f"{'stage':>16} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'total s':>9}")
+    stages = sorted(result["stages"], key=lambda s: STAGE_ORDER.index(s) if s in STAGE_ORDER else len(STAGE_ORDER))
+    for stage in stages:
+        stats = result["stages"][stage]
+        print(f"{stage:>16} {stats['count']:>7} {stats['p50'] * 1000:>9.2f} {stats['p95'] * 1000:>9.2f} "
+              f"{stats['p99'] * 1000:>9.2f} {stats['total']:>9.2f}")
+
+    if comparisons:
+        print(f"\n{'metric':>28} {'baseline':>10} {'current':>10} {'change':>8}")
+        for comparison in comparisons:
+            flag = "  REGRESSION" if comparison["regression"] else ""
+            print(f"{comparison['metric']:>28} {comparison['baseline']:>10.4g} {comparison['current']:>10.4g} "
+                  f"{comparison['change'] * 100:>+7.1f}%{flag}")
+
+def main():
+    """Benchmark the baseline pipeline on a fixed SID set"""
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the baseline pipeline with per-stage timing")
+    parser.add_argument("--backend", choices=["mock", "replay"], default="mock",
+                      help="Answer requests with the in-process mock server or by replaying the response cache")
+    parser.add_argument("--sids", type=str, default=None,
+                      help="File listing the SIDs to run (default: the first --sample SIDs in sorted order)")
+    parser.add_argument("--sample", type=int, default=100,
+                      help="Number of SIDs when --sids is not given")
+    parser.add_argument("--engine", choices=["thread", "async"], default="thread",
+                      help="Evaluation engine")
+    parser.add_argument("--workers", type=int, default=8,
+                      help="Concurrent workers (requests in flight with --engine async)")
+    parser.add_argument("--rate", type=float, default=1000,
+                      help="Client-side calls-per-second limit")
+    parser.add_argument("--adaptive-max-workers", type=int, default=None,
+                      help="Enable adaptive concurrency up to this limit")
+    parser.add_argument("--latency-dist", choices=LatencyModel.DISTRIBUTIONS, default="constant",
+                      help="Latency distribution of the mock server")
+    parser.add_argument("--latency-mean", type=float, default=0.2,
+                      help="Mean latency of the mock server in seconds")
+    parser.add_argument("--latency-std", type=float, default=0.0,
+                      help="Latency standard deviation of the mock server in seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                      help="Fraction of mock requests answered with 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                      help="Fraction of mock responses with malformed JSON")
+    parser.add_argument("--response-cache", type=str, default=str(DEFAULT_RESPONSE_CACHE),
+                      help="Response cache replayed by --backend replay")
+    parser.add_argument("--cache-dir", type=str, default=None,
+                      help="Use the preprocessed image cache in this directory (default: no cache)")
+    parser.add_argument("--preprocess", type=str, default="full",
+                      help="\"full\", \"none\" (send the original JPEG bytes) or a preprocessing profile name or file")
+    parser.add_argument("--jpeg-quality", type=int, default=PREPROCESS_CONFIG["jpeg_quality"],
+                      help="JPEG quality of preprocessed images")
+    parser.add_argument("--roi-crop", action="store_true",
+                      help="Crop images to the tongue mask before preprocessing")
+    parser.add_argument("--roi-margin", type=float, default=0.05,
+                      help="Margin around the mask bounding box, as a fraction of its size")
+    parser.add_argument("--max-edge", type=int, default=None,
+                      help="Downscale images so the longer edge is at most this many pixels")
+    parser.add_argument("--data-dir", type=str, default="data/TonguExpertDatabase",
+                      help="Path to the data directory")
+    parser.add_argument("--output", type=str, default=None,
+                      help="Result file (default: out_put/benchmarks/benchmark_<timestamp>.json)")
+    parser.add_argument("--baseline", type=str, default=None,
+                      help="Stored result to compare against; exits with status 1 on a regression")
+    parser.add_argument("--save-baseline", type=str, default=None,
+                      help="Also store this run's result as a baseline at this path")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                      help="Allowed relative degradation before a metric counts as a regression")
+
+    args = parser.parse_args()
+
+    # The mock and the replay backend never use a real key
+    os.environ.setdefault("DASHCOPE_API_KEY", "benchmark")
+    from baseline_test import TongueVisionTest
+
+    PREPROCESS_CONFIG["jpeg_quality"] = args.jpeg_quality
+    roi = roi_options(args.roi_crop, args.roi_margin, args.max_edge)
+    if args.preprocess == "none" and (roi is not None or args.cache_dir):
+        parser.error("--preprocess none cannot be combined with ROI options or --cache-dir")
+    profile = get_profile(args.preprocess) if args.preprocess not in ("none", "full") else None
+    image_cache = PreprocessCache(args.cache_dir, max_size_mb=None, roi=roi, profile=profile) \
+        if args.cache_dir else None
+    output_dir = DEFAULT_BENCHMARK_DIR
+    output_dir.mkdir(exist_ok=True, parents=True)
+
+    server = None
+    if args.backend == "mock":
+        server = MockVisionServer(
+            latency=LatencyModel(args.latency_dist, args.latency_mean, args.latency_std),
+            throttle_rate=args.throttle_rate,
+            malformed_rate=args.malformed_rate,
+            retry_after=0.1
+        ).start()
+        tester = TongueVisionTest(data_dir=args.data_dir, output_dir=output_dir, image_cache=image_cache,
+                                  base_url=server.base_url, roi=roi, preprocess=profile or args.preprocess)
+    else:
+        response_cache = ResponseCache(args.response_cache, replay_only=True)
+        tester = TongueVisionTest(data_dir=args.data_dir, output_dir=output_dir, image_cache=image_cache,
+                                  response_cache=response_cache, roi=roi, preprocess=profile or args.preprocess)
+
+    try:
+        tester.load_data()
+        sids = select_sids(tester.labels_df, args.sids, args.sample)
+        logger.info(f"Benchmarking {len(sids)} SIDs against the {args.backend} backend")
+        result = run_benchmark(tester, sids, args.engine, args.workers, args.rate, args.adaptive_max_workers)
+    finally:
+        if server is not None:
+            server.stop()
+
+    result["config"] = {key: value for key, value in vars(args).items()
+                        if key not in ("output", "baseline", "save_baseline")}
+    result["environment"] = {
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+    }
+    result["timestamp"] = datetime.now().isoformat(timespec='seconds')
+
+    comparisons = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("config", {}).get("backend") != args.backend:
+            logger.warning("Baseline was recorded against a different backend; comparison may be meaningless")
+        comparisons = compare_with_baseline(result, baseline, args.tolerance)
+        result["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "metrics": comparisons}
+
+    output_file = Path(args.output) if args.output else \
+        output_dir / f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output_file.parent.mkdir(exist_ok=True, parents=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    logger.info(f"Benchmark result saved to: {output_file}")
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        logger.info(f"Baseline saved to: {args.save_baseline}")
+
+    print_report(result, comparisons)
+
+    if comparisons and any(comparison["regression"] for comparison in comparisons):
+        logger.error("Performance regression against the baseline")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
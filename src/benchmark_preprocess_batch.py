@@ -0,0 +1,86 @@
+import time
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from image_cache import read_sid_list
+from image_preprocessing import (PREPROCESS_CONFIG, DENOISE_MODES, load_and_preprocess_image,
+                                 load_and_preprocess_batch, roi_options)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+def time_per_image(image_paths, roi=None):
+    """
+    Preprocess images one at a time with load_and_preprocess_image
+
+    Returns:
+        tuple: (outputs, seconds)
+    """
+    start = time.perf_counter()
+    outputs = [load_and_preprocess_image(path, roi=roi) for path in image_paths]
+    return outputs, time.perf_counter() - start
+
+def time_batched(image_paths, batch_size, workers=None, roi=None):
+    """
+    Preprocess images in batches with load_and_preprocess_batch
+
+    Returns:
+        tuple: (outputs, seconds)
+    """
+    start = time.perf_counter()
+    outputs = []
+    for offset in range(0, len(image_paths), batch_size):
+        outputs.extend(load_and_preprocess_batch(image_paths[offset:offset + batch_size], roi=roi, workers=workers))
+    return outputs, time.perf_counter() - start
+
+def max_difference(outputs, reference):
+    """Largest pixel difference between two lists of images"""
+    differences = [int(np.abs(output.astype(np.int16) - expected).max())
+                   for output, expected in zip(outputs, reference)
+                   if output is not None and expected is not None]
+    return max(differences) if differences else 0
+
+def main():
+    """Compare the throughput of the batch and the per-image preprocessing paths"""
+    parser = argparse.ArgumentParser(description="Throughput of load_and_preprocess_batch against the per-image path")
+    parser.add_argument("--sids", type=str, default="data/test.txt",
+                      help="File listing the SIDs (default: the test split)")
+    parser.add_argument("--sample", type=int, default=64,
+                      help="Number of images")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32],
+                      help="Batch sizes to measure")
+    parser.add_argument("--workers", type=int, default=None,
+                      help="Decoding threads per batch")
+    parser.add_argument("--denoise-mode", choices=DENOISE_MODES, default=PREPROCESS_CONFIG["denoise_mode"],
+                      help="Denoiser backend")
+    parser.add_argument("--max-edge", type=int, default=None,
+                      help="Downscale images so the longer edge is at most this many pixels")
+    parser.add_argument("--data-dir", type=str, default="data/TonguExpertDatabase",
+                      help="Path to the data directory")
+
+    args = parser.parse_args()
+
+    PREPROCESS_CONFIG["denoise_mode"] = args.denoise_mode
+    roi = roi_options(max_edge=args.max_edge)
+    images_dir = Path(args.data_dir) / "TongueImage" / "Raw"
+    image_paths = [images_dir / f"{sid}.jpg" for sid in read_sid_list(args.sids)[:args.sample]]
+    logger.info(f"Preprocessing {len(image_paths)} images with denoise mode {args.denoise_mode}")
+
+    reference, seconds = time_per_image(image_paths, roi)
+    print(f"\n{'path':>12} {'seconds':>9} {'images/s':>9} {'speedup':>8} {'max diff':>9}")
+    print(f"{'per-image':>12} {seconds:>9.2f} {len(image_paths) / seconds:>9.2f} {1.0:>7.2f}x {0:>9}")
+    for batch_size in args.batch_sizes:
+        outputs, batch_seconds = time_batched(image_paths, batch_size, args.workers, roi)
+        print(f"{f'batch {batch_size}':>12} {batch_seconds:>9.2f} {len(image_paths) / batch_seconds:>9.2f} "
+              f"{seconds / batch_seconds:>7.2f}x {max_difference(outputs, reference):>9}")
+
+if __name__ == "__main__":
+    main()
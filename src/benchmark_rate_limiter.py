@@ -0,0 +1,115 @@
+import time
+import bisect
+import argparse
+import logging
+import threading
+import concurrent.futures
+
+from rate_limiter import RateLimiter
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+def max_calls_in_window(timestamps, period):
+    """
+    Return the largest number of calls that started within any window of `period` seconds
+
+    Args:
+        timestamps (list): Sorted call start times in seconds
+        period (float): Window length in seconds
+
+    Returns:
+        int: Peak call count over all windows
+    """
+    peak = 0
+    for start, timestamp in enumerate(timestamps):
+        peak = max(peak, bisect.bisect_left(timestamps, timestamp + period, lo=start) - start)
+    return peak
+
+def run_trial(workers, calls, latency, max_calls_per_second, max_calls_per_minute=None, max_tokens_per_minute=None):
+    """
+    Push a fixed number of simulated API calls through a RateLimiter
+
+    Args:
+        workers (int): Number of worker threads (also the concurrency limit)
+        calls (int): Number of simulated calls
+        latency (float): Simulated request latency in seconds
+        max_calls_per_second (float): Requests-per-second budget
+        max_calls_per_minute (float, optional): Requests-per-minute budget
+        max_tokens_per_minute (float, optional): Tokens-per-minute budget
+
+    Returns:
+        dict: Throughput, peak calls in any 1 s and 60 s window, and limiter counters for the trial
+    """
+    rate_limiter = RateLimiter(
+        max_calls_per_second=max_calls_per_second,
+        max_concurrent_requests=workers,
+        max_calls_per_minute=max_calls_per_minute,
+        max_tokens_per_minute=max_tokens_per_minute
+    )
+
+    acquired_at = []
+    acquired_lock = threading.Lock()
+
+    def simulated_call(_):
+        admitted = rate_limiter.acquire()
+        with acquired_lock:
+            acquired_at.append(admitted)
+        try:
+            time.sleep(latency)
+        finally:
+            rate_limiter.release()
+
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(simulated_call, range(calls)))
+    elapsed = time.monotonic() - start
+
+    stats = rate_limiter.stats()
+    stats["workers"] = workers
+    stats["elapsed"] = elapsed
+    stats["throughput"] = calls / elapsed
+    acquired_at.sort()
+    stats["max_calls_per_second_window"] = max_calls_in_window(acquired_at, 1.0)
+    stats["max_calls_per_minute_window"] = max_calls_in_window(acquired_at, 60.0)
+    return stats
+
+def main():
+    """Measure how limiter throughput scales with the number of workers"""
+    parser = argparse.ArgumentParser(description="Microbenchmark of RateLimiter throughput against worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64],
+                      help="Worker counts to test")
+    parser.add_argument("--calls", type=int, default=200,
+                      help="Simulated calls per trial")
+    parser.add_argument("--latency", type=float, default=0.05,
+                      help="Simulated request latency in seconds")
+    parser.add_argument("--rate", type=float, default=1000,
+                      help="Requests-per-second budget")
+    parser.add_argument("--rpm", type=float, default=None,
+                      help="Requests-per-minute budget")
+    parser.add_argument("--tpm", type=float, default=None,
+                      help="Tokens-per-minute budget")
+
+    args = parser.parse_args()
+
+    logger.info(f"{args.calls} calls per trial, {args.latency * 1000:.0f} ms latency, {args.rate} calls/s budget")
+    # Peak calls seen in any window, to check against the budgets rather than an ideal rate
+    print(f"{'workers':>8} {'calls/s':>10} {'max in 1s':>10} {'max in 60s':>10} "
+          f"{'mean wait':>10} {'max wait':>10} {'max queue':>10}")
+    for workers in args.workers:
+        stats = run_trial(workers, args.calls, args.latency, args.rate, args.rpm, args.tpm)
+        print(f"{workers:>8} {stats['throughput']:>10.1f} {stats['max_calls_per_second_window']:>10} "
+              f"{stats['max_calls_per_minute_window']:>10} "
+              f"{stats['mean_wait_time'] * 1000:>8.1f}ms {stats['max_wait_time'] * 1000:>8.1f}ms "
+              f"{stats['max_queue_depth']:>10}")
+        if stats['max_calls_per_second_window'] > args.rate or (
+                args.rpm and stats['max_calls_per_minute_window'] > args.rpm):
+            logger.warning(f"{workers} workers: a window exceeded the budget")
+
+if __name__ == "__main__":
+    main()
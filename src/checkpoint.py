@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+def checkpoint_paths(output_dir, run_id):
+    """
+    Return the checkpoint and metadata file paths of a run
+
+    Args:
+        output_dir (str or Path): Output directory of the evaluation
+        run_id (str): Run identifier
+
+    Returns:
+        tuple: (checkpoint_path, metadata_path)
+    """
+    output_dir = Path(output_dir)
+    return output_dir / f"run_{run_id}.jsonl", output_dir / f"run_{run_id}.meta.json"
+
+def save_run_metadata(path, metadata):
+    """
+    Write the metadata of a run atomically
+
+    Args:
+        path (str or Path): Metadata file path
+        metadata (dict): Run settings, including the selected SIDs
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def load_run_metadata(path):
+    """
+    Read the metadata of a run
+
+    Args:
+        path (str or Path): Metadata file path
+
+    Returns:
+        dict: Run settings
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def read_checkpoint(path):
+    """
+    Stream the result records of a checkpoint file
+
+    A partially written last line (e.g. after a crash) is skipped.
+
+    Args:
+        path (str or Path): Checkpoint file path
+
+    Yields:
+        dict: One result record per line
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable line {line_number} of {path}")
+
+def completed_sids(path):
+    """
+    Return the SIDs that already have a result in a checkpoint file
+
+    Args:
+        path (str or Path): Checkpoint file path
+
+    Returns:
+        set: SIDs
+    """
+    if not Path(path).exists():
+        return set()
+    return {record["SID"] for record in read_checkpoint(path)}
+
+def truncate_partial_line(path):
+    """
+    Cut a checkpoint file back to its last complete line
+
+    Appending after a torn write would otherwise glue the next record onto it.
+
+    Args:
+        path (str or Path): Checkpoint file path
+    """
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        # Scan backwards in blocks for the last newline
+        position = size
+        while position > 0:
+            block_start = max(0, position - 65536)
+            f.seek(block_start)
+            block = f.read(position - block_start)
+            index = block.rfind(b"\n")
+            if index >= 0:
+                end = block_start + index + 1
+                break
+            position = block_start
+        else:
+            end = 0
+        if end < size:
+            logger.warning(f"Discarding {size - end} bytes of a partially written record in {path}")
+            f.truncate(end)
+
+def write_json_array(records, path):
+    """
+    Write result records as a JSON array without holding them all in memory
+
+    The output matches json.dump(list(records), f, ensure_ascii=False, indent=2).
+
+    Args:
+        records (iterable): Result records
+        path (str or Path): Output file path
+
+    Returns:
+        int: Number of records written
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[")
+        for record in records:
+            body = json.dumps(record, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            f.write(("," if count else "") + "\n  " + body)
+            count += 1
+        f.write("\n]" if count else "]")
+    return count
+
+class CheckpointWriter:
+    """Thread-safe append-only JSONL writer for evaluation results"""
+
+    def __init__(self, path, fsync_every=20, fsync_interval=5.0):
+        """
+        Open a checkpoint file for appending
+
+        Every record is flushed to the OS as soon as it is written; the file is
+        fsynced after fsync_every records or fsync_interval seconds, whichever
+        comes first, and on close.
+
+        Args:
+            path (str or Path): Checkpoint file path
+            fsync_every (int): Records written between fsyncs
+            fsync_interval (float): Maximum seconds between fsyncs
+        """
+        self.path = Path(path)
+        if self.path.exists():
+            truncate_partial_line(self.path)
+        self.sids = completed_sids(self.path)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.lock = Lock()
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def write(self, record):
+        """
+        Append one result record
+
+        Args:
+            record (dict): Result record with a SID key
+        """
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.sids.add(record["SID"])
+            self.unsynced += 1
+            if (self.unsynced >= self.fsync_every
+                    or time.monotonic() - self.last_sync >= self.fsync_interval):
+                self._sync()
+
+    def _sync(self):
+        """Force written records to disk; the caller holds the lock"""
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sids)
+
+    def close(self):
+        """Fsync and close the file"""
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.flush()
+            self._sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,351 @@
+import time
+import logging
+import warnings
+import concurrent.futures
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from phenotype_cache import phenotype_chunks, read_phenotype_chunk, DEFAULT_CHUNK_ROWS, DEFAULT_PHENOTYPE_CACHE
+
+logger = logging.getLogger(__name__)
+
+# Centroids kept per column by QuantileSketch; the rank error is about 1/capacity
+QUANTILE_CAPACITY = 1000
+
+# Distinct labels kept per column by LabelSketch; counts are exact up to this many
+LABEL_CAPACITY = 1000
+
+class MomentSketch:
+    """
+    Count, mean, variance, min and max of several columns, updated chunk by chunk
+
+    Chunks are combined with the parallel form of Welford's algorithm (Chan et
+    al.), so sketches of different chunks can be merged in any order.
+    """
+
+    def __init__(self, width):
+        """
+        Args:
+            width (int): Number of columns
+        """
+        self.count = np.zeros(width)
+        self.mean = np.zeros(width)
+        self.m2 = np.zeros(width)
+        self.min = np.full(width, np.inf)
+        self.max = np.full(width, -np.inf)
+
+    def update(self, matrix):
+        """
+        Add a chunk of rows; NaNs are skipped
+
+        Args:
+            matrix (numpy.ndarray): rows x width values
+        """
+        values = np.asarray(matrix, dtype=np.float64)
+        present = ~np.isnan(values)
+        other = MomentSketch(values.shape[1])
+        other.count = present.sum(axis=0).astype(np.float64)
+        seen = other.count > 0
+        filled = np.where(present, values, 0.0)
+        other.mean[seen] = filled[:, seen].sum(axis=0) / other.count[seen]
+        other.m2 = np.where(present, (values - other.mean) ** 2, 0.0).sum(axis=0)
+        other.min = np.where(present, values, np.inf).min(axis=0, initial=np.inf)
+        other.max = np.where(present, values, -np.inf).max(axis=0, initial=-np.inf)
+        self.merge(other)
+
+    def merge(self, other):
+        """Combine with the sketch of other rows"""
+        count = self.count + other.count
+        seen = count > 0
+        delta = other.mean - self.mean
+        weight = np.divide(other.count, count, out=np.zeros_like(count), where=seen)
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * weight
+        self.count = count
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        return self
+
+    def std(self):
+        """Sample standard deviation (ddof=1), NaN below two values"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch of one column
+
+    A t-digest with uniform centroid sizes: values are kept exactly until
+    there are more than 2 x capacity of them, then sorted and collapsed into
+    capacity centroids of equal weight. Quantiles interpolate linearly between
+    centroid centres like numpy.percentile, and are exact while nothing has
+    been collapsed.
+    """
+
+    def __init__(self, capacity=QUANTILE_CAPACITY):
+        """
+        Args:
+            capacity (int): Centroids kept after a compression
+        """
+        self.capacity = capacity
+        self.values = np.empty(0)
+        self.weights = np.empty(0)
+        self.exact = True
+
+    def update(self, values):
+        """Add values; NaNs are skipped"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) > 2 * self.capacity:
+            # Large chunk: collapse it on its own first, which needs no weights
+            values = np.sort(values)
+            bounds = np.arange(self.capacity) * len(values) // self.capacity
+            self._add(np.add.reduceat(values, bounds) / np.diff(bounds, append=len(values)),
+                      np.diff(bounds, append=len(values)).astype(np.float64))
+            self.exact = False
+        else:
+            self._add(values, np.ones(len(values)))
+
+    def merge(self, other):
+        """Combine with the sketch of other rows"""
+        self.exact = self.exact and other.exact
+        self._add(other.values, other.weights)
+        return self
+
+    def _add(self, values, weights):
+        self.values = np.concatenate([self.values, values])
+        self.weights = np.concatenate([self.weights, weights])
+        if len(self.values) > 2 * self.capacity:
+            self._compress()
+
+    def _compress(self):
+        order = np.argsort(self.values)
+        values, weights = self.values[order], self.weights[order]
+        # Bucket of each value by the weight before it, capacity buckets in all
+        before = np.cumsum(weights) - weights
+        buckets = np.minimum((before * self.capacity / weights.sum()).astype(np.int64), self.capacity - 1)
+        totals = np.bincount(buckets, weights, minlength=self.capacity)
+        sums = np.bincount(buckets, weights * values, minlength=self.capacity)
+        kept = totals > 0
+        self.values = sums[kept] / totals[kept]
+        self.weights = totals[kept]
+        self.exact = False
+
+    def quantiles(self, qs, minimum=None, maximum=None):
+        """
+        Estimate quantiles
+
+        Args:
+            qs (list): Quantiles in [0, 1]
+            minimum (float, optional): Exact minimum, pinned to rank 0
+            maximum (float, optional): Exact maximum, pinned to the last rank
+
+        Returns:
+            numpy.ndarray: One value per quantile (NaN if the sketch is empty)
+        """
+        if not len(self.values):
+            return np.full(len(qs), np.nan)
+        if self.exact:
+            return np.percentile(self.values, np.asarray(qs) * 100)
+        order = np.argsort(self.values)
+        values, weights = self.values[order], self.weights[order]
+        # Centroid i covers ranks [before_i, before_i + weight_i - 1]; its mean sits at the centre
+        centres = np.cumsum(weights) - weights + (weights - 1) / 2
+        last = weights.sum() - 1
+        if minimum is not None:
+            centres, values = np.concatenate([[0.0], centres]), np.concatenate([[minimum], values])
+        if maximum is not None:
+            centres, values = np.concatenate([centres, [last]]), np.concatenate([values, [maximum]])
+        return np.interp(np.asarray(qs) * last, centres, values)
+
+class LabelSketch:
+    """
+    Mergeable label counts of one column (Misra-Gries summary)
+
+    Counts are exact while a column has at most capacity distinct labels;
+    beyond that the most frequent labels are kept and their counts are lower
+    bounds that are short by at most total / (capacity + 1).
+    """
+
+    def __init__(self, capacity=LABEL_CAPACITY):
+        """
+        Args:
+            capacity (int): Distinct labels kept
+        """
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.int64)
+        self.total = 0
+        self.exact = True
+
+    def update(self, series):
+        """Add the non-missing labels of a column chunk"""
+        counts = series.dropna().astype(str).value_counts()
+        self._add(counts, int(counts.sum()))
+
+    def merge(self, other):
+        """Combine with the sketch of other rows"""
+        self.exact = self.exact and other.exact
+        self._add(other.counts, other.total)
+        return self
+
+    def _add(self, counts, total):
+        self.total += total
+        if not len(counts):
+            return
+        self.counts = self.counts.add(counts, fill_value=0).astype(np.int64)
+        if len(self.counts) > self.capacity:
+            ordered = self.counts.sort_values(ascending=False)
+            ordered = ordered.iloc[:self.capacity] - ordered.iloc[self.capacity]
+            self.counts = ordered[ordered > 0]
+            self.exact = False
+
+class TableSketch:
+    """
+    Sketches of every column of a table, producing the statistics of table_stats
+
+    Numeric columns get moments and a quantile sketch, label columns a label
+    sketch. A column is classified by the values it actually has, so label
+    columns that parse as numeric in a chunk with no labels (all NA) are
+    handled; a column with numbers in one chunk and text in another is an error.
+    """
+
+    def __init__(self, columns, quantile_capacity=QUANTILE_CAPACITY, label_capacity=LABEL_CAPACITY):
+        """
+        Args:
+            columns (list): Table columns, SID included
+            quantile_capacity (int): See QuantileSketch
+            label_capacity (int): See LabelSketch
+        """
+        self.columns = [column for column in columns if column != "SID"]
+        self.rows = 0
+        self.moments = MomentSketch(len(self.columns))
+        self.quantiles = [QuantileSketch(quantile_capacity) for _ in self.columns]
+        self.labels = [LabelSketch(label_capacity) for _ in self.columns]
+
+    def update(self, df):
+        """Add a chunk of rows"""
+        self.rows += len(df)
+        numeric = np.full((len(df), len(self.columns)), np.nan)
+        for position, column in enumerate(self.columns):
+            series = df[column]
+            if pd.api.types.is_numeric_dtype(series):
+                numeric[:, position] = series.to_numpy(dtype=np.float64, na_value=np.nan)
+                self.quantiles[position].update(numeric[:, position])
+            else:
+                self.labels[position].update(series)
+        self.moments.update(numeric)
+        return self
+
+    def merge(self, other):
+        """Combine with the sketch of other rows of the same table"""
+        self.rows += other.rows
+        self.moments.merge(other.moments)
+        for mine, theirs in zip(self.quantiles, other.quantiles):
+            mine.merge(theirs)
+        for mine, theirs in zip(self.labels, other.labels):
+            mine.merge(theirs)
+        return self
+
+    def stats(self):
+        """
+        Statistics in the format of column_stats.table_stats
+
+        Returns:
+            dict: {"rows", "numeric": {"columns", "summary"}, "labels": {column: histogram},
+                "method": "sketch", "exact": bool}
+        """
+        numeric, labels = [], []
+        for position, column in enumerate(self.columns):
+            has_numbers = self.moments.count[position] > 0
+            has_labels = self.labels[position].total > 0
+            if has_numbers and has_labels:
+                raise ValueError(f"Column {column} has numbers in some chunks and text in others")
+            # Columns without any value get both, like table_stats
+            if not has_labels:
+                numeric.append(position)
+            if not has_numbers:
+                labels.append(position)
+
+        count = self.moments.count[numeric]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            empty = count == 0
+            mean = np.where(empty, np.nan, self.moments.mean[numeric])
+            minimum = np.where(empty, np.nan, self.moments.min[numeric])
+            maximum = np.where(empty, np.nan, self.moments.max[numeric])
+        quartiles = np.array([self.quantiles[position].quantiles([0.25, 0.5, 0.75], low, high)
+                              for position, low, high in zip(numeric, minimum, maximum)]).reshape(-1, 3).T
+        # Rows of column_stats.SUMMARY_ROWS
+        summary = np.vstack([count, mean, self.moments.std()[numeric], minimum, quartiles, maximum])
+
+        histograms = {}
+        for position in labels:
+            sketch = self.labels[position]
+            entries = [(label, int(count)) for label, count in sketch.counts.items()]
+            entries.append((None, self.rows - sketch.total))
+            entries = [entry for entry in entries if entry[1] > 0]
+            histograms[self.columns[position]] = [list(entry) for entry in
+                                                  sorted(entries, key=lambda entry: -entry[1])]
+
+        exact = all(self.quantiles[position].exact for position in numeric) and \
+            all(self.labels[position].exact for position in labels)
+        return {
+            "rows": self.rows,
+            "numeric": {
+                "columns": [self.columns[position] for position in numeric],
+                "summary": [[None if np.isnan(value) else float(value) for value in row] for row in summary],
+            },
+            "labels": histograms,
+            "method": "sketch",
+            "exact": exact,
+        }
+
+def _sketch_chunk(chunk):
+    """Worker entry point: sketch one chunk"""
+    return TableSketch(chunk["columns"]).update(read_phenotype_chunk(chunk))
+
+def stream_table_stats(path, chunk_rows=DEFAULT_CHUNK_ROWS, cache_dir=DEFAULT_PHENOTYPE_CACHE, executor=None,
+                       in_flight=4):
+    """
+    Column statistics of a table computed chunk by chunk with bounded memory
+
+    Each chunk is read and sketched on its own and the sketches are merged as
+    they finish, so at most in_flight chunks are held in memory at once.
+    Counts, means, standard deviations, minima and maxima are exact up to
+    floating point; quartiles are exact for columns with at most
+    2 x QUANTILE_CAPACITY values and approximate (rank error about
+    1/QUANTILE_CAPACITY) above that.
+
+    Args:
+        path (str or Path): Phenotypes TSV
+        chunk_rows (int): Rows per chunk
+        cache_dir (str or Path, optional): Phenotype table cache; a valid entry is read instead of the TSV
+        executor (concurrent.futures.Executor, optional): Pool sketching chunks in parallel
+        in_flight (int): Chunks submitted to the executor at a time (e.g. two per worker)
+
+    Returns:
+        dict: Statistics in the format of column_stats.table_stats
+    """
+    start = time.perf_counter()
+    chunks = phenotype_chunks(path, chunk_rows, cache_dir)
+    sketch = TableSketch(chunks[0]["columns"] if chunks else ["SID"])
+    if executor is None:
+        for chunk in chunks:
+            sketch.merge(_sketch_chunk(chunk))
+    else:
+        pending = set()
+        for chunk in chunks:
+            if len(pending) >= in_flight:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    sketch.merge(future.result())
+            pending.add(executor.submit(_sketch_chunk, chunk))
+        for future in concurrent.futures.as_completed(pending):
+            sketch.merge(future.result())
+
+    stats = sketch.stats()
+    stats["seconds"] = time.perf_counter() - start
+    logger.debug(f"Sketched {Path(path).name} in {len(chunks)} chunks ({stats['seconds'] * 1000:.0f} ms)")
+    return stats
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import logging
+import warnings
+import concurrent.futures
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from phenotype_cache import load_phenotype_table, source_signature, DEFAULT_PHENOTYPE_CACHE
+from column_sketches import stream_table_stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATS_CACHE = Path("data/analysis_cache/column_stats.json")
+
+# Bump when the statistics change; older entries are recomputed
+STATS_VERSION = 1
+
+# Rows of the describe()-style summary
+SUMMARY_ROWS = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+
+def numeric_summary(matrix):
+    """
+    describe()-style statistics of every column of a matrix in one vectorized pass
+
+    NaNs are skipped. The moments are computed in float64; quantiles use
+    linear interpolation like DataFrame.describe.
+
+    Args:
+        matrix (numpy.ndarray): rows x columns values
+
+    Returns:
+        numpy.ndarray: len(SUMMARY_ROWS) x columns statistics (NaN for empty columns)
+    """
+    values = np.asarray(matrix, dtype=np.float64)
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        # All-NaN columns warn and yield NaN, which is what describe() reports
+        warnings.simplefilter("ignore", RuntimeWarning)
+        count = np.count_nonzero(~np.isnan(values), axis=0).astype(np.float64)
+        mean = np.nanmean(values, axis=0)
+        std = np.nanstd(values, axis=0, ddof=1)
+        minimum = np.nanmin(values, axis=0) if len(values) else np.full(values.shape[1], np.nan)
+        maximum = np.nanmax(values, axis=0) if len(values) else np.full(values.shape[1], np.nan)
+        quantiles = np.nanpercentile(values, [25, 50, 75], axis=0) if len(values) else \
+            np.full((3, values.shape[1]), np.nan)
+    return np.vstack([count, mean, std, minimum, quantiles, maximum])
+
+def label_histogram(series):
+    """
+    Counts of each label, most frequent first, NaN included
+
+    Args:
+        series (pandas.Series): Label column
+
+    Returns:
+        list: [label, count] pairs; the label of missing values is None
+    """
+    counts = series.value_counts(dropna=False)
+    return [[None if pd.isna(label) else str(label), int(count)] for label, count in counts.items()]
+
+def table_stats(df):
+    """
+    Column statistics of a table
+
+    Args:
+        df (pandas.DataFrame): Table with a SID column
+
+    Returns:
+        dict: {"rows", "numeric": {"columns", "summary"}, "labels": {column: histogram},
+            "method": "exact"}
+    """
+    columns = [column for column in df.columns if column != "SID"]
+    numeric = [column for column in columns if pd.api.types.is_numeric_dtype(df[column])]
+    # Label columns with no value at all parse as numeric; they get a histogram too
+    labels = [column for column in columns if column not in numeric or df[column].isna().all()]
+    summary = numeric_summary(df[numeric].to_numpy(dtype=np.float64)) if numeric else np.empty((len(SUMMARY_ROWS), 0))
+    return {
+        "rows": len(df),
+        "numeric": {
+            "columns": numeric,
+            # None for NaN, so the file stays valid JSON
+            "summary": [[None if np.isnan(value) else float(value) for value in row] for row in summary],
+        },
+        "labels": {column: label_histogram(df[column]) for column in labels},
+        "method": "exact",
+    }
+
+def _compute_table_stats(path, cache_dir):
+    """Worker entry point: load a table and compute its statistics"""
+    start = time.perf_counter()
+    stats = table_stats(load_phenotype_table(path, cache_dir))
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+def describe_frame(stats):
+    """
+    Rebuild the DataFrame.describe() output of a table from its statistics
+
+    Args:
+        stats (dict): Statistics from table_stats
+
+    Returns:
+        pandas.DataFrame: SUMMARY_ROWS x numeric columns
+    """
+    summary = np.array(stats["numeric"]["summary"], dtype=np.float64).reshape(len(SUMMARY_ROWS), -1)
+    return pd.DataFrame(summary, index=SUMMARY_ROWS, columns=stats["numeric"]["columns"])
+
+def label_counts(stats, column):
+    """
+    Rebuild value_counts(dropna=False) of a label column from its statistics
+
+    Args:
+        stats (dict): Statistics from table_stats
+        column (str): Label column
+
+    Returns:
+        pandas.Series: Counts indexed by label (NaN for missing values)
+    """
+    histogram = stats["labels"][column]
+    index = pd.Index([np.nan if label is None else label for label, _ in histogram], name=column)
+    return pd.Series([count for _, count in histogram], index=index, name="count")
+
+class ColumnStatsCache:
+    """Per-table column statistics persisted in a JSON file, keyed by source hash"""
+
+    def __init__(self, path=DEFAULT_STATS_CACHE):
+        """
+        Load the cache
+
+        Args:
+            path (str or Path, optional): JSON file; None keeps the statistics in memory only
+        """
+        self.path = Path(path) if path is not None else None
+        self.entries = {}
+        if self.path is not None and self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable column statistics cache {self.path}: {e}")
+
+    def lookup(self, path):
+        """
+        Return the cached statistics of a source table if its contents are unchanged
+
+        Args:
+            path (Path): Source table
+
+        Returns:
+            tuple: (stats or None, current source signature)
+        """
+        entry = self.entries.get(str(Path(path).resolve()))
+        previous = entry["source"] if entry is not None and entry.get("version") == STATS_VERSION else None
+        signature = source_signature(path, previous)
+        if previous is not None and signature["sha256"] == previous["sha256"]:
+            return entry["stats"], signature
+        return None, signature
+
+    def store(self, path, signature, stats):
+        """Record the statistics of a source table"""
+        self.entries[str(Path(path).resolve())] = {"version": STATS_VERSION, "source": signature, "stats": stats}
+
+    def save(self):
+        """Write the cache atomically"""
+        if self.path is None:
+            return
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+def compute_column_stats(paths, stats_cache=None, cache_dir=DEFAULT_PHENOTYPE_CACHE, workers=None,
+                         chunk_rows=None):
+    """
+    Column statistics of several tables, recomputing only changed ones
+
+    By default each table is loaded whole and its statistics are exact. With
+    chunk_rows the tables are streamed in chunks through mergeable sketches
+    (see column_sketches.stream_table_stats), which bounds memory by the
+    chunk size; the workers then sketch chunks rather than whole tables in
+    parallel. Cached exact statistics are reused in streaming mode, but
+    sketched ones are recomputed when exact statistics are asked for.
+
+    Args:
+        paths (list): Source tables
+        stats_cache (ColumnStatsCache, optional): Cache of earlier results
+        cache_dir (str or Path, optional): Phenotype table cache used to load tables
+        workers (int, optional): Processes computing tables in parallel; None or 1 computes
+            in this process
+        chunk_rows (int, optional): Stream the tables in chunks of this many rows
+
+    Returns:
+        dict: Table name (file stem) -> statistics
+    """
+    stats_cache = stats_cache if stats_cache is not None else ColumnStatsCache(None)
+    results = {}
+    pending = {}
+    for path in paths:
+        path = Path(path)
+        stats, signature = stats_cache.lookup(path)
+        if stats is not None and (chunk_rows is not None or stats.get("method", "exact") == "exact"):
+            results[path.stem] = stats
+        else:
+            pending[path] = signature
+
+    if pending:
+        start = time.perf_counter()
+        if chunk_rows is not None:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) \
+                if workers and workers > 1 else None
+            try:
+                computed = {path: stream_table_stats(path, chunk_rows, cache_dir, executor, 2 * (workers or 1))
+                            for path in pending}
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+        elif workers and workers > 1 and len(pending) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+                computed = dict(zip(pending, executor.map(_compute_table_stats, pending,
+                                                          [cache_dir] * len(pending))))
+        else:
+            computed = {path: _compute_table_stats(path, cache_dir) for path in pending}
+        for path, stats in computed.items():
+            stats_cache.store(path, pending[path], stats)
+            results[path.stem] = stats
+        stats_cache.save()
+        logger.info(f"Computed column statistics of {len(pending)} tables "
+                    f"({(time.perf_counter() - start) * 1000:.0f} ms), {len(paths) - len(pending)} cached")
+
+    return {Path(path).stem: results[Path(path).stem] for path in paths}
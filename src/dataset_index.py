@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import collections.abc
+from pathlib import Path
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIR = Path("data/dataset_index")
+
+# Bump when the manifest layout changes; older manifests are rebuilt
+MANIFEST_VERSION = 2
+
+class SidPaths(collections.abc.Mapping):
+    """Read-only SID -> Path mapping that builds each Path on access"""
+
+    def __init__(self, images_dir, names):
+        """
+        Args:
+            images_dir (Path): Directory of the files
+            names (dict): SID -> file name
+        """
+        self.images_dir = images_dir
+        self.names = names
+
+    def __getitem__(self, sid):
+        return self.images_dir / self.names[sid]
+
+    def __contains__(self, sid):
+        return sid in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+class DatasetIndex:
+    """
+    SID -> file index of an image directory, persisted as a manifest
+
+    The directory is listed once with os.scandir and the file names, sizes and
+    modification times are stored in a JSON manifest. Later runs load the
+    manifest as long as the directory's own mtime is unchanged, which covers
+    files being added, removed or renamed; files rewritten in place keep the
+    old size and mtime until refresh() is called. Presence queries are
+    vectorized pandas operations on the SID column.
+    """
+
+    def __init__(self, images_dir, index_dir=DEFAULT_INDEX_DIR, persist=True):
+        """
+        Load the manifest of a directory, scanning it if the manifest is missing or stale
+
+        Args:
+            images_dir (str or Path): Directory of image files named <SID>.<ext>
+            index_dir (str or Path): Directory holding the manifests
+            persist (bool): Write the manifest after a scan
+        """
+        self.images_dir = Path(images_dir)
+        self.persist = persist
+        key = hashlib.sha256(str(self.images_dir.resolve()).encode('utf-8')).hexdigest()[:16]
+        self.manifest_path = Path(index_dir) / f"{self.images_dir.name}_{key}.json"
+        self.files = None
+
+        if not self._load():
+            self.refresh()
+
+    def _load(self):
+        """Load the manifest if it matches the directory; returns True on success"""
+        if not self.manifest_path.exists():
+            return False
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_VERSION or \
+                    manifest.get("dir_mtime_ns") != os.stat(self.images_dir).st_mtime_ns:
+                return False
+            self.files = self._frame(manifest["files"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable dataset manifest {self.manifest_path}: {e}")
+            return False
+        logger.info(f"Loaded dataset index of {len(self.files)} files from {self.manifest_path}")
+        return True
+
+    @staticmethod
+    def _frame(columns):
+        """Build the file table, indexed by SID, from manifest columns"""
+        files = pd.DataFrame(columns, columns=["sid", "name", "size", "mtime_ns"])
+        return files.set_index("sid", drop=False)
+
+    def refresh(self):
+        """Rescan the directory and rewrite the manifest"""
+        start = time.perf_counter()
+        dir_mtime_ns = os.stat(self.images_dir).st_mtime_ns
+        sids, names, sizes, mtimes = [], [], [], []
+        with os.scandir(self.images_dir) as entries:
+            for entry in entries:
+                # Hidden files and subdirectories are not images
+                if entry.name.startswith(".") or "." not in entry.name or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                sids.append(entry.name.rsplit(".", 1)[0])
+                names.append(entry.name)
+                sizes.append(stat.st_size)
+                mtimes.append(stat.st_mtime_ns)
+        columns = {"sid": sids, "name": names, "size": sizes, "mtime_ns": mtimes}
+        self.files = self._frame(columns)
+        logger.info(f"Scanned {len(names)} files in {self.images_dir} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+
+        duplicates = self.files.index.duplicated(keep="last")
+        if duplicates.any():
+            logger.warning(f"{int(duplicates.sum())} SIDs have several files in {self.images_dir}; using one of each")
+
+        if self.persist:
+            self.manifest_path.parent.mkdir(exist_ok=True, parents=True)
+            tmp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": MANIFEST_VERSION, "directory": str(self.images_dir.resolve()),
+                           "dir_mtime_ns": dir_mtime_ns, "files": columns}, f)
+            os.replace(tmp_path, self.manifest_path)
+        return self
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, sid):
+        return sid in self.files.index
+
+    def paths(self):
+        """
+        Return the SID -> image path mapping
+
+        Returns:
+            SidPaths: Mapping of SID -> Path; of several files with the same SID the
+                last one listed wins
+        """
+        return SidPaths(self.images_dir, dict(zip(self.files["sid"].tolist(), self.files["name"].tolist())))
+
+    def present(self, sids, suffix=None):
+        """
+        Vectorized presence check
+
+        Args:
+            sids (iterable or pandas.Series): SIDs to check
+            suffix (str, optional): Only count files with this extension (e.g. ".jpg")
+
+        Returns:
+            numpy.ndarray: Boolean mask aligned with sids
+        """
+        sids = pd.Series(sids, dtype=object).astype(str)
+        if suffix is None:
+            return sids.isin(self.files.index).to_numpy()
+        return (sids + suffix).isin(self.files["name"]).to_numpy()
+
+    def missing(self, sids, suffix=None):
+        """
+        Return the SIDs without an image file, in input order
+
+        Args:
+            sids (iterable or pandas.Series): SIDs to check
+            suffix (str, optional): Only count files with this extension (e.g. ".jpg")
+
+        Returns:
+            list: Missing SIDs
+        """
+        sids = pd.Series(sids, dtype=object)
+        return sids[~self.present(sids, suffix)].tolist()
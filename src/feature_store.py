@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from phenotype_cache import load_phenotype_table, DEFAULT_PHENOTYPE_CACHE
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_FEATURE_STORE = Path("data/feature_store")
+
+# Feature tables of the Phenotypes directory: P<region><kind>_<Region>_<Kind>.txt
+FEATURE_TABLE_PATTERN = "P[0-9][0-9]_*.txt"
+
+# Bump when the store layout changes; older stores are rebuilt
+STORE_VERSION = 1
+
+def feature_tables(phenotypes_dir):
+    """
+    List the feature tables of a Phenotypes directory
+
+    Args:
+        phenotypes_dir (str or Path): Phenotypes directory
+
+    Returns:
+        list: Paths of the P1x-P5x tables, sorted by name
+    """
+    return sorted(Path(phenotypes_dir).glob(FEATURE_TABLE_PATTERN))
+
+def _source_stats(paths):
+    """Name, size and mtime of each source table"""
+    stats = []
+    for path in paths:
+        stat = os.stat(path)
+        stats.append({"table": path.stem, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+    return stats
+
+def build_feature_store(phenotypes_dir, store_dir=DEFAULT_FEATURE_STORE, cache_dir=DEFAULT_PHENOTYPE_CACHE):
+    """
+    Join every feature table on SID into one float32 matrix and save it
+
+    Rows are the sorted union of the tables' SIDs; a SID missing from a table
+    gets NaN in its columns. Column names are the source column names, with
+    the table prefix appended (e.g. tai_div_zhi_P32) where a name occurs in
+    several tables.
+
+    Args:
+        phenotypes_dir (str or Path): Phenotypes directory
+        store_dir (str or Path): Output directory
+        cache_dir (str or Path, optional): Phenotype table cache used to read the tables
+
+    Returns:
+        FeatureStore: The new store
+    """
+    start = time.perf_counter()
+    paths = feature_tables(phenotypes_dir)
+    if not paths:
+        raise FileNotFoundError(f"No feature tables ({FEATURE_TABLE_PATTERN}) in {phenotypes_dir}")
+    tables = {path.stem: load_phenotype_table(path, cache_dir) for path in paths}
+
+    sids = pd.Index(sorted(set().union(*(table["SID"] for table in tables.values()))))
+    counts = pd.Series([column for table in tables.values() for column in table.columns[1:]]).value_counts()
+    schema = []
+    for name, table in tables.items():
+        prefix = name.split("_", 1)[0]
+        for column in table.columns[1:]:
+            schema.append({
+                "name": column if counts[column] == 1 else f"{column}_{prefix}",
+                "table": name,
+                "source_column": column,
+            })
+
+    store_dir = Path(store_dir)
+    store_dir.mkdir(exist_ok=True, parents=True)
+    # Row-major, so the features of one SID are contiguous
+    tmp_path = store_dir / "features.tmp.npy"
+    matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(sids), len(schema)))
+    matrix[:] = np.nan
+    offset = 0
+    for name, table in tables.items():
+        width = table.shape[1] - 1
+        rows = sids.get_indexer(table["SID"])
+        matrix[rows, offset:offset + width] = table.iloc[:, 1:].to_numpy(dtype=np.float32)
+        offset += width
+    matrix.flush()
+    del matrix
+    os.replace(tmp_path, store_dir / "features.npy")
+    np.save(store_dir / "sids.npy", sids.to_numpy(dtype=str))
+
+    # The schema is written last and marks the store as complete
+    with open(store_dir / "schema.json.tmp", 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": STORE_VERSION,
+            "phenotypes_dir": str(Path(phenotypes_dir).resolve()),
+            "rows": len(sids),
+            "columns": schema,
+            "sources": _source_stats(paths),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }, f, ensure_ascii=False, indent=2)
+    os.replace(store_dir / "schema.json.tmp", store_dir / "schema.json")
+    logger.info(f"Built feature store {store_dir}: {len(sids)} SIDs x {len(schema)} features from "
+                f"{len(paths)} tables ({(time.perf_counter() - start) * 1000:.0f} ms)")
+    return FeatureStore(store_dir)
+
+def open_feature_store(phenotypes_dir, store_dir=DEFAULT_FEATURE_STORE, cache_dir=DEFAULT_PHENOTYPE_CACHE,
+                       rebuild=False):
+    """
+    Open the feature store, building it first if it is missing or out of date
+
+    The store is out of date when the set of feature tables or the size or
+    mtime of any of them changed since it was built.
+
+    Args:
+        phenotypes_dir (str or Path): Phenotypes directory
+        store_dir (str or Path): Store directory
+        cache_dir (str or Path, optional): Phenotype table cache used for rebuilding
+        rebuild (bool): Rebuild even if the store is current
+
+    Returns:
+        FeatureStore: The store
+    """
+    schema_path = Path(store_dir) / "schema.json"
+    if not rebuild and schema_path.exists():
+        try:
+            with open(schema_path, 'r', encoding='utf-8') as f:
+                schema = json.load(f)
+            if schema.get("version") == STORE_VERSION and \
+                    schema["sources"] == _source_stats(feature_tables(phenotypes_dir)):
+                return FeatureStore(store_dir, schema)
+            logger.info(f"Feature store {store_dir} is out of date, rebuilding")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Rebuilding unreadable feature store {store_dir}: {e}")
+    return build_feature_store(phenotypes_dir, store_dir, cache_dir)
+
+class FeatureStore:
+    """
+    Read-only, memory-mapped SID x feature matrix
+
+    Row and column lookups return views of the mapped file, so slicing
+    features copies nothing until the values are used.
+    """
+
+    def __init__(self, store_dir=DEFAULT_FEATURE_STORE, schema=None):
+        """
+        Open a store written by build_feature_store
+
+        Args:
+            store_dir (str or Path): Store directory
+            schema (dict, optional): Parsed schema.json, if already loaded
+        """
+        self.store_dir = Path(store_dir)
+        if schema is None:
+            with open(self.store_dir / "schema.json", 'r', encoding='utf-8') as f:
+                schema = json.load(f)
+        self.schema = schema
+        self.matrix = np.load(self.store_dir / "features.npy", mmap_mode='r')
+        self.sids = np.load(self.store_dir / "sids.npy")
+        if self.matrix.shape != (len(self.sids), len(schema["columns"])):
+            raise ValueError(f"Feature store {self.store_dir} does not match its schema")
+        self.row_index = pd.Index(self.sids)
+        self.column_names = [column["name"] for column in schema["columns"]]
+        self.column_index = pd.Index(self.column_names)
+
+        # Contiguous column range of each source table
+        self.table_slices = {}
+        for position, column in enumerate(schema["columns"]):
+            first, _ = self.table_slices.get(column["table"], (position, position))
+            self.table_slices[column["table"]] = (first, position + 1)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def tables(self):
+        """Return the names of the source tables"""
+        return list(self.table_slices)
+
+    def rows_of(self, sids):
+        """
+        Row numbers of SIDs
+
+        Args:
+            sids (iterable): SIDs
+
+        Returns:
+            numpy.ndarray: Row numbers, -1 for SIDs not in the store
+        """
+        return self.row_index.get_indexer(pd.Index(sids, dtype=object))
+
+    def row(self, sid):
+        """Return the feature vector of one SID (a view)"""
+        return self.matrix[self.row_index.get_loc(sid)]
+
+    def table(self, name):
+        """Return the columns of one source table (a view)"""
+        first, last = self.table_slices[name]
+        return self.matrix[:, first:last]
+
+    def columns(self, names):
+        """
+        Return the given columns
+
+        A run of adjacent columns is a view; any other selection is a copy.
+
+        Args:
+            names (list): Column names
+
+        Returns:
+            numpy.ndarray: rows x len(names) matrix
+        """
+        positions = self.column_index.get_indexer(names)
+        if (positions < 0).any():
+            raise KeyError(f"Unknown feature columns: {[n for n, p in zip(names, positions) if p < 0]}")
+        if len(positions) and (np.diff(positions) == 1).all():
+            return self.matrix[:, positions[0]:positions[-1] + 1]
+        return self.matrix[:, positions]
+
+    def frame(self, table=None, sids=None):
+        """
+        Return features as a DataFrame with a SID column
+
+        Args:
+            table (str, optional): Only the columns of this source table, under their
+                source names
+            sids (iterable, optional): Only these SIDs, in this order
+
+        Returns:
+            pandas.DataFrame: The features
+        """
+        columns = self.schema["columns"]
+        matrix = self.matrix
+        if table is not None:
+            first, last = self.table_slices[table]
+            matrix = matrix[:, first:last]
+            names = [column["source_column"] for column in columns[first:last]]
+        else:
+            names = self.column_names
+        row_sids = self.sids
+        if sids is not None:
+            rows = self.rows_of(sids)
+            if (rows < 0).any():
+                raise KeyError(f"{int((rows < 0).sum())} SIDs are not in the feature store")
+            matrix = matrix[rows]
+            row_sids = self.sids[rows]
+        df = pd.DataFrame(matrix, columns=names, copy=False)
+        df.insert(0, "SID", row_sids.astype(object))
+        return df
+
+def main():
+    """Build or inspect the feature store"""
+    parser = argparse.ArgumentParser(description="Join the Phenotypes feature tables into a memory-mapped matrix")
+    parser.add_argument("--data-dir", type=str, default="data/TonguExpertDatabase",
+                      help="Path to the data directory")
+    parser.add_argument("--store-dir", type=str, default=str(DEFAULT_FEATURE_STORE),
+                      help="Directory of the feature store")
+    parser.add_argument("--rebuild", action="store_true",
+                      help="Rebuild even if the store is up to date")
+
+    args = parser.parse_args()
+
+    store = open_feature_store(Path(args.data_dir) / "Phenotypes", args.store_dir, rebuild=args.rebuild)
+    print(f"{store.shape[0]} SIDs x {store.shape[1]} features in {store.store_dir}")
+    for name in store.tables():
+        first, last = store.table_slices[name]
+        print(f"  {name:>24}: columns {first}-{last - 1}")
+
+if __name__ == "__main__":
+    main()
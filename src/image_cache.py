@@ -0,0 +1,463 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import argparse
+import logging
+import concurrent.futures
+from pathlib import Path
+from threading import Lock
+
+import cv2
+import pandas as pd
+from tqdm import tqdm
+
+import image_preprocessing
+from image_preprocessing import PREPROCESS_CONFIG, DENOISE_MODES, load_and_preprocess_image, roi_options
+from preprocess_profiles import get_profile, restore_profile
+from stage_timing import timed
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path("data/preprocess_cache")
+DEFAULT_MAX_SIZE_MB = 2048
+
+def pipeline_fingerprint(config=None, roi=None, profile=None):
+    """
+    Compute a fingerprint of the preprocessing pipeline
+
+    The fingerprint covers the pipeline parameters, the source of the
+    image_preprocessing module and the OpenCV version, so any change that could
+    alter the produced pixels also changes the cache key.
+
+    Args:
+        config (dict, optional): Pipeline parameters (default: PREPROCESS_CONFIG)
+        roi (dict, optional): Region-of-interest options from image_preprocessing.roi_options
+        profile (PreprocessProfile, optional): Profile run instead of the default chain;
+            its fingerprint covers the stages and parameters, not custom stage code
+
+    Returns:
+        str: Hex digest identifying the pipeline
+    """
+    if config is None:
+        config = PREPROCESS_CONFIG
+    if roi is not None:
+        config = dict(config, roi=roi)
+    if profile is not None:
+        config = dict(config, profile=profile.fingerprint)
+
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps(config, sort_keys=True, default=str).encode('utf-8'))
+    with open(image_preprocessing.__file__, 'rb') as f:
+        hasher.update(f.read())
+    hasher.update(cv2.__version__.encode('utf-8'))
+    return hasher.hexdigest()[:16]
+
+def apply_worker_config(config, fingerprint, roi=None, profile=None):
+    """
+    Install the parent's PREPROCESS_CONFIG and profile stages in a worker process
+
+    Workers started with spawn re-import image_preprocessing and would otherwise
+    preprocess with the module defaults, writing the result under the parent's
+    fingerprint, and would miss the stages registered at runtime. The fingerprint
+    of the installed pipeline is checked against the parent's so such a mismatch
+    fails the run instead of poisoning the cache.
+
+    Args:
+        config (dict): Snapshot of the parent's PREPROCESS_CONFIG
+        fingerprint (str): Pipeline fingerprint computed in the parent
+        roi (dict, optional): Region-of-interest options from image_preprocessing.roi_options
+        profile (PreprocessProfile, optional): Profile run instead of the default chain
+
+    Raises:
+        RuntimeError: If the worker's pipeline fingerprint differs from the parent's
+        ValueError: If a stage of the profile cannot be registered in the worker
+    """
+    PREPROCESS_CONFIG.clear()
+    PREPROCESS_CONFIG.update(config)
+    if profile is not None:
+        restore_profile(profile)
+    worker_fingerprint = pipeline_fingerprint(roi=roi, profile=profile)
+    if worker_fingerprint != fingerprint:
+        raise RuntimeError(f"Worker pipeline fingerprint {worker_fingerprint} differs from the parent's {fingerprint}")
+
+def file_sha256(path, chunk_size=1 << 20):
+    """
+    Hash the contents of a file
+
+    Args:
+        path (str or Path): Path to the file
+        chunk_size (int): Number of bytes read per iteration
+
+    Returns:
+        str: Hex SHA-256 digest of the file contents
+    """
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def encode_jpeg(image, quality=None):
+    """
+    JPEG-encode an image
+
+    Args:
+        image (numpy.ndarray): Image in BGR format
+        quality (int, optional): JPEG quality 0-100 (default: PREPROCESS_CONFIG["jpeg_quality"])
+
+    Returns:
+        numpy.ndarray: Encoded bytes, or None if encoding fails
+    """
+    if quality is None:
+        quality = PREPROCESS_CONFIG["jpeg_quality"]
+    success, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    return buffer if success else None
+
+def encode_preprocessed_image(image_path, roi=None, profile=None):
+    """
+    Load, preprocess and JPEG-encode an image
+
+    Args:
+        image_path (str or Path): Path to the image file
+        roi (dict, optional): Region-of-interest options from image_preprocessing.roi_options
+        profile (PreprocessProfile, optional): Profile run instead of the default chain
+
+    Returns:
+        bytes: JPEG-encoded preprocessed image or None if processing fails
+    """
+    image = load_and_preprocess_image(image_path, roi=roi, profile=profile)
+    if image is None:
+        return None
+
+    with timed("encode"):
+        buffer = encode_jpeg(image)
+    if buffer is None:
+        logger.error(f"Could not encode preprocessed image: {image_path}")
+        return None
+    return buffer.tobytes()
+
+class PreprocessCache:
+    """Content-addressed on-disk cache of preprocessed, JPEG-encoded images"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=DEFAULT_MAX_SIZE_MB, fingerprint=None, roi=None,
+                 profile=None):
+        """
+        Initialize the cache
+
+        Entries are keyed by the SHA-256 of the source file plus the pipeline
+        fingerprint and stored as ``<cache_dir>/<fingerprint>/<xx>/<hash>.jpg``.
+        Writes go through a temporary file and ``os.replace`` so several
+        processes can share one cache directory safely.
+
+        Args:
+            cache_dir (str or Path): Root directory of the cache
+            max_size_mb (float): Size bound in megabytes; least recently used entries are evicted beyond it
+            fingerprint (str, optional): Pipeline fingerprint (default: pipeline_fingerprint(roi=roi, profile=profile))
+            roi (dict, optional): Region-of-interest options the cached images are produced with
+            profile (PreprocessProfile, optional): Profile the cached images are produced with
+        """
+        self.cache_dir = Path(cache_dir)
+        self.roi = roi
+        self.profile = profile
+        self.fingerprint = fingerprint or pipeline_fingerprint(roi=roi, profile=profile)
+        self.entries_dir = self.cache_dir / self.fingerprint
+        self.entries_dir.mkdir(exist_ok=True, parents=True)
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        # Source hashes memoized by (path, size, mtime) to avoid rehashing within a run
+        self._source_hashes = {}
+        self._approx_size = None
+
+    def _source_hash(self, image_path):
+        """Return the content hash of a source image, memoized on its stat"""
+        stat = os.stat(image_path)
+        memo_key = (str(image_path), stat.st_size, stat.st_mtime_ns)
+        digest = self._source_hashes.get(memo_key)
+        if digest is None:
+            digest = file_sha256(image_path)
+            self._source_hashes[memo_key] = digest
+        return digest
+
+    def _entry_path(self, image_path):
+        """Return the cache file path for a source image"""
+        digest = self._source_hash(image_path)
+        return self.entries_dir / digest[:2] / f"{digest}.jpg"
+
+    def get(self, image_path):
+        """
+        Look up the cached preprocessed image for a source file
+
+        Args:
+            image_path (str or Path): Path to the source image
+
+        Returns:
+            bytes: Cached JPEG bytes or None on a miss
+        """
+        entry_path = self._entry_path(image_path)
+        try:
+            with timed("cache_read"), open(entry_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        # Touch the entry so eviction sees it as recently used
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def put(self, image_path, data):
+        """
+        Store a preprocessed image in the cache
+
+        Args:
+            image_path (str or Path): Path to the source image
+            data (bytes): JPEG bytes of the preprocessed image
+        """
+        entry_path = self._entry_path(image_path)
+        entry_path.parent.mkdir(exist_ok=True, parents=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=entry_path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, entry_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if self.max_size_bytes is not None:
+            with self.lock:
+                if self._approx_size is None:
+                    self._approx_size = self._scan_size()
+                else:
+                    self._approx_size += len(data)
+                over_limit = self._approx_size > self.max_size_bytes
+            if over_limit:
+                self.evict()
+
+    def get_or_create(self, image_path, producer):
+        """
+        Return the cached image, computing and storing it on a miss
+
+        Args:
+            image_path (str or Path): Path to the source image
+            producer (callable): Zero-argument function returning JPEG bytes or None
+
+        Returns:
+            bytes: JPEG bytes or None if the producer failed
+        """
+        data = self.get(image_path)
+        if data is not None:
+            return data
+
+        data = producer()
+        if data is not None:
+            try:
+                self.put(image_path, data)
+            except OSError as e:
+                logger.warning(f"Could not write cache entry for {image_path}: {e}")
+        return data
+
+    def _list_entries(self):
+        """Return (mtime, size, path) for every entry across all fingerprints"""
+        entries = []
+        for path in self.cache_dir.glob("*/*/*.jpg"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_size(self):
+        """Return the total size of the cache in bytes"""
+        return sum(size for _, size, _ in self._list_entries())
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits its size bound
+
+        Returns:
+            int: Number of evicted entries
+        """
+        if self.max_size_bytes is None:
+            return 0
+
+        entries = sorted(self._list_entries(), key=lambda entry: entry[0])
+        total_size = sum(size for _, size, _ in entries)
+        # Evict down to 90% of the bound so we don't rescan on every put
+        target_size = int(self.max_size_bytes * 0.9)
+        evicted = 0
+
+        for _, size, path in entries:
+            if total_size <= target_size:
+                break
+            try:
+                path.unlink()
+                total_size -= size
+                evicted += 1
+            except FileNotFoundError:
+                # Another worker evicted it first
+                total_size -= size
+
+        with self.lock:
+            self._approx_size = total_size
+
+        if evicted:
+            logger.info(f"Evicted {evicted} entries from preprocess cache ({total_size / 1024 / 1024:.1f} MB left)")
+        return evicted
+
+    def stats(self):
+        """Return hit/miss counters"""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+def read_sid_list(sid_file):
+    """
+    Read a list of SIDs from a file
+
+    Supports JSON lists (e.g. failed_sids_*.json), tab-separated label files
+    with a SID column (e.g. data/test.txt) and plain files with one SID per line.
+
+    Args:
+        sid_file (str or Path): Path to the SID list
+
+    Returns:
+        list: SIDs in file order
+    """
+    sid_file = Path(sid_file)
+    if sid_file.suffix == ".json":
+        with open(sid_file, 'r', encoding='utf-8') as f:
+            return [str(sid) for sid in json.load(f)]
+
+    with open(sid_file, 'r', encoding='utf-8') as f:
+        first_line = f.readline()
+    if "\t" in first_line and "SID" in first_line.split("\t"):
+        return pd.read_csv(sid_file, sep='\t')['SID'].astype(str).tolist()
+
+    with open(sid_file, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def _init_warm_worker(config, fingerprint, roi, profile):
+    """Initializer for warm_cache worker processes"""
+    apply_worker_config(config, fingerprint, roi, profile)
+
+def _warm_one(args):
+    """Worker entry point for warm_cache: preprocess one image into the cache"""
+    image_path, cache_dir, fingerprint, roi, profile = args
+    # Eviction is left to the parent so workers don't rescan the cache per image
+    cache = PreprocessCache(cache_dir, max_size_mb=None, fingerprint=fingerprint, roi=roi, profile=profile)
+    if cache.get(image_path) is not None:
+        return "hit"
+    data = encode_preprocessed_image(image_path, roi, profile)
+    if data is None:
+        return "failed"
+    cache.put(image_path, data)
+    return "stored"
+
+def warm_cache(sids, images_dir, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=DEFAULT_MAX_SIZE_MB, workers=None, roi=None,
+               profile=None):
+    """
+    Fill the cache for a list of SIDs using a process pool
+
+    Args:
+        sids (list): SIDs to preprocess
+        images_dir (str or Path): Directory containing <SID>.jpg raw images
+        cache_dir (str or Path): Root directory of the cache
+        max_size_mb (float): Size bound of the cache in megabytes
+        workers (int, optional): Number of worker processes (default: CPU count)
+        roi (dict, optional): Region-of-interest options from image_preprocessing.roi_options
+        profile (PreprocessProfile, optional): Profile run instead of the default chain
+
+    Returns:
+        dict: Counts of hit, stored, failed and missing images
+    """
+    images_dir = Path(images_dir)
+    fingerprint = pipeline_fingerprint(roi=roi, profile=profile)
+    counts = {"hit": 0, "stored": 0, "failed": 0, "missing": 0}
+
+    tasks = []
+    for sid in sids:
+        image_path = images_dir / f"{sid}.jpg"
+        if not image_path.exists():
+            counts["missing"] += 1
+            continue
+        tasks.append((image_path, cache_dir, fingerprint, roi, profile))
+
+    logger.info(f"Warming preprocess cache {cache_dir} ({fingerprint}) with {len(tasks)} images...")
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_warm_worker,
+            initargs=(dict(PREPROCESS_CONFIG), fingerprint, roi, profile)) as executor:
+        for outcome in tqdm(executor.map(_warm_one, tasks, chunksize=4), total=len(tasks), desc="Warming cache"):
+            counts[outcome] += 1
+
+    PreprocessCache(cache_dir, max_size_mb=max_size_mb, fingerprint=fingerprint, roi=roi, profile=profile).evict()
+    logger.info(f"Cache warm-up finished: {counts}")
+    return counts
+
+def main():
+    """Warm up the preprocess cache for a list of SIDs"""
+    parser = argparse.ArgumentParser(description="Fill the preprocessed image cache for a SID list in parallel")
+    parser.add_argument("sid_file", help="SID list: JSON list, TSV with a SID column, or one SID per line")
+    parser.add_argument("--data-dir", type=str, default="data/TonguExpertDatabase",
+                      help="Path to the data directory")
+    parser.add_argument("--cache-dir", type=str, default=str(DEFAULT_CACHE_DIR),
+                      help="Directory of the preprocess cache")
+    parser.add_argument("--cache-size-mb", type=float, default=DEFAULT_MAX_SIZE_MB,
+                      help="Maximum cache size in megabytes")
+    parser.add_argument("--workers", type=int, default=None,
+                      help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--profile", type=str, default=None,
+                      help="Preprocessing profile name or file (default: the PREPROCESS_CONFIG chain)")
+    parser.add_argument("--jpeg-quality", type=int, default=PREPROCESS_CONFIG["jpeg_quality"],
+                      help="JPEG quality (0-100) of the cached images; must match the run using the cache")
+    parser.add_argument("--denoise-mode", choices=DENOISE_MODES, default=None,
+                      help=f"Denoiser backend (default: {PREPROCESS_CONFIG['denoise_mode']}); "
+                           "must match the run using the cache, profiles set their own")
+    parser.add_argument("--roi-crop", action="store_true",
+                      help="Warm the cache for images cropped to the tongue mask")
+    parser.add_argument("--roi-margin", type=float, default=0.05,
+                      help="Margin around the mask bounding box, as a fraction of its size")
+    parser.add_argument("--max-edge", type=int, default=None,
+                      help="Warm the cache for images downscaled to this longer edge")
+
+    args = parser.parse_args()
+
+    if not 0 <= args.jpeg_quality <= 100:
+        parser.error("--jpeg-quality must be between 0 and 100")
+    if args.profile and args.denoise_mode is not None:
+        parser.error("--denoise-mode does not apply to preprocessing profiles; set the mode in the profile")
+
+    # Both feed pipeline_fingerprint, so set them before warm_cache computes it (as baseline_test does)
+    if args.denoise_mode is not None:
+        PREPROCESS_CONFIG["denoise_mode"] = args.denoise_mode
+    PREPROCESS_CONFIG["jpeg_quality"] = args.jpeg_quality
+
+    sids = read_sid_list(args.sid_file)
+    images_dir = Path(args.data_dir) / "TongueImage" / "Raw"
+    roi = roi_options(args.roi_crop, args.roi_margin, args.max_edge)
+    profile = get_profile(args.profile) if args.profile else None
+    counts = warm_cache(sids, images_dir, args.cache_dir, args.cache_size_mb, args.workers, roi, profile)
+    return 0 if counts["failed"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
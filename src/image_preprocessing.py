@@ -1,10 +1,155 @@
 import cv2
 import numpy as np
 import logging
+import threading
+import functools
+import concurrent.futures
+from pathlib import Path
+
+from stage_timing import timed
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Parameters of the default preprocessing chain used by preprocess_image
+PREPROCESS_CONFIG = {
+    "denoise_strength": 5,
+    # Denoiser backend, one of DENOISE_MODES ("nlm" is the original non-local means)
+    "denoise_mode": "nlm",
+    "clahe_clip_limit": 3.0,
+    "clahe_tile_grid": 8,
+    "retinex_sigma": 10,
+    "gamma": 1.2,
+    "contrast_alpha": 1.1,
+    "contrast_beta": 5,
+    # Run the chain with FusedPreprocessor in load_and_preprocess_image; off by default since
+    # denoising dominates and the fused chain is only about 1.2x faster end to end
+    "fused": False,
+    # FusedPreprocessor only: blur the Retinex illumination at 1/scale resolution
+    # (1 matches retinex_enhancement exactly; 2 is faster within a few levels)
+    "retinex_blur_scale": 1,
+    # JPEG quality (0-100) of preprocessed images sent to the model; lower trades fidelity for payload size
+    "jpeg_quality": 95,
+}
+
+# Stage order of preprocess_image
+DEFAULT_STAGES = ["denoise", "white_balance", "light_normalization", "color_correction",
+                  "retinex", "gamma", "contrast"]
+
+# Memoized LUT builders by name, see register_lut
+_LUT_BUILDERS = {}
+
+def register_lut(name, builder, maxsize=256):
+    """
+    Register a LUT builder under a name
+    
+    Tables are memoized by their parameters, keeping the most recently used
+    maxsize tables per builder, so data-dependent tables (e.g. white balance
+    gains) don't grow the cache without bound.
+    
+    Args:
+        name (str): Registry name used with get_lut
+        builder (callable): Function of hashable parameters returning 256 uint8 values
+        maxsize (int): Number of tables kept per builder
+    """
+    @functools.lru_cache(maxsize=maxsize)
+    def cached(*params):
+        table = np.ascontiguousarray(builder(*params), dtype=np.uint8).reshape(256)
+        # Shared between callers, so it must not be modified in place
+        table.setflags(write=False)
+        return table
+    _LUT_BUILDERS[name] = cached
+
+def get_lut(name, *params):
+    """
+    Return a memoized lookup table
+    
+    Args:
+        name (str): Registered builder name ("identity", "gamma", "contrast", "gain", "scale" or custom)
+        *params: Builder parameters
+        
+    Returns:
+        numpy.ndarray: Read-only table of 256 uint8 values
+    """
+    try:
+        builder = _LUT_BUILDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown LUT: {name}")
+    return builder(*params)
+
+def compose_luts(*luts):
+    """
+    Compose lookup tables into one per-channel table
+    
+    The result maps a pixel through the tables in order, so applying it once
+    equals applying each table in turn.
+    
+    Args:
+        *luts: Tables of 256 values (shared by all channels) or 3x256 (one row per BGR channel)
+        
+    Returns:
+        numpy.ndarray: 3x256 uint8 table
+    """
+    combined = np.vstack([np.arange(256, dtype=np.uint8)] * 3)
+    for lut in luts:
+        lut = np.asarray(lut, dtype=np.uint8)
+        if lut.ndim == 1 or lut.shape[0] == 1:
+            combined = lut.reshape(256)[combined]
+        else:
+            combined = np.take_along_axis(lut, combined.astype(np.intp), axis=1)
+    return combined
+
+def apply_lut(image, lut, dst=None):
+    """
+    Apply a table from get_lut or compose_luts with a single cv2.LUT call
+    
+    Args:
+        image (numpy.ndarray): The input image in BGR format
+        lut (numpy.ndarray): 256 values for all channels or 3x256 per channel
+        dst (numpy.ndarray, optional): Output array, may be the input for in-place application
+        
+    Returns:
+        numpy.ndarray: The mapped image
+    """
+    lut = np.asarray(lut, dtype=np.uint8)
+    if lut.ndim == 2 and lut.shape[0] == 3:
+        # cv2.LUT takes a 1x256 table with one column per channel
+        lut = np.ascontiguousarray(lut.T).reshape(1, 256, 3)
+    return cv2.LUT(image, lut, dst=dst)
+
+def pixelwise_lut(gains=None, gamma=None, contrast=None):
+    """
+    Build one per-channel table for channel gains, gamma and contrast in that order
+    
+    Args:
+        gains (tuple, optional): (b, g, r) gains with white_balance rounding
+        gamma (float, optional): Gamma of gamma_correction
+        contrast (tuple, optional): (alpha, beta) of contrast_enhancement
+        
+    Returns:
+        numpy.ndarray: 3x256 uint8 table for apply_lut
+    """
+    luts = []
+    if gains is not None:
+        luts.append(np.vstack([get_lut("gain", float(gain)) for gain in gains]))
+    if gamma is not None:
+        luts.append(get_lut("gamma", float(gamma)))
+    if contrast is not None:
+        luts.append(get_lut("contrast", float(contrast[0]), float(contrast[1])))
+    return compose_luts(*luts)
+
+def _ramp():
+    """Return the 0..255 values as a 1x256 uint8 image"""
+    return np.arange(256, dtype=np.uint8).reshape(1, 256)
+
+# Each table is built by running the same OpenCV call as the per-image function on
+# a 0..255 ramp, so a LUT pass gives identical pixels
+register_lut("identity", lambda: np.arange(256, dtype=np.uint8), maxsize=1)
+register_lut("gamma", lambda gamma: ((np.arange(0, 256) / 255.0) ** (1.0 / gamma)) * 255)
+register_lut("contrast", lambda alpha, beta: cv2.convertScaleAbs(_ramp(), alpha=alpha, beta=beta))
+register_lut("gain", lambda gain: cv2.addWeighted(src1=_ramp(), alpha=gain, src2=0, beta=0, gamma=0))
+register_lut("scale", lambda scale: cv2.multiply(_ramp(), scale))
+
 def white_balance(image):
     """
     Apply automatic white balance to the image using the gray world algorithm
@@ -18,10 +163,7 @@ def white_balance(image):
     try:
         # 使用简单的灰度世界算法实现白平衡
         # 计算每个通道的平均值
-        b, g, r = cv2.split(image)
-        r_avg = np.mean(r)
-        g_avg = np.mean(g)
-        b_avg = np.mean(b)
+        b_avg, g_avg, r_avg = image.reshape(-1, 3).mean(axis=0)
         
         # 计算亮度的平均值 (灰度世界假设)
         k = (r_avg + g_avg + b_avg) / 3
@@ -31,25 +173,22 @@ def white_balance(image):
         kg = k / g_avg
         kb = k / b_avg
         
-        # 应用增益调整
-        r = cv2.addWeighted(src1=r, alpha=kr, src2=0, beta=0, gamma=0)
-        g = cv2.addWeighted(src1=g, alpha=kg, src2=0, beta=0, gamma=0)
-        b = cv2.addWeighted(src1=b, alpha=kb, src2=0, beta=0, gamma=0)
-        
-        # 合并通道
-        balanced_image = cv2.merge([b, g, r])
+        # 应用增益调整（每个通道一张查找表，一次完成）
+        balanced_image = apply_lut(image, pixelwise_lut(gains=(kb, kg, kr)))
         return balanced_image
     except Exception as e:
         logger.warning(f"White balance failed: {e}")
         return image
 
-def light_normalization(image):
+def light_normalization(image, clip_limit=3.0, tile_grid_size=8):
     """
     Apply light normalization to the image using CLAHE (Contrast Limited Adaptive Histogram Equalization)
     
     Args:
         image (numpy.ndarray): The input image in BGR format
-        
+        clip_limit (float): CLAHE contrast limit (default: 3.0)
+        tile_grid_size (int): Number of CLAHE tiles per side (default: 8)
+
     Returns:
         numpy.ndarray: The normalized image
     """
@@ -59,7 +198,7 @@ def light_normalization(image):
         l, a, b = cv2.split(lab)
         
         # Apply CLAHE to the L channel
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(tile_grid_size, tile_grid_size))
         cl = clahe.apply(l)
         
         # Merge the CLAHE enhanced L channel back with the a and b channels
@@ -82,33 +221,28 @@ def color_correction(image):
     """
     try:
         # 使用最大值法进行色彩校正
-        b, g, r = cv2.split(image)
-        
         # 找出图像中最亮的点作为参考白点
-        max_b = np.max(b)
-        max_g = np.max(g)
-        max_r = np.max(r)
+        max_b, max_g, max_r = image.reshape(-1, 3).max(axis=0)
         
         # 根据最大值调整通道
         if max_b > 0 and max_g > 0 and max_r > 0:
-            b = cv2.multiply(b, 255.0 / max_b)
-            g = cv2.multiply(g, 255.0 / max_g)
-            r = cv2.multiply(r, 255.0 / max_r)
+            scales = np.vstack([get_lut("scale", 255.0 / float(channel_max))
+                                for channel_max in (max_b, max_g, max_r)])
+            return apply_lut(image, scales)
         
-        # 合并通道
-        corrected_image = cv2.merge([b, g, r])
-        return corrected_image.astype(np.uint8)
+        return image.astype(np.uint8)
     except Exception as e:
         logger.warning(f"Color correction failed: {e}")
         return image
 
-def retinex_enhancement(image):
+def retinex_enhancement(image, sigma=10):
     """
     Apply Retinex enhancement to remove shadows and enhance details
     
     Args:
         image (numpy.ndarray): The input image in BGR format
-        
+        sigma (float): Gaussian sigma of the illumination estimate (default: 10)
+
     Returns:
         numpy.ndarray: The enhanced image
     """
@@ -119,7 +253,7 @@ def retinex_enhancement(image):
         y, u, v = cv2.split(yuv)
         
         # 对亮度通道应用高斯模糊
-        blur = cv2.GaussianBlur(y, (0, 0), 10)
+        blur = cv2.GaussianBlur(y, (0, 0), sigma)
         
         # 避免除零问题
         blur = np.where(blur == 0, 0.1, blur)
@@ -154,10 +288,8 @@ def gamma_correction(image, gamma=1.2):
         numpy.ndarray: The gamma-corrected image
     """
     try:
-        # Build a lookup table mapping the pixel values [0, 255] to their adjusted gamma values
-        invGamma = 1.0 / gamma
-        table = np.array([((i / 255.0) ** invGamma) * 255
-                          for i in np.arange(0, 256)]).astype("uint8")
+        # Look up the table mapping the pixel values [0, 255] to their adjusted gamma values
+        table = get_lut("gamma", float(gamma))
         
         # Apply gamma correction using the lookup table
         return cv2.LUT(image, table)
@@ -165,21 +297,97 @@ def gamma_correction(image, gamma=1.2):
         logger.warning(f"Gamma correction failed: {e}")
         return image
 
-def denoise_image(image, strength=10):
+def _denoise_nlm(image, strength, mask=None, dst=None):
+    """Non-local means on the full frame"""
+    return cv2.fastNlMeansDenoisingColored(image, dst, strength, strength, 7, 21)
+
+def _denoise_bilateral(image, strength, mask=None, dst=None):
+    """Bilateral filter; the colour sigma grows with the strength"""
+    return cv2.bilateralFilter(image, 7, 4 * strength, 5, dst=dst)
+
+def _denoise_guided(image, strength, mask=None, dst=None, radius=4):
+    """
+    Self-guided filter (He et al.) on each channel
+    
+    Flat regions are averaged while edges with a local variance well above
+    eps = (2 * strength)^2 are kept. Built from box filters since cv2.ximgproc
+    is not part of the standard OpenCV wheels.
+    """
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    eps = float((2 * strength) ** 2)
+    guide = image.astype(np.float32)
+    mean = cv2.boxFilter(guide, -1, ksize)
+    variance = cv2.boxFilter(guide * guide, -1, ksize) - mean * mean
+    a = variance / (variance + eps)
+    b = mean - a * mean
+    result = cv2.boxFilter(a, -1, ksize) * guide + cv2.boxFilter(b, -1, ksize)
+    if dst is None:
+        dst = np.empty_like(image)
+    np.copyto(dst, np.clip(result, 0, 255, out=result), casting='unsafe')
+    return dst
+
+def _denoise_nlm_downscaled(image, strength, mask=None, dst=None, scale=2):
+    """
+    Non-local means on a downscaled copy
+    
+    Only the noise removed at low resolution is upsampled and subtracted from
+    the full resolution image, so edges keep their original sharpness.
+    """
+    height, width = image.shape[:2]
+    small = cv2.resize(image, (max(1, width // scale), max(1, height // scale)), interpolation=cv2.INTER_AREA)
+    denoised = cv2.fastNlMeansDenoisingColored(small, None, strength, strength, 5, 11)
+    correction = cv2.resize(cv2.subtract(small, denoised, dtype=cv2.CV_16S), (width, height),
+                            interpolation=cv2.INTER_LINEAR)
+    return cv2.subtract(image, correction, dst=dst, dtype=cv2.CV_8U)
+
+def _denoise_nlm_roi(image, strength, mask=None, dst=None, pad=10):
+    """
+    Non-local means inside the bounding box of the tongue mask only
+    
+    Falls back to the full frame without a usable mask. The box is padded by
+    the search radius so its border pixels see the same neighbourhood.
+    """
+    bbox = tongue_bbox(mask) if mask is not None and mask.shape[:2] == image.shape[:2] else None
+    if bbox is None:
+        return _denoise_nlm(image, strength, dst=dst)
+    x0, y0, x1, y1 = bbox
+    height, width = image.shape[:2]
+    x0, y0, x1, y1 = max(0, x0 - pad), max(0, y0 - pad), min(width, x1 + pad), min(height, y1 + pad)
+    if dst is None:
+        dst = image.copy()
+    elif dst is not image:
+        np.copyto(dst, image)
+    dst[y0:y1, x0:x1] = cv2.fastNlMeansDenoisingColored(
+        np.ascontiguousarray(image[y0:y1, x0:x1]), None, strength, strength, 7, 21)
+    return dst
+
+# Denoiser backends selected by denoise_mode: func(image, strength, mask=None, dst=None)
+_DENOISE_BACKENDS = {
+    "nlm": _denoise_nlm,
+    "bilateral": _denoise_bilateral,
+    "guided": _denoise_guided,
+    "nlm_downscaled": _denoise_nlm_downscaled,
+    "nlm_roi": _denoise_nlm_roi,
+}
+DENOISE_MODES = tuple(_DENOISE_BACKENDS)
+
+def denoise_image(image, strength=10, mode="nlm", mask=None):
     """
     Apply denoising to the image
     
     Args:
         image (numpy.ndarray): The input image in BGR format
         strength (int): Strength of denoising (default: 10)
+        mode (str): Backend, one of DENOISE_MODES (default: "nlm", non-local means)
+        mask (numpy.ndarray, optional): Tongue mask of the same size, used by "nlm_roi"
         
     Returns:
         numpy.ndarray: The denoised image
     """
+    if mode not in _DENOISE_BACKENDS:
+        raise ValueError(f"Unknown denoise mode: {mode}")
     try:
-        # Use Non-Local Means Denoising algorithm
-        denoised_image = cv2.fastNlMeansDenoisingColored(image, None, strength, strength, 7, 21)
-        return denoised_image
+        return _DENOISE_BACKENDS[mode](image, strength, mask=mask)
     except Exception as e:
         logger.warning(f"Denoising failed: {e}")
         return image
@@ -197,44 +405,49 @@ def contrast_enhancement(image, alpha=1.2, beta=10):
         numpy.ndarray: The contrast-enhanced image
     """
     try:
-        # Apply the formula: new_image = alpha * old_image + beta
-        enhanced_image = cv2.convertScaleAbs(image, alpha=alpha, beta=beta)
+        # Apply the formula: new_image = alpha * old_image + beta, precomputed as a table
+        enhanced_image = cv2.LUT(image, get_lut("contrast", float(alpha), float(beta)))
         return enhanced_image
     except Exception as e:
         logger.warning(f"Contrast enhancement failed: {e}")
         return image
 
-def preprocess_image(image):
+def preprocess_image(image, mask=None):
     """
     Apply a sequence of preprocessing steps to enhance the tongue image
     
     Args:
         image (numpy.ndarray): The input image in BGR format
+        mask (numpy.ndarray, optional): Tongue mask, used by the "nlm_roi" denoise mode
         
     Returns:
         numpy.ndarray: The preprocessed image
     """
     try:
+        config = PREPROCESS_CONFIG
+        
         # Step 1: Denoise the image
-        image = denoise_image(image, strength=5)
+        image = denoise_image(image, strength=config["denoise_strength"],
+                              mode=config.get("denoise_mode", "nlm"), mask=mask)
         
         # Step 2: Apply automatic white balance
         image = white_balance(image)
         
         # Step 3: Apply light normalization
-        image = light_normalization(image)
+        image = light_normalization(image, clip_limit=config["clahe_clip_limit"],
+                                    tile_grid_size=config["clahe_tile_grid"])
         
         # Step 4: Apply color correction
         image = color_correction(image)
         
         # Step 5: Apply Retinex enhancement for shadow removal and detail enhancement
-        image = retinex_enhancement(image)
+        image = retinex_enhancement(image, sigma=config["retinex_sigma"])
         
         # Step 6: Apply gamma correction
-        image = gamma_correction(image, gamma=1.2)
+        image = gamma_correction(image, gamma=config["gamma"])
         
         # Step 7: Enhance contrast
-        image = contrast_enhancement(image, alpha=1.1, beta=5)
+        image = contrast_enhancement(image, alpha=config["contrast_alpha"], beta=config["contrast_beta"])
         
         return image
     except Exception as e:
@@ -242,28 +455,604 @@ def preprocess_image(image):
         # If preprocessing fails, return the original image
         return image
 
-def load_and_preprocess_image(image_path):
+def _histograms(image):
+    """Return the 3x256 per-channel pixel counts of a BGR image as float64"""
+    return np.vstack([cv2.calcHist([image], [channel], None, [256], [0, 256]).ravel()
+                      for channel in range(3)]).astype(np.float64)
+
+def _channel_stats(hist, lut):
+    """
+    Per-channel mean and maximum of images after a LUT, from their input histograms
+
+    Works on one image (3x256) or a batch (Nx3x256) at once. The counts and
+    table values are integers, so the sums are exact in float64 and the means
+    match a per-channel dot product bit for bit.
+
+    Args:
+        hist (numpy.ndarray): [N x] 3x256 pixel counts of the input images
+        lut (numpy.ndarray): [N x] 3x256 uint8 LUTs applied so far
+
+    Returns:
+        tuple: (means, maxes), arrays of shape [N x] 3 in BGR order
+    """
+    means = (hist * lut.astype(np.float64)).sum(axis=-1) / hist.sum(axis=-1)
+    maxes = np.where(hist > 0, lut, 0).max(axis=-1)
+    return means, maxes
+
+def _white_balance_lut(stats, config):
+    """Per-channel gray world gains of white_balance as a LUT"""
+    means, _ = stats
+    if min(means) <= 0:
+        return None
+    k = sum(means) / 3
+    return np.vstack([get_lut("gain", float(k / mean)) for mean in means])
+
+def _color_correction_lut(stats, config):
+    """Per-channel max-white scaling of color_correction as a LUT"""
+    _, maxes = stats
+    if min(maxes) <= 0:
+        return None
+    return np.vstack([get_lut("scale", 255.0 / int(channel_max)) for channel_max in maxes])
+
+def _gamma_lut(stats, config):
+    """Gamma curve of gamma_correction as a LUT"""
+    return get_lut("gamma", float(config["gamma"]))
+
+def _contrast_lut(stats, config):
+    """Affine mapping of contrast_enhancement as a LUT"""
+    return get_lut("contrast", float(config["contrast_alpha"]), float(config["contrast_beta"]))
+
+# Per-pixel stages that FusedPreprocessor folds into LUTs: name -> (builder, needs image statistics);
+# a builder gets (means, maxes) of the image after the tables composed so far, or None
+_LUT_STAGES = {
+    "white_balance": (_white_balance_lut, True),
+    "color_correction": (_color_correction_lut, True),
+    "gamma": (_gamma_lut, False),
+    "contrast": (_contrast_lut, False),
+}
+
+class FusedPreprocessor:
+    """
+    Runs a preprocessing chain with preallocated buffers and fused per-pixel stages
+
+    Adjacent per-pixel stages (white balance gains, max-white scaling, gamma and
+    contrast) are composed into one per-channel LUT and applied with a single
+    in-place cv2.LUT call. Their statistics come from one histogram pass, since
+    the mean and max of a channel after a LUT follow from its input histogram.
+    The remaining stages write into buffers that are reused while the image
+    size stays the same, and Retinex works on 256-entry log tables instead of
+    converting the whole frame to float and back.
+
+    Tolerance: with the default retinex_blur_scale=1 every LUT is built by
+    running the original OpenCV call on a 0..255 ramp, and the output matched
+    preprocess_image exactly (max difference 0) on the first 30 dataset images;
+    a difference of 1 level is possible where float32 logarithms round
+    differently. With retinex_blur_scale=2 the max difference was 7 levels and
+    99.9% of pixels were within 4. The non-denoise stages take about 0.8x the
+    time of the per-function chain at scale 1 and about 0.55x at scale 2.
+    Denoising uses the same backend as denoise_image (config "denoise_mode")
+    and dominates the run time, so the whole chain is not several times faster:
+    on 545x591 dataset images it took 988 ms against 1179 ms for preprocess_image
+    with non-local means (1.19x) and 55 ms against 79 ms with "guided" (1.43x).
+
+    An instance is not thread-safe; use one per worker (see preprocess_image_fused).
+    """
+
+    def __init__(self, stages=None, config=None):
+        """
+        Compile a chain
+
+        Args:
+            stages (list, optional): Ordered stage names (default: DEFAULT_STAGES)
+            config (dict, optional): Overrides of PREPROCESS_CONFIG
+        """
+        self.stages = list(stages if stages is not None else DEFAULT_STAGES)
+        self.config = dict(PREPROCESS_CONFIG, **(config or {}))
+        tiles = self.config["clahe_tile_grid"]
+        self.clahe = cv2.createCLAHE(clipLimit=self.config["clahe_clip_limit"], tileGridSize=(tiles, tiles))
+        self.buffers = {}
+        self.buffer_shape = None
+
+        # Group adjacent LUT stages: [("lut", [names]) or ("image", name)]
+        self.plan = []
+        for stage in self.stages:
+            if stage in _LUT_STAGES:
+                if self.plan and self.plan[-1][0] == "lut":
+                    self.plan[-1][1].append(stage)
+                else:
+                    self.plan.append(("lut", [stage]))
+            elif stage in ("denoise", "light_normalization", "retinex"):
+                self.plan.append(("image", stage))
+            else:
+                raise ValueError(f"Unknown preprocessing stage: {stage}")
+
+        # Stage-independent tables of the Retinex log differences
+        ramp = np.arange(256, dtype=np.float32).reshape(1, 256)
+        self.log_lut = cv2.log(ramp + 1.0)
+        blur_ramp = ramp.copy()
+        blur_ramp[0, 0] = np.float32(0.1)  # retinex_enhancement replaces zero blur by 0.1
+        self.blur_log_lut = cv2.log(blur_ramp + 1.0)
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        """Return a reusable work buffer"""
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self.buffers[name] = buffer
+        return buffer
+
+    def process(self, image, out=None, mask=None):
+        """
+        Run the chain on one image
+
+        Args:
+            image (numpy.ndarray): The input image in BGR format (not modified)
+            out (numpy.ndarray, optional): Output array; a new array is returned if omitted
+            mask (numpy.ndarray, optional): Tongue mask, used by the "nlm_roi" denoise mode
+
+        Returns:
+            numpy.ndarray: The preprocessed image
+        """
+        if image.shape[:2] != self.buffer_shape:
+            # Drop buffers of the previous size instead of keeping one set per size
+            self.buffers = {}
+            self.buffer_shape = image.shape[:2]
+
+        work = self._buffer("work", image.shape)
+        np.copyto(work, image)
+        for kind, stage in self.plan:
+            if kind == "lut":
+                self._apply_luts(work, stage)
+            elif stage == "denoise":
+                self._denoise(work, mask)
+            elif stage == "light_normalization":
+                self._light_normalization(work)
+            else:
+                self._retinex(work)
+
+        if out is None:
+            return work.copy()
+        np.copyto(out, work)
+        return out
+
+    def process_batch(self, images, masks=None):
+        """
+        Run the chain on several images, one stage at a time across the batch
+
+        Images of the same size are stacked into one contiguous array and share
+        the work buffers. The histograms behind the LUT statistics are taken per
+        image with cv2.calcHist, which measured about 5x faster than a single
+        np.bincount over the stack; the means and maxima derived from them are
+        computed for the whole stack at once. Raw dataset images rarely share a
+        size, so this is a convenience API rather than a faster path: throughput
+        stayed within 0.94-1.12x of process() per image. The output equals
+        process() per image.
+
+        Args:
+            images (list): Input images in BGR format (not modified)
+            masks (list, optional): Tongue masks (or None entries), used by the "nlm_roi" denoise mode
+
+        Returns:
+            list: The preprocessed images in input order
+        """
+        if masks is None:
+            masks = [None] * len(images)
+        groups = {}
+        for index, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(index)
+
+        results = [None] * len(images)
+        for shape, indices in groups.items():
+            if shape[:2] != self.buffer_shape:
+                self.buffers = {}
+                self.buffer_shape = shape[:2]
+            stack = np.stack([images[index] for index in indices])
+            for kind, stage in self.plan:
+                if kind == "lut":
+                    self._apply_luts_batch(stack, stage)
+                    continue
+                for position, index in enumerate(indices):
+                    work = stack[position]
+                    if stage == "denoise":
+                        self._denoise(work, masks[index])
+                    elif stage == "light_normalization":
+                        self._light_normalization(work)
+                    else:
+                        self._retinex(work)
+            for position, index in enumerate(indices):
+                results[index] = stack[position]
+        return results
+
+    def _apply_luts(self, work, stages):
+        """Compose a run of LUT stages and apply it in place"""
+        hist = None
+        lut = compose_luts()
+        for stage in stages:
+            builder, needs_stats = _LUT_STAGES[stage]
+            stats = None
+            if needs_stats:
+                if hist is None:
+                    hist = _histograms(work)
+                stats = _channel_stats(hist, lut)
+            stage_lut = builder(stats, self.config)
+            if stage_lut is not None:
+                lut = compose_luts(lut, stage_lut)
+        apply_lut(work, lut, dst=work)
+
+    def _apply_luts_batch(self, stack, stages):
+        """Compose a run of LUT stages per image of a stack and apply them in place"""
+        hists = None
+        luts = np.broadcast_to(compose_luts(), (len(stack), 3, 256)).copy()
+        for stage in stages:
+            builder, needs_stats = _LUT_STAGES[stage]
+            if needs_stats:
+                if hists is None:
+                    hists = np.stack([_histograms(work) for work in stack])
+                means, maxes = _channel_stats(hists, luts)
+            for position in range(len(stack)):
+                stats = (means[position], maxes[position]) if needs_stats else None
+                stage_lut = builder(stats, self.config)
+                if stage_lut is not None:
+                    luts[position] = compose_luts(luts[position], stage_lut)
+        for position, work in enumerate(stack):
+            apply_lut(work, luts[position], dst=work)
+
+    def _denoise(self, work, mask=None):
+        """Denoising with the configured backend, as in denoise_image"""
+        mode = self.config.get("denoise_mode", "nlm")
+        if mode not in _DENOISE_BACKENDS:
+            raise ValueError(f"Unknown denoise mode: {mode}")
+        denoised = self._buffer("denoised", work.shape)
+        _DENOISE_BACKENDS[mode](work, self.config["denoise_strength"], mask=mask, dst=denoised)
+        np.copyto(work, denoised)
+
+    def _light_normalization(self, work):
+        """CLAHE on the L channel, as in light_normalization"""
+        lab = self._buffer("lab", work.shape)
+        lightness = self._buffer("lightness", work.shape[:2])
+        equalized = self._buffer("equalized", work.shape[:2])
+        cv2.cvtColor(work, cv2.COLOR_BGR2LAB, dst=lab)
+        cv2.extractChannel(lab, 0, dst=lightness)
+        self.clahe.apply(lightness, dst=equalized)
+        cv2.insertChannel(equalized, lab, 0)
+        cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=work)
+
+    def _retinex(self, work):
+        """Single-scale Retinex on the Y channel, as in retinex_enhancement"""
+        yuv = self._buffer("yuv", work.shape)
+        luma = self._buffer("luma", work.shape[:2])
+        blur = self._buffer("blur", work.shape[:2])
+        retinex = self._buffer("retinex", work.shape[:2], np.float32)
+        blur_log = self._buffer("blur_log", work.shape[:2], np.float32)
+
+        cv2.cvtColor(work, cv2.COLOR_BGR2YUV, dst=yuv)
+        cv2.extractChannel(yuv, 0, dst=luma)
+        scale = self.config.get("retinex_blur_scale", 1)
+        if scale > 1:
+            # The illumination estimate is smooth, so blur a downscaled copy and upsample it
+            height, width = luma.shape
+            small_shape = (max(1, height // scale), max(1, width // scale))
+            small = self._buffer("small", small_shape)
+            small_blur = self._buffer("small_blur", small_shape)
+            cv2.resize(luma, small_shape[::-1], dst=small, interpolation=cv2.INTER_AREA)
+            cv2.GaussianBlur(small, (0, 0), self.config["retinex_sigma"] / scale, dst=small_blur)
+            cv2.resize(small_blur, (width, height), dst=blur, interpolation=cv2.INTER_LINEAR)
+        else:
+            cv2.GaussianBlur(luma, (0, 0), self.config["retinex_sigma"], dst=blur)
+
+        # log(y + 1) - log(blur + 1) via the log tables
+        cv2.LUT(luma, self.log_lut, dst=retinex)
+        cv2.LUT(blur, self.blur_log_lut, dst=blur_log)
+        np.subtract(retinex, blur_log, out=retinex)
+
+        # Same float32 normalization as retinex_enhancement, in place
+        low = retinex.min()
+        high = retinex.max()
+        np.subtract(retinex, low, out=retinex)
+        np.multiply(retinex, np.float32(255.0), out=retinex)
+        np.divide(retinex, high - low + np.float32(0.0001), out=retinex)
+        np.copyto(luma, retinex, casting='unsafe')
+
+        cv2.insertChannel(luma, yuv, 0)
+        cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR, dst=work)
+
+# One FusedPreprocessor per thread, so buffers are reused per worker
+_fused_local = threading.local()
+
+def preprocess_image_fused(image, mask=None):
+    """
+    Apply the default preprocessing chain with a per-thread FusedPreprocessor
+    
+    Falls back to preprocess_image if the fused chain fails.
+    
+    Args:
+        image (numpy.ndarray): The input image in BGR format
+        mask (numpy.ndarray, optional): Tongue mask, used by the "nlm_roi" denoise mode
+        
+    Returns:
+        numpy.ndarray: The preprocessed image
+    """
+    try:
+        return _fused_preprocessor().process(image, mask=mask)
+    except Exception as e:
+        logger.warning(f"Fused preprocessing failed, using the reference chain: {e}")
+        return preprocess_image(image, mask=mask)
+
+def _fused_preprocessor():
+    """Return this thread's FusedPreprocessor, rebuilt when PREPROCESS_CONFIG changed"""
+    preprocessor = getattr(_fused_local, "preprocessor", None)
+    if preprocessor is None or preprocessor.config != PREPROCESS_CONFIG:
+        preprocessor = FusedPreprocessor()
+        _fused_local.preprocessor = preprocessor
+    return preprocessor
+
+def preprocess_batch(images, masks=None):
+    """
+    Apply the default preprocessing chain to a batch of images
+
+    Uses this thread's FusedPreprocessor, so the CLAHE instance, LUTs and work
+    buffers are shared by the whole batch (see FusedPreprocessor.process_batch).
+    Falls back to preprocess_image per image if the batch fails.
+
+    Args:
+        images (list): Input images in BGR format
+        masks (list, optional): Tongue masks, used by the "nlm_roi" denoise mode
+
+    Returns:
+        list: The preprocessed images in input order
+    """
+    if not images:
+        return []
+    try:
+        return _fused_preprocessor().process_batch(images, masks)
+    except Exception as e:
+        logger.warning(f"Batch preprocessing failed, using the reference chain: {e}")
+        masks = masks if masks is not None else [None] * len(images)
+        return [preprocess_image(image, mask) for image, mask in zip(images, masks)]
+
+def roi_options(crop=False, margin=0.05, max_edge=None):
+    """
+    Build the region-of-interest options of load_and_preprocess_image
+    
+    Args:
+        crop (bool): Crop to the bounding box of the tongue mask
+        margin (float): Margin added around the bounding box, as a fraction of its size
+        max_edge (int, optional): Downscale so the longer edge is at most this many pixels
+        
+    Returns:
+        dict: Options, or None if neither cropping nor resizing is requested
+    """
+    if not crop and not max_edge:
+        return None
+    return {"crop": bool(crop), "margin": float(margin), "max_edge": int(max_edge) if max_edge else None}
+
+def mask_path_for(image_path):
+    """
+    Return the mask file matching a raw image
+    
+    The dataset stores masks as TongueImage/Mask/<SID>.jpg next to TongueImage/Raw.
+    
+    Args:
+        image_path (str or Path): Path to the raw image
+        
+    Returns:
+        Path: Path of the mask
+    """
+    image_path = Path(image_path)
+    return image_path.parent.parent / "Mask" / image_path.name
+
+def tongue_bbox(mask, threshold=127):
+    """
+    Find the bounding box of the tongue in a mask
+    
+    Args:
+        mask (numpy.ndarray): Grayscale mask, tongue pixels bright
+        threshold (int): Intensity above which a pixel belongs to the tongue
+        
+    Returns:
+        tuple: (x0, y0, x1, y1) with exclusive x1/y1, or None if the mask is empty
+    """
+    _, binary = cv2.threshold(mask, threshold, 255, cv2.THRESH_BINARY)
+    points = cv2.findNonZero(binary)
+    if points is None:
+        return None
+    x, y, width, height = cv2.boundingRect(points)
+    return x, y, x + width, y + height
+
+def load_mask(image_path, shape):
+    """
+    Read the tongue mask of a raw image
+    
+    Args:
+        image_path (str or Path): Path of the raw image
+        shape (tuple): Shape of the raw image
+        
+    Returns:
+        numpy.ndarray: Grayscale mask, or None (with a warning) if it is missing,
+            of a different size or empty
+    """
+    mask_path = mask_path_for(image_path)
+    mask = cv2.imread(str(mask_path), cv2.IMREAD_GRAYSCALE) if mask_path.exists() else None
+    if mask is None:
+        logger.warning(f"No mask found for {image_path}, using the full frame")
+    elif mask.shape[:2] != shape[:2]:
+        logger.warning(f"Mask size {mask.shape[:2]} differs from image size {shape[:2]} "
+                       f"for {image_path}, using the full frame")
+        mask = None
+    elif tongue_bbox(mask) is None:
+        logger.warning(f"Empty mask for {image_path}, using the full frame")
+        mask = None
+    return mask
+
+def _crop_and_resize(image, mask, roi):
+    """Apply roi to an image and, if given, its mask; returns (image, mask)"""
+    if roi.get("crop") and mask is not None:
+        x0, y0, x1, y1 = tongue_bbox(mask)
+        pad_x = int(round((x1 - x0) * roi.get("margin", 0.0)))
+        pad_y = int(round((y1 - y0) * roi.get("margin", 0.0)))
+        height, width = image.shape[:2]
+        window = (slice(max(0, y0 - pad_y), min(height, y1 + pad_y)),
+                  slice(max(0, x0 - pad_x), min(width, x1 + pad_x)))
+        image = np.ascontiguousarray(image[window])
+        mask = np.ascontiguousarray(mask[window])
+        
+    max_edge = roi.get("max_edge")
+    if max_edge and max(image.shape[:2]) > max_edge:
+        scale = max_edge / max(image.shape[:2])
+        size = (max(1, int(round(image.shape[1] * scale))), max(1, int(round(image.shape[0] * scale))))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        if mask is not None:
+            mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+    return image, mask
+
+def crop_and_resize(image, image_path, roi):
+    """
+    Crop an image to the tongue ROI and limit its size
+    
+    Falls back to the full frame if the mask is missing or empty.
+    
+    Args:
+        image (numpy.ndarray): The input image in BGR format
+        image_path (str or Path): Path of the raw image, used to find its mask
+        roi (dict): Options from roi_options
+        
+    Returns:
+        numpy.ndarray: The cropped and resized image
+    """
+    mask = load_mask(image_path, image.shape) if roi.get("crop") else None
+    return _crop_and_resize(image, mask, roi)[0]
+
+def load_image(image_path, roi=None, needs_mask=False):
+    """
+    Decode an image and, when needed, its tongue mask, and apply the ROI options
+
+    Args:
+        image_path (str or Path): Path to the image file
+        roi (dict, optional): Options from roi_options
+        needs_mask (bool): Load the mask even if the ROI options do not crop
+
+    Returns:
+        tuple: (image, mask); image is None if the file cannot be read, mask is None
+            when it is not needed or not available
+    """
+    with timed("imread"):
+        image = cv2.imread(str(image_path))
+    if image is None:
+        logger.error(f"Could not read image: {image_path}")
+        return None, None
+    
+    mask = None
+    if roi is not None or needs_mask:
+        with timed("roi"):
+            if needs_mask or roi.get("crop"):
+                mask = load_mask(image_path, image.shape)
+            if roi is not None:
+                image, mask = _crop_and_resize(image, mask, roi)
+    return image, mask
+
+def apply_preprocessing(image, mask=None, profile=None):
+    """
+    Run a profile, or the chain configured by PREPROCESS_CONFIG, on a decoded image
+
+    Args:
+        image (numpy.ndarray): The input image in BGR format
+        mask (numpy.ndarray, optional): Tongue mask of the image
+        profile (PreprocessProfile, optional): Profile from preprocess_profiles
+
+    Returns:
+        numpy.ndarray: The preprocessed image
+    """
+    with timed("preprocess"):
+        if profile is not None:
+            return profile.apply(image, mask)
+        if PREPROCESS_CONFIG.get("fused"):
+            return preprocess_image_fused(image, mask)
+        return preprocess_image(image, mask)
+
+def load_and_preprocess_image(image_path, cache=None, roi=None, profile=None):
     """
     Load an image from the file system and apply preprocessing
     
     Args:
         image_path (str or Path): Path to the image file
-        
+        cache (PreprocessCache, optional): On-disk cache of preprocessed images.
+            When given, a cached result is decoded instead of rerunning the pipeline.
+        roi (dict, optional): Options from roi_options; the image is cropped to the
+            tongue and downscaled before the expensive preprocessing steps
+        profile (PreprocessProfile, optional): Profile from preprocess_profiles to run
+            instead of the default chain configured by PREPROCESS_CONFIG
+
     Returns:
         numpy.ndarray: The preprocessed image or None if loading fails
     """
     try:
-        # Read image from file
-        image = cv2.imread(str(image_path))
+        if cache is not None:
+            from image_cache import encode_preprocessed_image
+            jpeg_bytes = cache.get_or_create(image_path, lambda: encode_preprocessed_image(image_path, roi, profile))
+            if jpeg_bytes is None:
+                return None
+            return cv2.imdecode(np.frombuffer(jpeg_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
         
+        # Read image from file
+        if profile is not None:
+            needs_mask = profile.needs_mask
+        else:
+            needs_mask = PREPROCESS_CONFIG.get("denoise_mode") == "nlm_roi"
+        image, mask = load_image(image_path, roi, needs_mask)
         if image is None:
-            logger.error(f"Could not read image: {image_path}")
             return None
         
         # Apply preprocessing
-        preprocessed_image = preprocess_image(image)
-        
-        return preprocessed_image
+        return apply_preprocessing(image, mask, profile)
     except Exception as e:
         logger.error(f"Error loading and preprocessing image {image_path}: {e}")
-        return None 
\ No newline at end of file
+        return None 
+
+def _load_for_batch(image_path, roi, needs_mask):
+    """Decode one image (and its mask) for load_and_preprocess_batch"""
+    image = cv2.imread(str(image_path))
+    if image is None:
+        logger.error(f"Could not read image: {image_path}")
+        return None, None
+    mask = None
+    if needs_mask or (roi is not None and roi.get("crop")):
+        mask = load_mask(image_path, image.shape)
+    if roi is not None:
+        image, mask = _crop_and_resize(image, mask, roi)
+    return image, mask
+
+def load_and_preprocess_batch(image_paths, roi=None, workers=None):
+    """
+    Load and preprocess several images
+
+    Files are decoded (and cropped) concurrently on a thread pool, since
+    cv2.imread releases the GIL, and the decoded batch is preprocessed with
+    preprocess_batch.
+
+    Args:
+        image_paths (list): Paths to the image files
+        roi (dict, optional): Options from roi_options
+        workers (int, optional): Decoding threads (default: min(8, number of paths))
+
+    Returns:
+        list: Preprocessed images in input order, None where loading failed
+    """
+    image_paths = list(image_paths)
+    if not image_paths:
+        return []
+    needs_mask = PREPROCESS_CONFIG.get("denoise_mode") == "nlm_roi"
+    with timed("imread"):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or min(8, len(image_paths))) as executor:
+            loaded = list(executor.map(lambda path: _load_for_batch(path, roi, needs_mask), image_paths))
+
+    valid = [index for index, (image, _) in enumerate(loaded) if image is not None]
+    results = [None] * len(image_paths)
+    with timed("preprocess"):
+        if PREPROCESS_CONFIG.get("fused"):
+            processed = preprocess_batch([loaded[index][0] for index in valid],
+                                         [loaded[index][1] for index in valid])
+        else:
+            processed = [preprocess_image(*loaded[index]) for index in valid]
+    for index, image in zip(valid, processed):
+        results[index] = image
+    return results
@@ -0,0 +1,235 @@
+import logging
+import operator
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Indicators predicted for every image, in report order
+INDICATORS = ["coating_label", "tai_label", "zhi_label", "fissure_label", "tooth_mk_label"]
+
+# Representation of a missing label after standardize_label
+MISSING_LABEL = "NaN"
+
+def standardize_label(value):
+    """
+    Standardize a label, mapping the representations of a missing value to "NaN"
+
+    Args:
+        value: Label value (str, None or float NaN)
+
+    Returns:
+        str: Standardized label
+    """
+    if value is None:
+        return MISSING_LABEL
+    value_str = str(value)
+    if value_str.lower() in ["nan", "none", "null"]:
+        return MISSING_LABEL
+    return value_str
+
+class EncodedResults:
+    """
+    Ground truth and predictions of a run as integer codes
+
+    Column j of truth and pred holds indicator j coded as positions in
+    classes[j], the sorted labels that occur in either array. Labels are
+    standardized once per distinct value while encoding, not once per cell.
+    """
+
+    def __init__(self, sids, truth, pred, classes, indicators=INDICATORS):
+        """
+        Args:
+            sids (numpy.ndarray): SID of each row
+            truth (numpy.ndarray): rows x indicators ground truth codes
+            pred (numpy.ndarray): rows x indicators predicted codes
+            classes (list): Sorted labels of each indicator
+            indicators (list): Indicator names
+        """
+        self.sids = sids
+        self.truth = truth
+        self.pred = pred
+        self.classes = classes
+        self.indicators = list(indicators)
+
+    @classmethod
+    def from_results(cls, results, indicators=INDICATORS, standardize=standardize_label):
+        """
+        Encode result records
+
+        Args:
+            results (iterable): Result records with "SID", "ground_truth" and "predictions"
+                (e.g. TongueVisionTest.iter_predictions() or a loaded predictions file)
+            indicators (list): Indicators to encode
+            standardize (callable): Label standardization
+
+        Returns:
+            EncodedResults: The encoded run
+        """
+        sids, truth, pred = [], [], []
+        labels_of = operator.itemgetter(*indicators)
+        for result in results:
+            sids.append(result["SID"])
+            truth.append(labels_of(result["ground_truth"]))
+            pred.append(labels_of(result["predictions"]))
+        return cls.from_labels(truth, pred, sids, indicators, standardize)
+
+    @classmethod
+    def from_labels(cls, truth, pred, sids=None, indicators=INDICATORS, standardize=standardize_label):
+        """
+        Encode label arrays
+
+        Args:
+            truth (array-like): rows x indicators ground truth labels
+            pred (array-like): rows x indicators predicted labels
+            sids (array-like, optional): SID of each row; defaults to the row numbers
+            indicators (list): Indicator names, one per column
+            standardize (callable): Label standardization
+
+        Returns:
+            EncodedResults: The encoded run
+        """
+        truth = np.asarray(truth, dtype=object).reshape(-1, len(indicators))
+        pred = np.asarray(pred, dtype=object).reshape(-1, len(indicators))
+        if truth.shape != pred.shape:
+            raise ValueError(f"Ground truth {truth.shape} and predictions {pred.shape} differ in shape")
+        rows = len(truth)
+        sids = np.asarray(sids if sids is not None else np.arange(rows)).astype(str)
+
+        truth_codes = np.empty(truth.shape, dtype=np.int16)
+        pred_codes = np.empty(pred.shape, dtype=np.int16)
+        classes = []
+        for column in range(len(indicators)):
+            # Factorize the raw values, then standardize only the distinct ones
+            raw_codes, uniques = pd.factorize(np.concatenate([truth[:, column], pred[:, column]]),
+                                              use_na_sentinel=False)
+            labels = [standardize(None if pd.isna(value) else value) for value in uniques]
+            column_classes = sorted(set(labels))
+            lookup = np.array([column_classes.index(label) for label in labels], dtype=np.int16)
+            codes = lookup[raw_codes]
+            truth_codes[:, column] = codes[:rows]
+            pred_codes[:, column] = codes[rows:]
+            classes.append(column_classes)
+        return cls(sids, truth_codes, pred_codes, classes, indicators)
+
+    def __len__(self):
+        return len(self.sids)
+
+    def correct(self):
+        """Return the rows x indicators boolean matrix of correct predictions"""
+        return self.truth == self.pred
+
+    def take(self, rows):
+        """
+        Return the given rows
+
+        Args:
+            rows (array-like): Row numbers or a boolean mask
+
+        Returns:
+            EncodedResults: The rows, with the same classes
+        """
+        return EncodedResults(self.sids[rows], self.truth[rows], self.pred[rows], self.classes, self.indicators)
+
+    def align(self, sids):
+        """
+        Return the rows of the given SIDs, in that order
+
+        Args:
+            sids (array-like): SIDs, all present in this run
+
+        Returns:
+            EncodedResults: The rows
+        """
+        rows = pd.Index(self.sids).get_indexer(np.asarray(sids).astype(str))
+        if (rows < 0).any():
+            raise KeyError(f"{int((rows < 0).sum())} SIDs are not in the results")
+        return self.take(rows)
+
+def confusion_matrix(truth, pred, class_count):
+    """
+    Confusion matrix of one indicator in a single bincount
+
+    Args:
+        truth (numpy.ndarray): Ground truth codes
+        pred (numpy.ndarray): Predicted codes
+        class_count (int): Number of classes
+
+    Returns:
+        numpy.ndarray: class_count x class_count counts, rows are ground truth
+    """
+    pairs = truth.astype(np.int64) * class_count + pred
+    return np.bincount(pairs, minlength=class_count * class_count).reshape(class_count, class_count)
+
+def report_from_confusion(confusion, classes):
+    """
+    Build a classification report from a confusion matrix
+
+    Produces the same dictionary as sklearn's classification_report with
+    output_dict=True and zero_division=0.
+
+    Args:
+        confusion (numpy.ndarray): Confusion matrix, rows are ground truth
+        classes (list): Label of each row/column
+
+    Returns:
+        dict: Per-class precision/recall/f1-score/support plus accuracy, macro and weighted averages
+    """
+    correct = np.diag(confusion).astype(np.float64)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    total = int(support.sum())
+    precision = np.divide(correct, predicted, out=np.zeros_like(correct), where=predicted > 0)
+    recall = np.divide(correct, support, out=np.zeros_like(correct), where=support > 0)
+    denominator = precision + recall
+    f1 = np.divide(2 * precision * recall, denominator, out=np.zeros_like(correct), where=denominator > 0)
+
+    report = {}
+    for position, label in enumerate(classes):
+        report[label] = {
+            "precision": float(precision[position]),
+            "recall": float(recall[position]),
+            "f1-score": float(f1[position]),
+            "support": int(support[position])
+        }
+    report["accuracy"] = float(correct.sum() / total) if total else 0.0
+    for average, weights in [("macro avg", np.ones(len(classes))), ("weighted avg", support.astype(np.float64))]:
+        weight_sum = weights.sum()
+        report[average] = {
+            key: float((weights * values).sum() / weight_sum) if weight_sum else 0.0
+            for key, values in [("precision", precision), ("recall", recall), ("f1-score", f1)]
+        }
+        report[average]["support"] = total
+    return report
+
+def compute_metrics(encoded):
+    """
+    Per-indicator and overall metrics of an encoded run
+
+    Args:
+        encoded (EncodedResults): The run
+
+    Returns:
+        dict: indicator -> {"accuracy", "sample_count", "detailed_report", "precision_macro",
+            "recall_macro", "f1_macro"}, plus "overall" -> {"accuracy", "sample_count"} where
+            a sample is correct if every indicator is
+    """
+    metrics = {}
+    for column, indicator in enumerate(encoded.indicators):
+        classes = encoded.classes[column]
+        report = report_from_confusion(
+            confusion_matrix(encoded.truth[:, column], encoded.pred[:, column], len(classes)), classes)
+        metrics[indicator] = {
+            "accuracy": report["accuracy"],
+            "sample_count": len(encoded),
+            "detailed_report": report,
+            "precision_macro": report["macro avg"]["precision"],
+            "recall_macro": report["macro avg"]["recall"],
+            "f1_macro": report["macro avg"]["f1-score"]
+        }
+    metrics["overall"] = {
+        "accuracy": float(encoded.correct().all(axis=1).mean()),
+        "sample_count": len(encoded)
+    }
+    return metrics
@@ -0,0 +1,421 @@
+import json
+import math
+import time
+import base64
+import random
+import hashlib
+import argparse
+import logging
+from threading import Lock, Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from rate_limiter import SlidingWindow
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+# Label options listed in the baseline prompt
+LABEL_OPTIONS = {
+    "coating_label": ["greasy", "greasy_thick", "non_greasy"],
+    "tai_label": ["white", "light_yellow", "yellow"],
+    "zhi_label": ["regular", "dark", "light"],
+    "fissure_label": ["NaN", "light", "severe"],
+    "tooth_mk_label": ["NaN", "light", "severe"],
+}
+
+class LatencyModel:
+    """Distribution of simulated request latencies"""
+
+    DISTRIBUTIONS = ("constant", "uniform", "normal", "lognormal", "exponential")
+
+    def __init__(self, distribution="constant", mean=0.5, std=0.0, max_latency=None):
+        """
+        Initialize the latency model
+
+        Args:
+            distribution (str): One of DISTRIBUTIONS
+            mean (float): Mean latency in seconds
+            std (float): Standard deviation in seconds (ignored by constant and exponential;
+                uniform spans mean +/- sqrt(3) * std)
+            max_latency (float, optional): Upper bound applied to every sample
+        """
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.distribution = distribution
+        self.mean = mean
+        self.std = std
+        self.max_latency = max_latency
+
+    def sample(self, rng):
+        """
+        Draw one latency
+
+        Args:
+            rng (random.Random): Random number generator
+
+        Returns:
+            float: Latency in seconds
+        """
+        if self.distribution == "constant" or self.mean <= 0:
+            latency = self.mean
+        elif self.distribution == "uniform":
+            half_width = math.sqrt(3) * self.std
+            latency = rng.uniform(self.mean - half_width, self.mean + half_width)
+        elif self.distribution == "normal":
+            latency = rng.gauss(self.mean, self.std)
+        elif self.distribution == "lognormal":
+            # Parameters of the underlying normal giving the requested mean and std
+            sigma2 = math.log(1 + (self.std / self.mean) ** 2)
+            mu = math.log(self.mean) - sigma2 / 2
+            latency = rng.lognormvariate(mu, math.sqrt(sigma2))
+        else:
+            latency = rng.expovariate(1.0 / self.mean)
+
+        latency = max(0.0, latency)
+        if self.max_latency is not None:
+            latency = min(latency, self.max_latency)
+        return latency
+
+    def to_dict(self):
+        """Return the model parameters"""
+        return {
+            "distribution": self.distribution,
+            "mean": self.mean,
+            "std": self.std,
+            "max_latency": self.max_latency,
+        }
+
+class PayloadError(ValueError):
+    """A request body that the real endpoint would reject"""
+
+def extract_image_payload(payload):
+    """
+    Validate a chat completion request and return its image
+
+    Accepts the payload built by TongueVisionTest.build_messages: a system
+    message and a user message holding a text part and a base64 data URL.
+
+    Args:
+        payload (dict): Decoded request body
+
+    Returns:
+        str: The base64 image data
+
+    Raises:
+        PayloadError: If the request is malformed
+    """
+    if not isinstance(payload, dict):
+        raise PayloadError("Request body must be a JSON object")
+    if not payload.get("model"):
+        raise PayloadError("Missing 'model'")
+    messages = payload.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise PayloadError("'messages' must be a non-empty list")
+
+    for message in messages:
+        if not isinstance(message, dict) or message.get("role") not in ("system", "user", "assistant"):
+            raise PayloadError("Every message needs a valid 'role'")
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if not isinstance(part, dict) or part.get("type") != "image_url":
+                continue
+            url = (part.get("image_url") or {}).get("url", "")
+            prefix, _, data = url.partition(";base64,")
+            if not prefix.startswith("data:image/") or not data:
+                raise PayloadError("image_url must be a base64 data URL")
+            try:
+                base64.b64decode(data, validate=True)
+            except ValueError:
+                raise PayloadError("image_url holds invalid base64 data")
+            return data
+
+    raise PayloadError("No image_url content part found")
+
+class MockVisionServer:
+    """OpenAI-compatible stand-in for the vision model with fault injection"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=None, throttle_rate=0.0, server_error_rate=0.0,
+                 malformed_rate=0.0, max_rps=None, max_concurrent=None, retry_after=1.0, seed=0):
+        """
+        Initialize the server
+
+        Labels are derived from a hash of the image payload and the seed, so the
+        same image always gets the same answer. Faults are drawn from a seeded
+        generator in request order.
+
+        Args:
+            host (str): Interface to bind
+            port (int): Port to bind (0 picks a free port)
+            latency (LatencyModel, optional): Simulated latency of successful requests
+                (default: constant 0.5s)
+            throttle_rate (float): Fraction of requests answered with 429
+            server_error_rate (float): Fraction of requests answered with 500
+            malformed_rate (float): Fraction of successful responses whose content is not valid JSON
+            max_rps (float, optional): Requests per second above which requests get 429
+            max_concurrent (int, optional): Requests in flight above which requests get 429
+            retry_after (float): Retry-After header sent with injected 429s
+            seed (int): Seed of the label and fault generators
+        """
+        self.latency = latency or LatencyModel()
+        self.throttle_rate = throttle_rate
+        self.server_error_rate = server_error_rate
+        self.malformed_rate = malformed_rate
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.seed = seed
+
+        self.lock = Lock()
+        self.rng = random.Random(seed)
+        self.window = SlidingWindow.per_second(max_rps) if max_rps else None
+        self.in_flight = 0
+        self.counters = {
+            "requests": 0,
+            "ok": 0,
+            "malformed": 0,
+            "throttled": 0,
+            "rate_limited": 0,
+            "concurrency_limited": 0,
+            "server_errors": 0,
+            "bad_requests": 0,
+        }
+        self.started_at = time.monotonic()
+
+        self.httpd = ThreadingHTTPServer((host, port), _MockRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        """Base URL to pass as --base-url"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """Serve requests on a background thread"""
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def stats(self):
+        """Return request counters and the mean request rate"""
+        with self.lock:
+            stats = dict(self.counters)
+            elapsed = time.monotonic() - self.started_at
+            stats["in_flight"] = self.in_flight
+        stats["elapsed"] = elapsed
+        stats["requests_per_second"] = stats["requests"] / elapsed if elapsed > 0 else 0.0
+        return stats
+
+    def labels_for(self, image_data):
+        """Return the deterministic labels of an image payload"""
+        digest = hashlib.sha256(image_data.encode('ascii')).digest()
+        rng = random.Random(int.from_bytes(digest[:8], "big") ^ self.seed)
+        return {key: rng.choice(options) for key, options in LABEL_OPTIONS.items()}
+
+    def _admit(self):
+        """
+        Apply the rate and concurrency caps and draw the injected fault
+
+        Returns:
+            tuple: (status, error message, retry_after, malformed, latency); status is 200 when admitted
+        """
+        with self.lock:
+            self.counters["requests"] += 1
+            if self.window is not None:
+                now = time.monotonic()
+                self.window.expire(now)
+                wait = self.window.time_until(1, now)
+                if wait > 0:
+                    self.counters["rate_limited"] += 1
+                    return 429, "Rate limit exceeded", wait, False, 0.0
+                self.window.charge(1, now)
+            if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+                self.counters["concurrency_limited"] += 1
+                return 429, "Too many concurrent requests", self.retry_after, False, 0.0
+
+            draw = self.rng.random()
+            if draw < self.throttle_rate:
+                self.counters["throttled"] += 1
+                return 429, "Throttled (injected)", self.retry_after, False, 0.0
+            if draw < self.throttle_rate + self.server_error_rate:
+                self.counters["server_errors"] += 1
+                return 500, "Internal server error (injected)", None, False, 0.0
+
+            malformed = self.rng.random() < self.malformed_rate
+            self.counters["malformed" if malformed else "ok"] += 1
+            self.in_flight += 1
+            return 200, None, None, malformed, self.latency.sample(self.rng)
+
+    def handle_completion(self, body):
+        """
+        Answer one chat completion request
+
+        Args:
+            body (bytes): Raw request body
+
+        Returns:
+            tuple: (status, headers, response dict)
+        """
+        try:
+            payload = json.loads(body)
+            image_data = extract_image_payload(payload)
+        except (ValueError, PayloadError) as e:
+            with self.lock:
+                self.counters["requests"] += 1
+                self.counters["bad_requests"] += 1
+            return 400, {}, _error_body(str(e), "invalid_request_error")
+
+        status, message, retry_after, malformed, latency = self._admit()
+        if status != 200:
+            headers = {"Retry-After": f"{retry_after:.3f}"} if retry_after is not None else {}
+            error_type = "rate_limit_error" if status == 429 else "server_error"
+            return status, headers, _error_body(message, error_type)
+
+        try:
+            time.sleep(latency)
+            labels = self.labels_for(image_data)
+            content = json.dumps(labels)
+            if malformed:
+                # A truncated answer, like a response cut off mid-object
+                content = content[:len(content) // 2]
+            completion_id = hashlib.sha1(image_data[:1024].encode('ascii')).hexdigest()[:24]
+            response = {
+                "id": f"chatcmpl-mock-{completion_id}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": f"```json\n{content}\n```"},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": len(image_data) // 1000 + 800,
+                    "completion_tokens": len(content) // 4,
+                    "total_tokens": len(image_data) // 1000 + 800 + len(content) // 4,
+                },
+            }
+            return 200, {}, response
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+def _error_body(message, error_type):
+    """Build an error body in the OpenAI format"""
+    return {"error": {"message": message, "type": error_type, "code": None}}
+
+class _MockRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end of MockVisionServer"""
+
+    # Keep-alive, as used by the OpenAI client's connection pool
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            status, headers, response = self.server.mock.handle_completion(body)
+        else:
+            status, headers, response = 404, {}, _error_body(f"Unknown path {self.path}", "not_found")
+        self._send_json(status, response, headers)
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path.endswith("/stats"):
+            self._send_json(200, self.server.mock.stats())
+        elif path.endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send_json(404, _error_body(f"Unknown path {self.path}", "not_found"))
+
+    def _send_json(self, status, response, headers=None):
+        data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+def main():
+    """Run the mock server until interrupted"""
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock of the vision model for offline benchmarking")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                      help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8000,
+                      help="Port to bind")
+    parser.add_argument("--latency-dist", choices=LatencyModel.DISTRIBUTIONS, default="lognormal",
+                      help="Distribution of request latencies")
+    parser.add_argument("--latency-mean", type=float, default=0.5,
+                      help="Mean latency in seconds")
+    parser.add_argument("--latency-std", type=float, default=0.2,
+                      help="Standard deviation of the latency in seconds")
+    parser.add_argument("--latency-max", type=float, default=None,
+                      help="Upper bound of the latency in seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                      help="Fraction of requests answered with 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0,
+                      help="Fraction of requests answered with 500")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                      help="Fraction of responses whose content is not valid JSON")
+    parser.add_argument("--max-rps", type=float, default=None,
+                      help="Requests per second above which requests get 429")
+    parser.add_argument("--max-concurrent", type=int, default=None,
+                      help="Requests in flight above which requests get 429")
+    parser.add_argument("--retry-after", type=float, default=1.0,
+                      help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--seed", type=int, default=0,
+                      help="Seed of the label and fault generators")
+
+    args = parser.parse_args()
+
+    latency = LatencyModel(args.latency_dist, args.latency_mean, args.latency_std, args.latency_max)
+    server = MockVisionServer(
+        host=args.host,
+        port=args.port,
+        latency=latency,
+        throttle_rate=args.throttle_rate,
+        server_error_rate=args.server_error_rate,
+        malformed_rate=args.malformed_rate,
+        max_rps=args.max_rps,
+        max_concurrent=args.max_concurrent,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+    logger.info(f"Mock vision server listening on {server.base_url} (latency {latency.to_dict()})")
+    logger.info(f"Request counters: GET {server.base_url}/stats")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        logger.info(f"Final counters: {server.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+import os
+import json
+import base64
+import logging
+import argparse
+import functools
+import concurrent.futures
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+from tqdm import tqdm
+
+from baseline_test import (TongueVisionTest, PREPROCESS_MODES, DEFAULT_BASE_URL, raw_image_base64)
+from image_preprocessing import PREPROCESS_CONFIG, DENOISE_MODES, load_image, apply_preprocessing, roi_options
+from image_cache import encode_jpeg, read_sid_list
+from preprocess_profiles import PreprocessProfile, get_profile, registered_profiles
+from rate_limiter import RateLimiter
+from checkpoint import CheckpointWriter, checkpoint_paths, save_run_metadata
+from stage_timing import timed
+from response_cache import ResponseCache, DEFAULT_RESPONSE_CACHE
+from metrics_engine import INDICATORS
+from significance import compare_runs, format_interval, DEFAULT_RESAMPLES, DEFAULT_CONFIDENCE
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+def variant_name(preprocess):
+    """Name of a variant: the profile name, or the preprocess mode"""
+    return preprocess.name if isinstance(preprocess, PreprocessProfile) else preprocess
+
+class MultiVariantTest:
+    """Evaluate several preprocessing variants of every image in one pass"""
+
+    def __init__(self, variants, data_dir="data/TonguExpertDatabase", output_dir="out_put/multi_variant_results",
+                 model_name="qwen-vl-max", base_url=DEFAULT_BASE_URL, response_cache=None, roi=None):
+        """
+        Initialize one TongueVisionTest per variant
+
+        Args:
+            variants (list): Preprocess values (see TongueVisionTest): "none", "full",
+                profile names, profile files or PreprocessProfile objects
+            data_dir (str): Path to the data directory
+            output_dir (str): Output directory; each variant writes to a subdirectory
+            model_name (str): Name of the model to use for API calls
+            base_url (str): Base URL of the OpenAI-compatible API
+            response_cache (ResponseCache, optional): Response cache shared by the variants
+            roi (dict, optional): ROI options applied to every preprocessed variant
+        """
+        if not variants:
+            raise ValueError("At least one variant is needed")
+        self.output_dir = Path(output_dir)
+        self.roi = roi
+        self.testers = {}
+        for preprocess in variants:
+            if isinstance(preprocess, str) and preprocess not in PREPROCESS_MODES:
+                preprocess = get_profile(preprocess)
+            name = variant_name(preprocess)
+            if name in self.testers:
+                raise ValueError(f"Duplicate variant: {name}")
+            self.testers[name] = TongueVisionTest(
+                data_dir=data_dir, output_dir=self.output_dir / name, model_name=model_name,
+                base_url=base_url, response_cache=response_cache,
+                roi=roi if preprocess != "none" else None, preprocess=preprocess)
+
+        profiles = [tester.profile for tester in self.testers.values() if tester.profile is not None]
+        self.needs_mask = any(profile.needs_mask for profile in profiles) or \
+            ("full" in self.testers and PREPROCESS_CONFIG.get("denoise_mode") == "nlm_roi")
+        self.comparison = {}
+
+        # Bootstrap settings of the variants' confidence intervals and the paired tests;
+        # 0 resamples disables both
+        self.bootstrap_resamples = DEFAULT_RESAMPLES
+        self.bootstrap_confidence = DEFAULT_CONFIDENCE
+        self.bootstrap_workers = None
+
+    def load_data(self):
+        """Load labels and image paths once and share them with every variant"""
+        testers = list(self.testers.values())
+        testers[0].load_data()
+        for tester in testers[1:]:
+            tester.labels_df = testers[0].labels_df
+            tester.image_paths = testers[0].image_paths
+
+    def encode_variants(self, image_path):
+        """
+        Decode an image once and encode every variant of it
+
+        Args:
+            image_path (Path): Path to the image file
+
+        Returns:
+            dict: Variant name -> base64 payload
+        """
+        payloads = {}
+        raw = None
+        image = mask = None
+        if any(tester.preprocess != "none" for tester in self.testers.values()):
+            image, mask = load_image(image_path, self.roi, self.needs_mask)
+
+        for name, tester in self.testers.items():
+            if tester.preprocess != "none" and image is not None:
+                try:
+                    # Every stage returns a new array, so the decoded image is shared safely
+                    processed = apply_preprocessing(image, mask, tester.profile)
+                    with timed("encode"):
+                        buffer = encode_jpeg(processed)
+                    if buffer is not None:
+                        payloads[name] = base64.b64encode(buffer).decode('utf-8')
+                        continue
+                    logger.warning(f"JPEG encoding failed for {image_path} ({name}), using original image")
+                except Exception as e:
+                    logger.warning(f"Error preprocessing {image_path} ({name}): {e}. Using original image.")
+            if raw is None:
+                with timed("encode"):
+                    raw = raw_image_base64(image_path)
+            payloads[name] = raw
+        return payloads
+
+    def process_item(self, item, rate_limiter):
+        """
+        Encode the variants of one image and call the model for each of them
+
+        Args:
+            item (tuple): (sid, row)
+            rate_limiter (RateLimiter): Limiter shared by all variants
+
+        Returns:
+            dict: Variant name -> result, or None where the call failed
+        """
+        sid, _ = item
+        first = next(iter(self.testers.values()))
+        if sid not in first.image_paths:
+            logger.warning(f"Skipping SID {sid}: No image found.")
+            return {name: None for name in self.testers}
+        payloads = self.encode_variants(first.image_paths[sid])
+        return {name: tester.process_image(item, rate_limiter, payloads[name])
+                for name, tester in self.testers.items()}
+
+    def run_evaluation(self, sample_limit=None, max_workers=5, max_calls_per_second=2,
+                       max_calls_per_minute=None, max_tokens_per_minute=None, tokens_per_request=1000,
+                       sids=None, run_id=None):
+        """
+        Evaluate every variant on the same samples
+
+        Each worker decodes an image once, fans it out to all variants in memory
+        and sends the variants to the model one after another; every request goes
+        through one rate limiter, so the limits hold for the whole job.
+
+        Args:
+            sample_limit (int, optional): Number of random samples
+            max_workers (int): Images processed concurrently
+            max_calls_per_second (float): Maximum API calls per second across all variants
+            max_calls_per_minute (int, optional): Maximum API calls per minute
+            max_tokens_per_minute (int, optional): Maximum model tokens per minute
+            tokens_per_request (int): Estimated tokens per request
+            sids (list, optional): Evaluate exactly these SIDs instead of sampling
+            run_id (str, optional): Stream each variant's results to run_<run_id>.jsonl
+                in its output directory
+        """
+        first = next(iter(self.testers.values()))
+        if first.labels_df is None:
+            self.load_data()
+        items = first.select_items(sample_limit, sids)
+
+        rate_limiter = RateLimiter(
+            max_calls_per_second=max_calls_per_second,
+            max_concurrent_requests=max_workers,
+            max_calls_per_minute=max_calls_per_minute,
+            max_tokens_per_minute=max_tokens_per_minute,
+            tokens_per_request=tokens_per_request
+        )
+
+        for name, tester in self.testers.items():
+            tester.run_id = run_id
+            tester.checkpoint_path = None
+            tester.predictions = []
+            if run_id is not None:
+                tester.checkpoint_path, metadata_path = checkpoint_paths(tester.output_dir, run_id)
+                metadata = tester.run_metadata(run_id, [item[0] for item in items])
+                metadata["variants"] = list(self.testers)
+                save_run_metadata(metadata_path, metadata)
+                tester.checkpoint = CheckpointWriter(tester.checkpoint_path)
+
+        logger.info(f"Evaluating {len(self.testers)} variants ({', '.join(self.testers)}) on {len(items)} images "
+                    f"with {max_workers} workers and {max_calls_per_second} calls per second limit...")
+        failed = {name: [] for name in self.testers}
+        pbar = tqdm(total=len(items), desc="Processing images")
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                future_to_sid = {executor.submit(self.process_item, item, rate_limiter): item[0] for item in items}
+                for future in concurrent.futures.as_completed(future_to_sid):
+                    sid = future_to_sid[future]
+                    pbar.update(1)
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        logger.error(f"Exception processing SID {sid}: {e}")
+                        results = {name: None for name in self.testers}
+                    for name, result in results.items():
+                        if result is not None:
+                            self.testers[name].record_result(result)
+                        else:
+                            failed[name].append(sid)
+        finally:
+            pbar.close()
+            for tester in self.testers.values():
+                if tester.checkpoint is not None:
+                    tester.checkpoint.close()
+                    tester.checkpoint = None
+
+        limiter_stats = rate_limiter.stats()
+        logger.info(f"Rate limiter: mean wait {limiter_stats['mean_wait_time']:.3f}s, "
+                    f"max wait {limiter_stats['max_wait_time']:.3f}s, "
+                    f"peak queue depth {limiter_stats['max_queue_depth']}")
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        for name, tester in self.testers.items():
+            logger.info(f"Variant {name}: {len(items) - len(failed[name])} succeeded, {len(failed[name])} failed")
+            if failed[name]:
+                failed_file = tester.output_dir / f"failed_sids_{timestamp}.json"
+                with open(failed_file, 'w', encoding='utf-8') as f:
+                    json.dump(failed[name], f)
+                if len(tester.dead_letters) > 0:
+                    tester.dead_letters.save(tester.output_dir / f"dead_letter_{timestamp}.json")
+
+    def calculate_metrics(self):
+        """Calculate the metrics of every variant and compare them"""
+        for tester in self.testers.values():
+            tester.bootstrap_resamples = self.bootstrap_resamples
+            tester.bootstrap_confidence = self.bootstrap_confidence
+            tester.bootstrap_workers = self.bootstrap_workers
+            tester.calculate_metrics()
+        self.comparison = self.compare()
+
+    def compare(self):
+        """
+        Compare the variants
+
+        Besides each variant's own metrics, accuracy is recomputed on the SIDs
+        every variant answered, so the comparison is not skewed by failures.
+        Each variant is also tested against the baseline on the SIDs both
+        answered (McNemar and paired bootstrap, see significance.compare_runs).
+
+        Returns:
+            dict: Per-variant metrics, paired accuracy, differences to the first variant and
+                significance tests against it
+        """
+        encoded = {name: tester.encoded_results for name, tester in self.testers.items()
+                   if tester.encoded_results is not None}
+        common = functools.reduce(np.intersect1d, (run.sids for run in encoded.values())) \
+            if len(encoded) == len(self.testers) else np.empty(0, dtype=str)
+
+        baseline = next(iter(self.testers))
+        comparison = {"baseline": baseline, "paired_sample_count": len(common), "variants": {}}
+        for name, tester in self.testers.items():
+            metrics = tester.results or {}
+            paired = dict.fromkeys(INDICATORS + ["overall"])
+            if len(common):
+                flags = encoded[name].align(common).correct()
+                paired.update(zip(INDICATORS, flags.mean(axis=0).tolist()))
+                paired["overall"] = float(flags.all(axis=1).mean())
+            comparison["variants"][name] = {
+                "profile_fingerprint": tester.profile.fingerprint if tester.profile is not None else None,
+                "sample_count": metrics.get("overall", {}).get("sample_count", 0),
+                "accuracy": {key: metrics.get(key, {}).get("accuracy") for key in INDICATORS + ["overall"]},
+                "f1_macro": {key: metrics.get(key, {}).get("f1_macro") for key in INDICATORS},
+                "paired_accuracy": paired,
+            }
+        base_paired = comparison["variants"][baseline]["paired_accuracy"]
+        for name, row in comparison["variants"].items():
+            row["paired_delta"] = {key: (value - base_paired[key] if value is not None else None)
+                                   for key, value in row["paired_accuracy"].items()}
+            row["significance"] = None
+            if name != baseline and self.bootstrap_resamples and baseline in encoded and name in encoded:
+                row["significance"] = compare_runs(encoded[baseline], encoded[name], self.bootstrap_resamples,
+                                                   self.bootstrap_confidence, self.bootstrap_workers)
+        return comparison
+
+    def save_results(self):
+        """
+        Save every variant's results and the comparison report
+
+        Returns:
+            dict: Variant output files and the comparison files
+        """
+        output_files = {name: tester.save_results() for name, tester in self.testers.items()
+                        if tester.results}
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        comparison_file = self.output_dir / f"comparison_{timestamp}.json"
+        with open(comparison_file, 'w', encoding='utf-8') as f:
+            json.dump(self.comparison, f, ensure_ascii=False, indent=2)
+
+        report_file = self.output_dir / f"comparison_{timestamp}.md"
+        with open(report_file, 'w', encoding='utf-8') as f:
+            f.write("# Preprocessing Variant Comparison\n\n")
+            f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+            f.write(f"Baseline variant: {self.comparison['baseline']}\n\n")
+
+            f.write("## Accuracy\n\n")
+            f.write("| Variant | Samples | Overall | " + " | ".join(INDICATORS) + " |\n")
+            f.write("|---------|---------|---------|" + "|".join("------" for _ in INDICATORS) + "|\n")
+            for name, row in self.comparison["variants"].items():
+                values = [row["accuracy"][key] for key in ["overall"] + INDICATORS]
+                f.write(f"| {name} | {row['sample_count']} | "
+                        + " | ".join(f"{value:.4f}" if value is not None else "-" for value in values) + " |\n")
+
+            f.write(f"\n## Paired Accuracy ({self.comparison['paired_sample_count']} SIDs answered by every variant)\n\n")
+            f.write("| Variant | Overall | Δ Overall | " + " | ".join(INDICATORS) + " |\n")
+            f.write("|---------|---------|-----------|" + "|".join("------" for _ in INDICATORS) + "|\n")
+            for name, row in self.comparison["variants"].items():
+                paired = row["paired_accuracy"]
+                delta = row["paired_delta"]["overall"]
+                cells = [f"{paired['overall']:.4f}" if paired["overall"] is not None else "-",
+                         f"{delta:+.4f}" if delta is not None else "-"]
+                cells += [f"{paired[key]:.4f} ({row['paired_delta'][key]:+.4f})" if paired[key] is not None else "-"
+                          for key in INDICATORS]
+                f.write(f"| {name} | " + " | ".join(cells) + " |\n")
+
+            tested = {name: row["significance"] for name, row in self.comparison["variants"].items()
+                      if row.get("significance") and row["significance"]["sample_count"]}
+            if tested:
+                first = next(iter(tested.values()))
+                f.write(f"\n## Significance vs {self.comparison['baseline']}\n\n")
+                f.write(f"Differences are variant - baseline on the SIDs both answered, with "
+                        f"{first['confidence']:.0%} paired bootstrap intervals ({first['resamples']} resamples) "
+                        f"and exact McNemar p-values.\n\n")
+                f.write("| Variant | Indicator | Δ Accuracy | McNemar p | Bootstrap p | Δ Macro F1 | Bootstrap p |\n")
+                f.write("|---------|-----------|------------|-----------|-------------|------------|-------------|\n")
+                for name, significance in tested.items():
+                    for key in ["overall"] + INDICATORS:
+                        row = significance[key]
+                        delta = row["accuracy_delta"]
+                        cells = [f"{delta['estimate']:+.4f}{format_interval(delta['ci'])}",
+                                 f"{row['mcnemar']['p_value']:.4f}", f"{delta['p_value']:.4f}"]
+                        f1_delta = row.get("f1_macro_delta")
+                        cells += [f"{f1_delta['estimate']:+.4f}{format_interval(f1_delta['ci'])}",
+                                  f"{f1_delta['p_value']:.4f}"] if f1_delta else ["-", "-"]
+                        f.write(f"| {name} | {key} | " + " | ".join(cells) + " |\n")
+
+            f.write("\n## Macro F1\n\n")
+            f.write("| Variant | " + " | ".join(INDICATORS) + " |\n")
+            f.write("|---------|" + "|".join("------" for _ in INDICATORS) + "|\n")
+            for name, row in self.comparison["variants"].items():
+                f.write(f"| {name} | " + " | ".join(f"{row['f1_macro'][key]:.4f}"
+                                                  if row["f1_macro"][key] is not None else "-"
+                                                  for key in INDICATORS) + " |\n")
+
+        logger.info(f"Comparison saved to: {comparison_file}")
+        logger.info(f"Comparison report saved to: {report_file}")
+        return {"variants": output_files, "comparison_file": comparison_file, "report_file": report_file}
+
+def main():
+    """Evaluate several preprocessing variants in one run"""
+    parser = argparse.ArgumentParser(description="Evaluate several preprocessing variants of every image in one pass")
+    parser.add_argument("--variants", nargs="+", default=["none", "full"],
+                      help="Variants to compare: \"none\", \"full\", profile names "
+                           f"({', '.join(registered_profiles())}) or profile files; the first is the baseline")
+    parser.add_argument("--sample", type=int, default=10,
+                      help="Number of samples to process. Set to -1 for all samples.")
+    parser.add_argument("--sids", type=str, default=None,
+                      help="File listing the SIDs to evaluate (e.g. data/test.txt) instead of sampling")
+    parser.add_argument("--workers", type=int, default=5,
+                      help="Images processed concurrently")
+    parser.add_argument("--rate", type=float, default=2,
+                      help="Maximum API calls per second across all variants")
+    parser.add_argument("--rpm", type=int, default=None,
+                      help="Maximum API calls per minute")
+    parser.add_argument("--tpm", type=int, default=None,
+                      help="Maximum model tokens per minute")
+    parser.add_argument("--tokens-per-request", type=int, default=1000,
+                      help="Estimated tokens per request, charged against the --tpm budget")
+    parser.add_argument("--model", type=str, default="qwen-vl-max",
+                      help="Model name to use")
+    parser.add_argument("--base-url", type=str, default=DEFAULT_BASE_URL,
+                      help="Base URL for the API calls")
+    parser.add_argument("--output", type=str, default="out_put/multi_variant_results",
+                      help="Output directory; each variant gets a subdirectory")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                      help="Keep results in memory instead of streaming them to JSONL checkpoints")
+    parser.add_argument("--jpeg-quality", type=int, default=PREPROCESS_CONFIG["jpeg_quality"],
+                      help="JPEG quality (0-100) of preprocessed variants")
+    parser.add_argument("--denoise-mode", choices=DENOISE_MODES, default=PREPROCESS_CONFIG["denoise_mode"],
+                      help="Denoiser backend of the \"full\" variant")
+    parser.add_argument("--roi-crop", action="store_true",
+                      help="Crop preprocessed variants to the bounding box of the tongue mask")
+    parser.add_argument("--roi-margin", type=float, default=0.05,
+                      help="Margin around the mask bounding box, as a fraction of its size")
+    parser.add_argument("--max-edge", type=int, default=None,
+                      help="Downscale preprocessed variants so the longer edge is at most this many pixels")
+    parser.add_argument("--data-dir", type=str, default="data/TonguExpertDatabase",
+                      help="Path to the data directory")
+    parser.add_argument("--response-cache", type=str, default=str(DEFAULT_RESPONSE_CACHE),
+                      help="SQLite file caching model responses")
+    parser.add_argument("--no-response-cache", action="store_true",
+                      help="Disable the model response cache")
+    parser.add_argument("--replay-only", action="store_true",
+                      help="Answer every request from the response cache and never call the API")
+    parser.add_argument("--bootstrap", type=int, default=DEFAULT_RESAMPLES,
+                      help="Bootstrap resamples for confidence intervals and paired tests (0 disables them)")
+    parser.add_argument("--bootstrap-workers", type=int, default=None,
+                      help="Processes computing the bootstrap resamples")
+
+    args = parser.parse_args()
+
+    if args.replay_only and args.no_response_cache:
+        parser.error("--replay-only needs the response cache")
+    if not 0 <= args.jpeg_quality <= 100:
+        parser.error("--jpeg-quality must be between 0 and 100")
+    variants = []
+    for value in args.variants:
+        try:
+            variants.append(value if value in PREPROCESS_MODES else get_profile(value))
+        except (ValueError, OSError, ImportError) as e:
+            parser.error(str(e))
+
+    if "DASHCOPE_API_KEY" not in os.environ and not args.replay_only:
+        logger.error("DASHCOPE_API_KEY environment variable not set.")
+        logger.error("Please set the environment variable with your Alibaba Cloud Dashscope API key.")
+        return
+
+    PREPROCESS_CONFIG["denoise_mode"] = args.denoise_mode
+    PREPROCESS_CONFIG["jpeg_quality"] = args.jpeg_quality
+    roi = roi_options(args.roi_crop, args.roi_margin, args.max_edge)
+    response_cache = None
+    if not args.no_response_cache:
+        response_cache = ResponseCache(args.response_cache, replay_only=args.replay_only)
+    try:
+        test = MultiVariantTest(variants, data_dir=args.data_dir, output_dir=args.output, model_name=args.model,
+                                base_url=args.base_url, response_cache=response_cache, roi=roi)
+        test.bootstrap_resamples = args.bootstrap
+        test.bootstrap_workers = args.bootstrap_workers
+        sids = read_sid_list(args.sids) if args.sids else None
+        run_id = None if args.no_checkpoint else datetime.now().strftime('%Y%m%d_%H%M%S')
+        test.load_data()
+        test.run_evaluation(
+            sample_limit=None if args.sample < 0 else args.sample,
+            max_workers=args.workers,
+            max_calls_per_second=args.rate,
+            max_calls_per_minute=args.rpm,
+            max_tokens_per_minute=args.tpm,
+            tokens_per_request=args.tokens_per_request,
+            sids=sids,
+            run_id=run_id
+        )
+        test.calculate_metrics()
+        output_files = test.save_results()
+        logger.info(f"Comparison report saved to: {output_files['report_file']}")
+    finally:
+        if response_cache is not None:
+            response_cache.close()
+
+if __name__ == "__main__":
+    main()
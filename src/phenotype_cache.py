@@ -0,0 +1,262 @@
+import io
+import os
+import json
+import time
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from image_cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PHENOTYPE_CACHE = Path("data/phenotype_cache")
+
+# Bump when the cached layout changes; older entries are rebuilt
+CACHE_VERSION = 1
+
+# Rows per chunk when streaming a table
+DEFAULT_CHUNK_ROWS = 100_000
+
+def source_signature(path, previous=None):
+    """
+    Size, mtime and content hash of a source file
+
+    The file is only hashed when its size or mtime differ from the previous
+    signature, so an unchanged file costs one stat call.
+
+    Args:
+        path (str or Path): Source file
+        previous (dict, optional): Signature recorded earlier
+
+    Returns:
+        dict: {"size", "mtime_ns", "sha256"}; the contents are unchanged iff
+            the sha256 equals the previous one
+    """
+    stat = os.stat(path)
+    if previous is not None and (previous.get("size"), previous.get("mtime_ns")) == (stat.st_size, stat.st_mtime_ns):
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": previous["sha256"]}
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_sha256(path)}
+
+def read_phenotype_tsv(path):
+    """
+    Parse a Phenotypes TSV with explicit dtypes
+
+    The SID column stays a string, numeric columns become float32 and text
+    columns (the labels) become categoricals. Missing values follow
+    pandas.read_csv ("NA", "NaN", empty, ...).
+
+    Args:
+        path (str or Path): TSV file with a header row and a SID column
+
+    Returns:
+        pandas.DataFrame: The table
+    """
+    return _typed(pd.read_csv(path, sep='\t', dtype={"SID": str}))
+
+def _typed(df):
+    """Apply the read_phenotype_tsv dtypes to a parsed table"""
+    for column in df.columns:
+        if column == "SID":
+            continue
+        if pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].astype(np.float32)
+        else:
+            df[column] = df[column].astype("category")
+    return df
+
+def _entry_dir(cache_dir, source):
+    """Cache directory of one source file"""
+    return Path(cache_dir) / Path(source).stem
+
+def _write_entry(entry_dir, source, df, signature):
+    """Store a parsed table as .npy arrays plus a JSON schema"""
+    entry_dir.mkdir(exist_ok=True, parents=True)
+    numeric = [column for column in df.columns if df[column].dtype == np.float32]
+    categorical = [column for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)]
+    arrays = {
+        "sid": df["SID"].to_numpy(dtype=str),
+        # Column-major: each feature is contiguous, which is also pandas' block layout
+        "numeric": np.ascontiguousarray(df[numeric].to_numpy(dtype=np.float32).T),
+        "codes": np.ascontiguousarray(np.stack([df[column].cat.codes.to_numpy(dtype=np.int16)
+                                                for column in categorical])
+                                      if categorical else np.empty((0, len(df)), dtype=np.int16)),
+    }
+    for name, array in arrays.items():
+        tmp_path = entry_dir / f"{name}.tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, entry_dir / f"{name}.npy")
+
+    # The schema is written last and marks the entry as complete
+    meta = {
+        "version": CACHE_VERSION,
+        "source": str(Path(source).resolve()),
+        "size": signature["size"],
+        "mtime_ns": signature["mtime_ns"],
+        "sha256": signature["sha256"],
+        "rows": len(df),
+        "columns": list(df.columns),
+        "numeric": numeric,
+        "categorical": {column: df[column].cat.categories.tolist() for column in categorical},
+    }
+    _write_meta(entry_dir, meta)
+
+def _write_meta(entry_dir, meta):
+    """Write the schema of a cache entry atomically"""
+    tmp_path = entry_dir / "meta.json.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, entry_dir / "meta.json")
+
+def _read_entry(entry_dir, meta, mmap=True, rows=slice(None)):
+    """Rebuild the table, or a slice of its rows, from a cache entry"""
+    mmap_mode = 'r' if mmap else None
+    sids = np.load(entry_dir / "sid.npy", mmap_mode=mmap_mode)
+    numeric = np.load(entry_dir / "numeric.npy", mmap_mode=mmap_mode)
+    codes = np.load(entry_dir / "codes.npy", mmap_mode=mmap_mode)
+    if len(sids) != meta["rows"] or numeric.shape != (len(meta["numeric"]), meta["rows"]):
+        raise ValueError("cached arrays do not match the schema")
+    sids, numeric, codes = sids[rows], numeric[:, rows], codes[:, rows]
+
+    columns = {"SID": sids.astype(object)}
+    for position, column in enumerate(meta["numeric"]):
+        columns[column] = numeric[position]
+    for position, (column, categories) in enumerate(meta["categorical"].items()):
+        columns[column] = pd.Categorical.from_codes(codes[position], categories=categories)
+    return pd.DataFrame(columns, columns=meta["columns"])
+
+def _valid_meta(entry_dir, path):
+    """
+    Schema of a cache entry if it matches the source contents
+
+    Returns:
+        tuple: (meta or None, source signature or None)
+    """
+    if not (entry_dir / "meta.json").exists():
+        return None, None
+    try:
+        with open(entry_dir / "meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable phenotype cache entry {entry_dir}: {e}")
+        return None, None
+    if meta.get("version") != CACHE_VERSION:
+        return None, None
+
+    signature = source_signature(path, meta)
+    if signature["sha256"] != meta["sha256"]:
+        return None, signature
+    if (meta["size"], meta["mtime_ns"]) != (signature["size"], signature["mtime_ns"]):
+        # Same contents under a new mtime (copied or touched)
+        meta.update(signature)
+        _write_meta(entry_dir, meta)
+    return meta, signature
+
+def load_phenotype_table(path, cache_dir=DEFAULT_PHENOTYPE_CACHE, mmap=True, refresh=False):
+    """
+    Load a Phenotypes TSV through the binary cache
+
+    The first load parses the TSV (see read_phenotype_tsv) and stores it as
+    .npy arrays; later loads read the arrays, memory-mapping the feature
+    matrix. An entry is valid while the source size and mtime match; when
+    they don't, the source is hashed and the entry is reused if the contents
+    are unchanged (e.g. after a copy or touch), otherwise rebuilt.
+
+    Args:
+        path (str or Path): Phenotypes TSV
+        cache_dir (str or Path, optional): Cache directory; None parses the TSV directly
+        mmap (bool): Memory-map the cached arrays instead of reading them into memory
+        refresh (bool): Rebuild the entry even if it is valid
+
+    Returns:
+        pandas.DataFrame: The table, with float32 features and categorical labels
+    """
+    path = Path(path)
+    if cache_dir is None:
+        return read_phenotype_tsv(path)
+
+    entry_dir = _entry_dir(cache_dir, path)
+    meta, signature = (None, None) if refresh else _valid_meta(entry_dir, path)
+    if meta is not None:
+        try:
+            return _read_entry(entry_dir, meta, mmap)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Rebuilding phenotype cache entry {entry_dir}: {e}")
+
+    start = time.perf_counter()
+    df = read_phenotype_tsv(path)
+    try:
+        _write_entry(entry_dir, path, df, signature or source_signature(path))
+        logger.info(f"Cached {path.name} ({df.shape[0]}x{df.shape[1]}) in {entry_dir} "
+                    f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+    except OSError as e:
+        logger.warning(f"Could not cache {path}: {e}")
+    return df
+
+def phenotype_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS, cache_dir=DEFAULT_PHENOTYPE_CACHE):
+    """
+    Split a Phenotypes table into chunks that can be read independently
+
+    A valid cache entry is split into row ranges of its memory-mapped
+    arrays. Otherwise the TSV is split into byte ranges that start and end on
+    line boundaries, sized from the average line length of the first block;
+    the TSV is not cached, since that would parse it whole.
+
+    Args:
+        path (str or Path): Phenotypes TSV
+        chunk_rows (int): Approximate rows per chunk
+        cache_dir (str or Path, optional): Cache directory; None always splits the TSV
+
+    Returns:
+        list: Picklable chunk descriptions for read_phenotype_chunk
+    """
+    path = Path(path)
+    if cache_dir is not None:
+        entry_dir = _entry_dir(cache_dir, path)
+        meta, _ = _valid_meta(entry_dir, path)
+        if meta is not None:
+            return [{"cache": str(entry_dir), "columns": meta["columns"], "start": start,
+                     "stop": min(start + chunk_rows, meta["rows"])}
+                    for start in range(0, meta["rows"], chunk_rows)]
+
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        columns = f.readline().decode('utf-8').rstrip('\r\n').split('\t')
+        data_start = f.tell()
+        sample = f.read(1 << 20)
+        line_bytes = len(sample) / max(sample.count(b'\n'), 1)
+        chunk_bytes = max(int(line_bytes * chunk_rows), 1)
+        bounds = [data_start]
+        while bounds[-1] + chunk_bytes < size:
+            f.seek(bounds[-1] + chunk_bytes)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+        bounds.append(size)
+    return [{"tsv": str(path), "columns": columns, "start": start, "stop": stop}
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+def read_phenotype_chunk(chunk):
+    """
+    Read one chunk from phenotype_chunks
+
+    Args:
+        chunk (dict): Chunk description
+
+    Returns:
+        pandas.DataFrame: The chunk's rows, typed like load_phenotype_table
+    """
+    if "cache" in chunk:
+        entry_dir = Path(chunk["cache"])
+        with open(entry_dir / "meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return _read_entry(entry_dir, meta, rows=slice(chunk["start"], chunk["stop"]))
+
+    with open(chunk["tsv"], 'rb') as f:
+        f.seek(chunk["start"])
+        block = f.read(chunk["stop"] - chunk["start"])
+    df = pd.read_csv(io.BytesIO(block), sep='\t', header=None, names=chunk["columns"], dtype={"SID": str})
+    return _typed(df)
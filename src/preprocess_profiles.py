@@ -0,0 +1,342 @@
+import json
+import runpy
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+from image_preprocessing import (DENOISE_MODES, FusedPreprocessor, denoise_image, white_balance,
+                                 light_normalization, color_correction, retinex_enhancement,
+                                 gamma_correction, contrast_enhancement)
+
+logger = logging.getLogger(__name__)
+
+# Stage functions by name, see register_stage
+_STAGES = {}
+# Named profiles, see register_profile
+_PROFILES = {}
+
+PROFILE_SUFFIXES = (".json", ".yaml", ".yml", ".py")
+
+def register_stage(name, func=None, defaults=None, fused_params=None):
+    """
+    Register a preprocessing stage
+
+    Can be used directly or as a decorator:
+
+        @register_stage("sharpen", defaults={"amount": 0.5})
+        def sharpen(image, mask=None, amount=0.5):
+            ...
+
+    Args:
+        name (str): Stage name used in profiles
+        func (callable, optional): Function (image, mask=None, **params) -> image
+        defaults (dict, optional): Default parameters; profiles may only set these keys
+        fused_params (dict, optional): Parameter -> FusedPreprocessor config key, for
+            stages FusedPreprocessor implements itself
+
+    Returns:
+        callable: func, or a decorator when func is omitted
+    """
+    def register(func):
+        if name in _STAGES:
+            logger.warning(f"Replacing preprocessing stage {name}")
+        _STAGES[name] = {
+            "func": func,
+            "defaults": dict(defaults or {}),
+            "fused_params": dict(fused_params) if fused_params is not None else None,
+        }
+        return func
+
+    if func is None:
+        return register
+    return register(func)
+
+def registered_stages():
+    """Return the names of the registered stages"""
+    return sorted(_STAGES)
+
+def run_stage(name, image, mask=None, **params):
+    """
+    Run one registered stage
+
+    Args:
+        name (str): Stage name
+        image (numpy.ndarray): The input image in BGR format
+        mask (numpy.ndarray, optional): Tongue mask of the image
+        **params: Stage parameters (missing ones take the stage defaults)
+
+    Returns:
+        numpy.ndarray: The processed image
+    """
+    try:
+        spec = _STAGES[name]
+    except KeyError:
+        raise ValueError(f"Unknown preprocessing stage: {name}")
+    return spec["func"](image, mask=mask, **dict(spec["defaults"], **params))
+
+# Built-in stages; the defaults are the values preprocess_image has always used
+register_stage("denoise",
+               lambda image, mask=None, strength=5, mode="nlm": denoise_image(image, strength, mode, mask),
+               defaults={"strength": 5, "mode": "nlm"},
+               fused_params={"strength": "denoise_strength", "mode": "denoise_mode"})
+register_stage("white_balance", lambda image, mask=None: white_balance(image), fused_params={})
+register_stage("light_normalization",
+               lambda image, mask=None, clip_limit=3.0, tile_grid_size=8:
+                   light_normalization(image, clip_limit, tile_grid_size),
+               defaults={"clip_limit": 3.0, "tile_grid_size": 8},
+               fused_params={"clip_limit": "clahe_clip_limit", "tile_grid_size": "clahe_tile_grid"})
+register_stage("color_correction", lambda image, mask=None: color_correction(image), fused_params={})
+register_stage("retinex",
+               lambda image, mask=None, sigma=10: retinex_enhancement(image, sigma),
+               defaults={"sigma": 10},
+               fused_params={"sigma": "retinex_sigma"})
+register_stage("gamma",
+               lambda image, mask=None, gamma=1.2: gamma_correction(image, gamma),
+               defaults={"gamma": 1.2},
+               fused_params={"gamma": "gamma"})
+register_stage("contrast",
+               lambda image, mask=None, alpha=1.1, beta=5: contrast_enhancement(image, alpha, beta),
+               defaults={"alpha": 1.1, "beta": 5},
+               fused_params={"alpha": "contrast_alpha", "beta": "contrast_beta"})
+
+# FusedPreprocessors per thread, keyed by profile fingerprint
+_fused_local = threading.local()
+
+class PreprocessProfile:
+    """A named, ordered list of preprocessing stages and their parameters"""
+
+    def __init__(self, name, stages, description=""):
+        """
+        Define a profile
+
+        Args:
+            name (str): Profile name
+            stages (list): Stage names, or dicts {"stage": name, <param>: value, ...}
+            description (str): Free-text description
+        """
+        self.name = name
+        self.description = description
+        # File the profile was loaded from, set by load_profiles; see restore_profile
+        self.source = None
+        self.stages = []
+        for entry in stages:
+            if isinstance(entry, str):
+                stage, params = entry, {}
+            else:
+                params = dict(entry)
+                stage = params.pop("stage", None)
+            if stage not in _STAGES:
+                raise ValueError(f"Profile {name}: unknown preprocessing stage {stage!r}")
+            spec = _STAGES[stage]
+            unknown = set(params) - set(spec["defaults"])
+            if unknown:
+                raise ValueError(f"Profile {name}: unknown parameters {sorted(unknown)} for stage {stage}")
+            # Fill in defaults so the fingerprint covers every effective parameter
+            self.stages.append((stage, dict(spec["defaults"], **params)))
+
+        for stage, params in self.stages:
+            if stage == "denoise" and params["mode"] not in DENOISE_MODES:
+                raise ValueError(f"Profile {name}: unknown denoise mode {params['mode']!r}")
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a profile from its dict form (as stored in JSON or YAML)"""
+        return cls(data["name"], data["stages"], data.get("description", ""))
+
+    def to_dict(self):
+        """Return the profile as a JSON-serializable dict"""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "stages": [dict({"stage": stage}, **params) for stage, params in self.stages],
+        }
+
+    @property
+    def fingerprint(self):
+        """Hex digest of the stages and parameters; the name and description do not count"""
+        payload = json.dumps([[stage, params] for stage, params in self.stages], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def missing_stages(self):
+        """Return the stages of the profile that are not registered in this process"""
+        return sorted({stage for stage, _ in self.stages if stage not in _STAGES})
+
+    @property
+    def needs_mask(self):
+        """True if a stage uses the tongue mask"""
+        return any(stage == "denoise" and params["mode"] == "nlm_roi" for stage, params in self.stages)
+
+    def fused_config(self):
+        """
+        Return the FusedPreprocessor config running this profile, or None
+
+        Profiles qualify when every stage is built into FusedPreprocessor and
+        no stage appears twice with different parameters.
+        """
+        config = {}
+        for stage, params in self.stages:
+            fused_params = _STAGES[stage]["fused_params"]
+            if fused_params is None:
+                return None
+            for param, value in params.items():
+                key = fused_params[param]
+                if config.get(key, value) != value:
+                    return None
+                config[key] = value
+        return config
+
+    def apply(self, image, mask=None):
+        """
+        Run the profile on one image
+
+        Built-in stages run through a per-thread FusedPreprocessor; profiles
+        with custom stages call the stage functions in order.
+
+        Args:
+            image (numpy.ndarray): The input image in BGR format
+            mask (numpy.ndarray, optional): Tongue mask of the image
+
+        Returns:
+            numpy.ndarray: The preprocessed image
+        """
+        config = self.fused_config()
+        if config is not None:
+            preprocessors = getattr(_fused_local, "preprocessors", None)
+            if preprocessors is None:
+                preprocessors = _fused_local.preprocessors = {}
+            preprocessor = preprocessors.get(self.fingerprint)
+            if preprocessor is None:
+                preprocessor = FusedPreprocessor([stage for stage, _ in self.stages], config)
+                preprocessors[self.fingerprint] = preprocessor
+            return preprocessor.process(image, mask=mask)
+
+        for stage, params in self.stages:
+            image = run_stage(stage, image, mask, **params)
+        return image
+
+    def __repr__(self):
+        return f"PreprocessProfile({self.name!r}, fingerprint={self.fingerprint[:12]})"
+
+def register_profile(profile):
+    """
+    Register a profile under its name
+
+    Args:
+        profile (PreprocessProfile or dict): Profile or its dict form
+
+    Returns:
+        PreprocessProfile: The registered profile
+    """
+    if isinstance(profile, dict):
+        profile = PreprocessProfile.from_dict(profile)
+    if profile.name in _PROFILES and _PROFILES[profile.name].fingerprint != profile.fingerprint:
+        logger.warning(f"Replacing preprocessing profile {profile.name}")
+    _PROFILES[profile.name] = profile
+    return profile
+
+def registered_profiles():
+    """Return the names of the registered profiles"""
+    return sorted(_PROFILES)
+
+def load_profiles(path):
+    """
+    Load and register the profiles defined in a file
+
+    JSON and YAML files hold one profile dict, a list of them, or
+    {"profiles": [...]}; YAML needs PyYAML. Python files are executed and
+    either call register_profile themselves or define a PROFILES list.
+
+    Args:
+        path (str or Path): Profile file
+
+    Returns:
+        list: The loaded PreprocessProfile objects
+    """
+    path = Path(path)
+    if path.suffix == ".py":
+        before = dict(_PROFILES)
+        namespace = runpy.run_path(str(path))
+        loaded = [register_profile(profile) for profile in namespace.get("PROFILES", [])]
+        loaded += [profile for name, profile in _PROFILES.items()
+                   if before.get(name) is not profile and profile not in loaded]
+        return _set_source(loaded, path)
+
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.suffix in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(f"PyYAML is required to read {path}; install it or use a JSON profile")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("profiles", [data])
+    return _set_source([register_profile(entry) for entry in data], path)
+
+def _set_source(profiles, path):
+    """Record the file the profiles were loaded from"""
+    source = str(path.resolve())
+    for profile in profiles:
+        profile.source = source
+    return profiles
+
+def restore_profile(profile):
+    """
+    Make the stages of a profile received from another process available
+
+    Stages registered at runtime (with register_stage or by a .py profile file)
+    only exist in the process that registered them; worker processes started
+    with spawn import this module with the built-in stages alone. Profiles
+    loaded from a file are loaded again from it.
+
+    Args:
+        profile (PreprocessProfile): Profile passed to the worker
+
+    Raises:
+        ValueError: If some stages of the profile are still not registered
+    """
+    missing = profile.missing_stages()
+    if missing and profile.source is not None:
+        load_profiles(profile.source)
+        missing = profile.missing_stages()
+    if missing:
+        raise ValueError(f"Profile {profile.name}: stages {missing} are not registered in this process; "
+                         "define them in a profile file so worker processes can load them")
+
+def get_profile(name):
+    """
+    Look up a profile by name or load it from a file
+
+    Args:
+        name (str): Registered profile name, or the path of a profile file
+            (the file must define exactly one profile, or one named after the file)
+
+    Returns:
+        PreprocessProfile: The profile
+    """
+    if name in _PROFILES:
+        return _PROFILES[name]
+    path = Path(name)
+    if path.suffix in PROFILE_SUFFIXES and path.exists():
+        loaded = load_profiles(path)
+        if len(loaded) == 1:
+            return loaded[0]
+        for profile in loaded:
+            if profile.name == path.stem:
+                return profile
+        raise ValueError(f"{path} defines several profiles; register them with load_profiles and pass a name")
+    raise ValueError(f"Unknown preprocessing profile {name!r}; registered: {', '.join(registered_profiles())}")
+
+# The chain of preprocess_image with its original parameters
+register_profile(PreprocessProfile(
+    "default",
+    ["denoise", "white_balance", "light_normalization", "color_correction", "retinex", "gamma", "contrast"],
+    "Original preprocessing chain"))
+# Same chain with the fast guided-filter denoiser
+register_profile(PreprocessProfile(
+    "fast",
+    [{"stage": "denoise", "mode": "guided"}, "white_balance", "light_normalization",
+     "color_correction", "retinex", "gamma", "contrast"],
+    "Default chain with guided-filter denoising"))
@@ -0,0 +1,207 @@
+import time
+import logging
+from collections import deque
+from threading import Condition
+
+logger = logging.getLogger(__name__)
+
+class SlidingWindow:
+    """A budget of `limit` units in any window of `period` seconds"""
+
+    def __init__(self, limit, period):
+        """
+        Initialize the window empty
+
+        Unlike a token bucket that starts full, the window never admits more than
+        `limit` units in any `period`, including the first one.
+
+        Args:
+            limit (float): Maximum units charged within any window
+            period (float): Window length in seconds
+        """
+        self.limit = float(limit)
+        self.period = float(period)
+        # (timestamp, amount) of every charge still inside the window
+        self.entries = deque()
+        self.total = 0.0
+
+    @classmethod
+    def per_second(cls, rate):
+        """Return a window admitting `rate` calls per second, spacing them out when rate < 1"""
+        if rate >= 1:
+            return cls(rate, 1.0)
+        return cls(1, 1.0 / rate)
+
+    def expire(self, now):
+        """Drop the charges that have left the window"""
+        while self.entries and self.entries[0][0] <= now - self.period:
+            self.total -= self.entries.popleft()[1]
+
+    def time_until(self, amount, now):
+        """Return the seconds until `amount` units fit in the window (0 if they do now)"""
+        # A request larger than the budget can never fit in full, so it only waits for an empty window
+        amount = min(amount, self.limit)
+        if self.total + amount <= self.limit:
+            return 0.0
+        remaining = self.total
+        for timestamp, charged in self.entries:
+            remaining -= charged
+            if remaining + amount <= self.limit:
+                return timestamp + self.period - now
+        return self.entries[-1][0] + self.period - now
+
+    def charge(self, amount, now):
+        """Record `amount` units at time `now`"""
+        self.entries.append((now, amount))
+        self.total += amount
+
+    def refund(self, amount):
+        """Return up to `amount` units, taken from the most recent charges"""
+        while amount > 0 and self.entries:
+            timestamp, charged = self.entries.pop()
+            returned = min(amount, charged)
+            amount -= returned
+            self.total -= returned
+            if charged > returned:
+                self.entries.append((timestamp, charged - returned))
+                break
+
+class RateLimiter:
+    """A rate limiter to prevent exceeding API limits"""
+
+    def __init__(self, max_calls_per_second=1, max_concurrent_requests=5,
+                 max_calls_per_minute=None, max_tokens_per_minute=None, tokens_per_request=1000):
+        """
+        Initialize the rate limiter
+
+        Requests-per-second, requests-per-minute and tokens-per-minute budgets are
+        enforced together with one sliding window each, so no window of the budget's
+        length ever holds more than the budget. Waiting happens on a
+        condition variable, so the lock is never held while a thread sleeps and
+        release() is never blocked by waiters.
+
+        Args:
+            max_calls_per_second (float): Maximum number of calls allowed per second
+            max_concurrent_requests (int): Maximum number of concurrent requests
+            max_calls_per_minute (float, optional): Maximum number of calls allowed per minute
+            max_tokens_per_minute (float, optional): Maximum number of model tokens allowed per minute
+            tokens_per_request (int): Estimated tokens per request, charged against the TPM budget
+        """
+        self.max_calls_per_second = max_calls_per_second
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_calls_per_minute = max_calls_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.tokens_per_request = tokens_per_request
+
+        self.request_windows = []
+        if max_calls_per_second:
+            self.request_windows.append(SlidingWindow.per_second(max_calls_per_second))
+        if max_calls_per_minute:
+            self.request_windows.append(SlidingWindow(max_calls_per_minute, 60.0))
+        self.token_window = None
+        if max_tokens_per_minute:
+            self.token_window = SlidingWindow(max_tokens_per_minute, 60.0)
+
+        self.condition = Condition()
+        self.active_requests = 0
+
+        # Counters
+        self.waiting = 0
+        self.max_queue_depth = 0
+        self.total_acquired = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _time_until_ready(self, tokens, now):
+        """Return the seconds until every budget admits one request of `tokens` tokens"""
+        wait_time = 0.0
+        for window in self.request_windows:
+            window.expire(now)
+            wait_time = max(wait_time, window.time_until(1, now))
+        if self.token_window is not None:
+            self.token_window.expire(now)
+            wait_time = max(wait_time, self.token_window.time_until(tokens, now))
+        return wait_time
+
+    def acquire(self, tokens=None):
+        """
+        Acquires permission to make an API call, blocking if necessary.
+
+        Args:
+            tokens (int, optional): Tokens the request is expected to use (default: tokens_per_request)
+
+        Returns:
+            float: time.monotonic() at which the call was admitted and charged to the budgets
+        """
+        if tokens is None:
+            tokens = self.tokens_per_request
+        start = time.monotonic()
+
+        with self.condition:
+            self.waiting += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.waiting)
+            try:
+                while True:
+                    if self.active_requests >= self.max_concurrent_requests:
+                        # Woken up by release()
+                        self.condition.wait()
+                        continue
+
+                    now = time.monotonic()
+                    wait_time = self._time_until_ready(tokens, now)
+                    if wait_time <= 0:
+                        break
+                    # Sleep without holding the lock until enough charges leave the windows
+                    self.condition.wait(timeout=wait_time)
+
+                for window in self.request_windows:
+                    window.charge(1, now)
+                if self.token_window is not None:
+                    self.token_window.charge(tokens, now)
+                self.active_requests += 1
+            finally:
+                self.waiting -= 1
+
+            waited = time.monotonic() - start
+            self.total_acquired += 1
+            self.total_wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            return now
+
+    def release(self, tokens_used=None, tokens_reserved=None):
+        """
+        Releases a request slot.
+
+        Args:
+            tokens_used (int, optional): Actual tokens used by the request, if known
+            tokens_reserved (int, optional): Tokens charged at acquire() (default: tokens_per_request)
+        """
+        with self.condition:
+            self.active_requests -= 1
+            if self.token_window is not None and tokens_used is not None:
+                # Settle the difference between the estimate and the real usage
+                if tokens_reserved is None:
+                    tokens_reserved = self.tokens_per_request
+                if tokens_used > tokens_reserved:
+                    self.token_window.charge(tokens_used - tokens_reserved, time.monotonic())
+                else:
+                    self.token_window.refund(tokens_reserved - tokens_used)
+            self.condition.notify_all()
+
+    def stats(self):
+        """
+        Return the limiter counters
+
+        Returns:
+            dict: Acquired calls, total/mean/max wait time in seconds, current and peak queue depth
+        """
+        with self.condition:
+            return {
+                "acquired": self.total_acquired,
+                "total_wait_time": self.total_wait_time,
+                "mean_wait_time": self.total_wait_time / self.total_acquired if self.total_acquired else 0.0,
+                "max_wait_time": self.max_wait_time,
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_queue_depth,
+                "active_requests": self.active_requests,
+            }
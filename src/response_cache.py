@@ -0,0 +1,148 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from pathlib import Path
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESPONSE_CACHE = Path("data/response_cache.sqlite")
+
+def text_sha256(text):
+    """
+    Hash a string
+
+    Args:
+        text (str): Text to hash
+
+    Returns:
+        str: Hex digest
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """SQLite cache of raw model responses keyed by everything that determines a request"""
+
+    def __init__(self, path=DEFAULT_RESPONSE_CACHE, replay_only=False):
+        """
+        Open (and create if needed) the cache database
+
+        A request is identified by the API endpoint, the model name, the hash
+        of the prompt template, the hash of the base64 image payload, the
+        temperature and max_tokens. In replay-only mode the caller must not send requests for
+        misses; the flag is kept here so every engine sees the same setting.
+
+        Args:
+            path (str or Path): SQLite database file
+            replay_only (bool): Serve responses from the cache only, never from the network
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self.replay_only = replay_only
+
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " prompt_hash TEXT NOT NULL,"
+                " image_hash TEXT NOT NULL,"
+                " temperature REAL,"
+                " max_tokens INTEGER,"
+                " response TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " base_url TEXT)"
+            )
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(responses)")}
+            if "base_url" not in columns:
+                # Databases from before the endpoint was part of the key; their keys no longer match
+                self.connection.execute("ALTER TABLE responses ADD COLUMN base_url TEXT")
+            self.connection.commit()
+
+    @staticmethod
+    def make_key(model, prompt_hash, image_hash, temperature, max_tokens, base_url):
+        """
+        Build the cache key of a request
+
+        The endpoint is part of the key so responses of a mock or proxy server
+        are never replayed as output of the real model.
+
+        Args:
+            model (str): Model name
+            prompt_hash (str): Hash of the prompt template
+            image_hash (str): Hash of the base64 image payload
+            temperature (float): Sampling temperature
+            max_tokens (int): Maximum completion tokens
+            base_url (str): Base URL of the API endpoint
+
+        Returns:
+            tuple: (key, fields) where fields are the stored key components
+        """
+        fields = {
+            "base_url": base_url,
+            "model": model,
+            "prompt_hash": prompt_hash,
+            "image_hash": image_hash,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        return text_sha256(json.dumps(fields, sort_keys=True)), fields
+
+    def get(self, key):
+        """
+        Look up a cached response
+
+        Args:
+            key (str): Cache key from make_key
+
+        Returns:
+            str: Raw model response or None on a miss
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, fields, response):
+        """
+        Store a response, replacing any earlier one for the same request
+
+        Args:
+            key (str): Cache key from make_key
+            fields (dict): Key components from make_key
+            response (str): Raw model response
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (key, model, prompt_hash, image_hash, temperature, max_tokens, response, created, base_url)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, fields["model"], fields["prompt_hash"], fields["image_hash"],
+                 fields["temperature"], fields["max_tokens"], response, time.time(), fields["base_url"]))
+            self.connection.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        """Return hit/miss counters"""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.connection.close()
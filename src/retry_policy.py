@@ -0,0 +1,169 @@
+import json
+import random
+import logging
+from pathlib import Path
+from threading import Lock
+
+from api_errors import THROTTLED, SERVER_ERROR, TIMEOUT, CONNECTION, PARSE_ERROR
+
+logger = logging.getLogger(__name__)
+
+class RetryPolicy:
+    """Exponential backoff with full jitter for one error class"""
+
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=30.0, multiplier=2.0):
+        """
+        Initialize the policy
+
+        Args:
+            max_attempts (int): Total attempts including the first one
+            base_delay (float): Backoff ceiling for the first retry in seconds
+            max_delay (float): Upper bound of the backoff ceiling in seconds
+            multiplier (float): Growth factor of the ceiling per retry
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Return the sleep before the next attempt
+
+        Args:
+            attempt (int): Number of attempts made so far (1 after the first failure)
+            retry_after (float, optional): Delay requested by the server, used as a lower bound
+
+        Returns:
+            float: Seconds to wait
+        """
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def to_dict(self):
+        """Return the policy parameters"""
+        return {
+            "max_attempts": self.max_attempts,
+            "base_delay": self.base_delay,
+            "max_delay": self.max_delay,
+            "multiplier": self.multiplier,
+        }
+
+def default_retry_policies(max_attempts=None):
+    """
+    Build the retry policies used by TongueVisionTest
+
+    Args:
+        max_attempts (int, optional): Overrides the attempt count of every policy
+
+    Returns:
+        dict: Error class -> RetryPolicy. Classes without a policy are not retried.
+    """
+    policies = {
+        THROTTLED: RetryPolicy(max_attempts=6, base_delay=2.0, max_delay=60.0),
+        SERVER_ERROR: RetryPolicy(max_attempts=4, base_delay=1.0, max_delay=30.0),
+        TIMEOUT: RetryPolicy(max_attempts=3, base_delay=2.0, max_delay=30.0),
+        CONNECTION: RetryPolicy(max_attempts=4, base_delay=1.0, max_delay=30.0),
+        PARSE_ERROR: RetryPolicy(max_attempts=2, base_delay=0.5, max_delay=5.0),
+    }
+    if max_attempts is not None:
+        for policy in policies.values():
+            policy.max_attempts = max_attempts
+    return policies
+
+def next_retry_delay(policies, error_class, attempt, retry_after=None):
+    """
+    Decide whether a failed attempt is retried
+
+    Args:
+        policies (dict): Error class -> RetryPolicy
+        error_class (str): Class of the failure
+        attempt (int): Number of attempts made so far
+        retry_after (float, optional): Delay requested by the server
+
+    Returns:
+        float: Seconds to wait before retrying, or None if retries are exhausted
+    """
+    policy = policies.get(error_class)
+    if policy is None or attempt >= policy.max_attempts:
+        return None
+    return policy.delay(attempt, retry_after)
+
+class DeadLetterQueue:
+    """Thread-safe collection of SIDs that exhausted their retries"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.entries = {}
+
+    def add(self, sid, error_class, message, attempts):
+        """
+        Record a failed SID, replacing any earlier record for it
+
+        Args:
+            sid (str): Image identifier
+            error_class (str): Class of the last failure
+            message (str): Description of the last failure
+            attempts (int): Number of attempts made
+        """
+        with self.lock:
+            self.entries[sid] = {
+                "SID": sid,
+                "error_class": error_class,
+                "message": message,
+                "attempts": attempts,
+            }
+
+    def discard(self, sid):
+        """Remove a SID, e.g. after it succeeded on requeue"""
+        with self.lock:
+            self.entries.pop(sid, None)
+
+    def sids(self, error_classes=None):
+        """
+        Return the dead-lettered SIDs
+
+        Args:
+            error_classes (iterable, optional): Only return SIDs whose last failure is in these classes
+
+        Returns:
+            list: SIDs
+        """
+        with self.lock:
+            return [
+                sid for sid, entry in self.entries.items()
+                if error_classes is None or entry["error_class"] in error_classes
+            ]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def save(self, path):
+        """
+        Write the dead letters to a JSON file
+
+        Args:
+            path (str or Path): Output file path
+        """
+        with self.lock:
+            entries = list(self.entries.values())
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+
+def load_failed_sids(path):
+    """
+    Read the SIDs of a failed_sids_*.json or dead_letter_*.json file
+
+    Args:
+        path (str or Path): Path to the file
+
+    Returns:
+        list: SIDs
+    """
+    with open(Path(path), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return [entry["SID"] if isinstance(entry, dict) else str(entry) for entry in data]
@@ -0,0 +1,302 @@
+import json
+import math
+import time
+import logging
+import argparse
+import concurrent.futures
+from pathlib import Path
+
+import numpy as np
+
+from metrics_engine import EncodedResults, compute_metrics, INDICATORS
+from checkpoint import read_checkpoint
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESAMPLES = 10000
+DEFAULT_CONFIDENCE = 0.95
+
+# Resamples drawn from one seed; blocks are what the workers split, so results
+# do not depend on the number of workers
+BLOCK_RESAMPLES = 500
+
+# Upper bound on resample x row draw counts held at once per block
+BATCH_CELLS = 2_000_000
+
+def _resampled_metrics(counts, class_counts, exact, weights):
+    """
+    Accuracy and macro F1 of every indicator, and exact-match accuracy, for a batch of resamples
+
+    A resample is given by how often it draws each row, so its confusion
+    matrices are one matrix product of those weights with the one-hot
+    (indicator, truth, prediction) encoding of the rows.
+
+    Args:
+        counts (numpy.ndarray): rows x sum(classes^2) one-hot confusion cell of each row and indicator
+        class_counts (list): Number of classes of each indicator
+        exact (numpy.ndarray): 1.0 for rows where every indicator is correct
+        weights (numpy.ndarray): resamples x rows draw counts
+
+    Returns:
+        tuple: (resamples x indicators accuracy, resamples x indicators macro F1, resamples exact-match accuracy)
+    """
+    batch, rows = weights.shape
+    cells = weights @ counts
+    accuracy = np.empty((batch, len(class_counts)))
+    f1_macro = np.empty((batch, len(class_counts)))
+    offset = 0
+    for column, classes in enumerate(class_counts):
+        confusion = cells[:, offset:offset + classes * classes].reshape(batch, classes, classes)
+        offset += classes * classes
+        correct = np.diagonal(confusion, axis1=1, axis2=2)
+        support = confusion.sum(axis=2)
+        predicted = confusion.sum(axis=1)
+        precision = np.divide(correct, predicted, out=np.zeros_like(correct), where=predicted > 0)
+        recall = np.divide(correct, support, out=np.zeros_like(correct), where=support > 0)
+        denominator = precision + recall
+        f1 = np.divide(2 * precision * recall, denominator, out=np.zeros_like(correct), where=denominator > 0)
+        # Like classification_report, the macro average covers the classes present in the sample
+        present = (support + predicted) > 0
+        accuracy[:, column] = correct.sum(axis=1) / rows
+        f1_macro[:, column] = (f1 * present).sum(axis=1) / present.sum(axis=1)
+    return accuracy, f1_macro, weights @ exact / rows
+
+def _bootstrap_block(runs, resamples, seed):
+    """
+    Worker entry point: metrics of one block of resamples for one or more paired runs
+
+    Every run is evaluated on the same resampled rows.
+
+    Args:
+        runs (list): (counts, class_counts, exact) of each run, see _resampled_metrics
+        resamples (int): Resamples in the block
+        seed (numpy.random.SeedSequence): Seed of the block
+
+    Returns:
+        list: (accuracy, f1_macro, exact) arrays of each run
+    """
+    rng = np.random.default_rng(seed)
+    rows = len(runs[0][2])
+    batch = max(1, BATCH_CELLS // max(rows, 1))
+    parts = [[] for _ in runs]
+    for start in range(0, resamples, batch):
+        size = min(batch, resamples - start)
+        # Draw counts of every row in every resample with one bincount
+        indices = rng.integers(0, rows, size=(size, rows), dtype=np.int64) + (np.arange(size) * rows)[:, None]
+        weights = np.bincount(indices.ravel(), minlength=size * rows).reshape(size, rows).astype(np.float64)
+        for part, run in zip(parts, runs):
+            part.append(_resampled_metrics(*run, weights))
+    return [tuple(np.concatenate(arrays) for arrays in zip(*part)) for part in parts]
+
+def _run_arrays(encoded):
+    """Arrays of a run needed by the workers"""
+    class_counts = [len(classes) for classes in encoded.classes]
+    offsets = np.cumsum([0] + [classes * classes for classes in class_counts])
+    cells = encoded.truth.astype(np.int64) * np.array(class_counts) + encoded.pred + offsets[:-1]
+    counts = np.zeros((len(encoded), offsets[-1]))
+    np.put_along_axis(counts, cells, 1.0, axis=1)
+    return counts, class_counts, encoded.correct().all(axis=1).astype(np.float64)
+
+def bootstrap_resamples(runs, resamples=DEFAULT_RESAMPLES, workers=None, seed=0):
+    """
+    Draw bootstrap resamples of one or more runs over the same rows
+
+    Resamples are drawn in blocks of BLOCK_RESAMPLES, each from its own child
+    seed of `seed`, and computed in batches of resample x row draw counts;
+    with workers > 1 the blocks run in a process pool. The result only
+    depends on the seed, not on the number of workers.
+
+    Args:
+        runs (list): EncodedResults with the same rows in the same order
+        resamples (int): Number of resamples
+        workers (int, optional): Processes; None or 1 computes in this process
+        seed (int): Random seed
+
+    Returns:
+        list: (resamples x indicators accuracy, resamples x indicators macro F1,
+            resamples exact-match accuracy) of each run
+    """
+    if resamples < 1:
+        raise ValueError("resamples must be at least 1")
+    arrays = [_run_arrays(encoded) for encoded in runs]
+    sizes = [min(BLOCK_RESAMPLES, resamples - start) for start in range(0, resamples, BLOCK_RESAMPLES)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers and workers > 1 and len(sizes) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(sizes))) as executor:
+            blocks = list(executor.map(_bootstrap_block, [arrays] * len(sizes), sizes, seeds))
+    else:
+        blocks = [_bootstrap_block(arrays, size, block_seed) for size, block_seed in zip(sizes, seeds)]
+    return [tuple(np.concatenate([block[run][part] for block in blocks]) for part in range(3))
+            for run in range(len(runs))]
+
+def _interval(samples, confidence):
+    """Percentile interval of bootstrap samples (along the first axis)"""
+    alpha = (1 - confidence) / 2
+    return np.quantile(samples, [alpha, 1 - alpha], axis=0)
+
+def bootstrap_metrics(encoded, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, workers=None, seed=0):
+    """
+    Percentile bootstrap confidence intervals of the metrics of a run
+
+    Args:
+        encoded (EncodedResults): The run
+        resamples (int): Number of resamples
+        confidence (float): Confidence level of the intervals
+        workers (int, optional): Processes, see bootstrap_resamples
+        seed (int): Random seed
+
+    Returns:
+        dict: indicator -> {"accuracy_ci": [low, high], "f1_macro_ci": [low, high]}, plus
+            "overall" -> {"accuracy_ci": [low, high]}
+    """
+    start = time.perf_counter()
+    (accuracy, f1_macro, exact), = bootstrap_resamples([encoded], resamples, workers, seed)
+    accuracy_ci, f1_ci, exact_ci = (_interval(samples, confidence) for samples in (accuracy, f1_macro, exact))
+    intervals = {indicator: {"accuracy_ci": accuracy_ci[:, column].tolist(), "f1_macro_ci": f1_ci[:, column].tolist()}
+                 for column, indicator in enumerate(encoded.indicators)}
+    intervals["overall"] = {"accuracy_ci": exact_ci.tolist()}
+    logger.info(f"Bootstrapped {resamples} resamples of {len(encoded)} results "
+                f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+    return intervals
+
+def format_interval(interval):
+    """Format an interval for a report line, e.g. " [0.7120, 0.7480]"; "" for None"""
+    if interval is None:
+        return ""
+    return f" [{interval[0]:.4f}, {interval[1]:.4f}]"
+
+def mcnemar_test(correct_a, correct_b):
+    """
+    Exact McNemar test of two classifiers on the same samples
+
+    Only the discordant samples count: under the null hypothesis each of them
+    is equally likely to favour either classifier, so the two-sided p-value is
+    a binomial tail with p = 1/2.
+
+    Args:
+        correct_a (numpy.ndarray): Boolean correctness of classifier A per sample
+        correct_b (numpy.ndarray): Boolean correctness of classifier B per sample
+
+    Returns:
+        dict: {"a_only": samples only A got right, "b_only": samples only B got right, "p_value"}
+    """
+    a_only = int(np.count_nonzero(correct_a & ~correct_b))
+    b_only = int(np.count_nonzero(~correct_a & correct_b))
+    discordant = a_only + b_only
+    if discordant == 0:
+        return {"a_only": 0, "b_only": 0, "p_value": 1.0}
+    # Exact integer tail, so large discordant counts don't underflow
+    tail = sum(math.comb(discordant, k) for k in range(min(a_only, b_only) + 1))
+    p_value = min(1.0, 2 * tail / 2 ** discordant)
+    return {"a_only": a_only, "b_only": b_only, "p_value": p_value}
+
+def _delta_summary(estimate, samples, confidence):
+    """Point estimate, interval and two-sided paired bootstrap p-value of a difference"""
+    low, high = _interval(samples, confidence)
+    # Share of resamples on the far side of zero, doubled
+    p_value = min(1.0, 2 * min(np.mean(samples <= 0), np.mean(samples >= 0)))
+    return {"estimate": float(estimate), "ci": [float(low), float(high)], "p_value": float(p_value)}
+
+def compare_runs(encoded_a, encoded_b, resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE,
+                 workers=None, seed=0):
+    """
+    Paired significance tests between two runs on the SIDs both answered
+
+    Accuracy differences are tested with McNemar's test and a paired
+    bootstrap; macro F1 differences with the paired bootstrap. Differences
+    are B - A.
+
+    Args:
+        encoded_a (EncodedResults): Run A (e.g. the baseline)
+        encoded_b (EncodedResults): Run B
+        resamples (int): Number of bootstrap resamples
+        confidence (float): Confidence level of the intervals
+        workers (int, optional): Processes, see bootstrap_resamples
+        seed (int): Random seed
+
+    Returns:
+        dict: {"sample_count", "resamples", "confidence"} plus indicator -> {"accuracy_delta",
+            "f1_macro_delta", "mcnemar"} and "overall" -> {"accuracy_delta", "mcnemar"}; each delta
+            is {"estimate", "ci", "p_value"}. Only sample_count is set when no SID is shared.
+    """
+    common = np.intersect1d(encoded_a.sids, encoded_b.sids)
+    comparison = {"sample_count": len(common), "resamples": resamples, "confidence": confidence}
+    if not len(common):
+        return comparison
+    run_a, run_b = encoded_a.align(common), encoded_b.align(common)
+    metrics_a, metrics_b = compute_metrics(run_a), compute_metrics(run_b)
+    (accuracy_a, f1_a, exact_a), (accuracy_b, f1_b, exact_b) = \
+        bootstrap_resamples([run_a, run_b], resamples, workers, seed)
+
+    correct_a, correct_b = run_a.correct(), run_b.correct()
+    for column, indicator in enumerate(run_a.indicators):
+        comparison[indicator] = {
+            "accuracy_delta": _delta_summary(metrics_b[indicator]["accuracy"] - metrics_a[indicator]["accuracy"],
+                                             accuracy_b[:, column] - accuracy_a[:, column], confidence),
+            "f1_macro_delta": _delta_summary(metrics_b[indicator]["f1_macro"] - metrics_a[indicator]["f1_macro"],
+                                             f1_b[:, column] - f1_a[:, column], confidence),
+            "mcnemar": mcnemar_test(correct_a[:, column], correct_b[:, column]),
+        }
+    comparison["overall"] = {
+        "accuracy_delta": _delta_summary(metrics_b["overall"]["accuracy"] - metrics_a["overall"]["accuracy"],
+                                         exact_b - exact_a, confidence),
+        "mcnemar": mcnemar_test(correct_a.all(axis=1), correct_b.all(axis=1)),
+    }
+    return comparison
+
+def load_predictions(path):
+    """
+    Encode a predictions file
+
+    Args:
+        path (str or Path): predictions_*.json array or run_*.jsonl checkpoint
+
+    Returns:
+        EncodedResults: The run
+    """
+    if Path(path).suffix == ".jsonl":
+        return EncodedResults.from_results(read_checkpoint(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        return EncodedResults.from_results(json.load(f))
+
+def main():
+    """Compare two prediction files of the same SIDs"""
+    parser = argparse.ArgumentParser(description="Paired significance tests between two evaluation runs")
+    parser.add_argument("baseline", type=str, help="Predictions file of run A (.json or checkpoint .jsonl)")
+    parser.add_argument("candidate", type=str, help="Predictions file of run B")
+    parser.add_argument("--resamples", type=int, default=DEFAULT_RESAMPLES,
+                      help="Number of bootstrap resamples")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE,
+                      help="Confidence level of the intervals")
+    parser.add_argument("--workers", type=int, default=None,
+                      help="Processes computing resamples in parallel")
+    parser.add_argument("--seed", type=int, default=0,
+                      help="Random seed")
+
+    args = parser.parse_args()
+
+    comparison = compare_runs(load_predictions(args.baseline), load_predictions(args.candidate),
+                              args.resamples, args.confidence, args.workers, args.seed)
+    print(f"{comparison['sample_count']} SIDs in both runs, differences are B - A "
+          f"({args.confidence:.0%} intervals, {args.resamples} resamples)")
+    if not comparison["sample_count"]:
+        return
+    print(f"{'':>16} {'Δ accuracy':>10} {'interval':>19} {'bootstrap p':>11} {'McNemar p':>10} "
+          f"{'Δ macro F1':>10} {'bootstrap p':>11}")
+    for key in INDICATORS + ["overall"]:
+        row = comparison[key]
+        delta = row["accuracy_delta"]
+        line = (f"{key:>16} {delta['estimate']:>+10.4f} [{delta['ci'][0]:+.4f}, {delta['ci'][1]:+.4f}] "
+                f"{delta['p_value']:>11.4f} {row['mcnemar']['p_value']:>10.4f}")
+        if "f1_macro_delta" in row:
+            line += f" {row['f1_macro_delta']['estimate']:>+10.4f} {row['f1_macro_delta']['p_value']:>11.4f}"
+        print(line)
+
+if __name__ == "__main__":
+    main()
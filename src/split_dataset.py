@@ -7,6 +7,7 @@ from sklearn.model_selection import train_test_split
 from collections import Counter
 import random
 import glob
+from dataset_index import DatasetIndex
 
 # Set random seed for reproducibility
 RANDOM_SEED = 42
@@ -20,6 +21,7 @@ RAW_IMAGES_DIR = os.path.join(TONGUEEXPERT_DIR, "TongueImage", "Raw")
 LABELS_FILE = os.path.join(TONGUEEXPERT_DIR, "Phenotypes", "L2_Labels_Predict.txt")
 TEST_FILE = os.path.join(DATA_DIR, "test.txt")
 TRAIN_JSONL = os.path.join(DATA_DIR, "train.jsonl")
+INDEX_DIR = os.path.join(DATA_DIR, "dataset_index")
 
 def encode_image_to_base64(image_path):
     """Encode image to base64 string."""
@@ -52,11 +54,8 @@ def create_test_and_train_split():
     
     # Verify that all image files exist
     print("\nVerifying image files...")
-    missing_images = []
-    for sid in df['SID']:
-        img_path = os.path.join(RAW_IMAGES_DIR, f"{sid}.jpg")
-        if not os.path.exists(img_path):
-            missing_images.append(sid)
+    image_index = DatasetIndex(RAW_IMAGES_DIR, index_dir=INDEX_DIR)
+    missing_images = image_index.missing(df['SID'], suffix=".jpg")
     
     if missing_images:
         print(f"Warning: {len(missing_images)} image files are missing. First 10: {missing_images[:10]}")
@@ -143,12 +142,14 @@ def create_test_and_train_split():
         train_df[col] = train_df[col].replace("None", "NaN")
         train_df[col] = train_df[col].fillna("NaN")
     
+    # Entries reference f"{sid}.jpg", so only count .jpg files as present
+    has_image = image_index.present(train_df['SID'], ".jpg")
+    
     with open(TRAIN_JSONL, 'w', encoding='utf-8') as f:
-        for _, row in train_df.iterrows():
+        for (_, row), present in zip(train_df.iterrows(), has_image):
             sid = row['SID']
-            image_path = os.path.join(RAW_IMAGES_DIR, f"{sid}.jpg")
             
-            if os.path.exists(image_path):
+            if present:
                 # Create the jsonl entry with proper handling of NaN values
                 entry = {
                     "messages": [
@@ -0,0 +1,81 @@
+import time
+import logging
+from contextlib import contextmanager
+from threading import Lock
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Timer that timed() records into; None disables timing
+_active_timer = None
+
+class StageTimer:
+    """Thread-safe collection of per-stage durations"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        """
+        Add one duration
+
+        Args:
+            stage (str): Stage name
+            seconds (float): Duration in seconds
+        """
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def summary(self):
+        """
+        Summarize the recorded durations
+
+        Returns:
+            dict: Stage -> count, total, mean, p50, p95, p99 and max in seconds
+        """
+        with self.lock:
+            samples = {stage: np.asarray(values) for stage, values in self.samples.items()}
+
+        summary = {}
+        for stage, values in samples.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[stage] = {
+                "count": int(values.size),
+                "total": float(values.sum()),
+                "mean": float(values.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(values.max()),
+            }
+        return summary
+
+def set_active_timer(timer):
+    """
+    Route timed() measurements of this process to a timer
+
+    Args:
+        timer (StageTimer): Timer to record into, or None to disable timing
+    """
+    global _active_timer
+    _active_timer = timer
+
+@contextmanager
+def timed(stage):
+    """
+    Time a block as one sample of a stage when a timer is active
+
+    Args:
+        stage (str): Stage name
+    """
+    timer = _active_timer
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.record(stage, time.perf_counter() - start)
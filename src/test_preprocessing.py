@@ -16,8 +16,10 @@ from image_preprocessing import (
     retinex_enhancement,
     gamma_correction, 
     preprocess_image, 
-    load_and_preprocess_image
+    load_and_preprocess_image,
+    load_mask
 )
+from preprocess_profiles import get_profile, registered_profiles, run_stage
 
 # 设置默认输出目录
 DEFAULT_OUTPUT_DIR = Path("data/preprocessing_results")
@@ -50,14 +52,17 @@ def display_image_comparison(original, processed, title):
     plt.tight_layout()
     plt.show()
     
-def test_preprocessing_steps(image_path, save_dir=None):
+def test_preprocessing_steps(image_path, save_dir=None, profile_name=None):
     """
     Test each preprocessing step and the complete preprocessing pipeline
     
     Args:
         image_path (str): Path to the test image
         save_dir (str, optional): Directory to save the processed images
+        profile_name (str, optional): Preprocessing profile name or file; its stages
+            replace the default steps
     """
+    profile = get_profile(profile_name) if profile_name else None
     # 如果未指定输出目录，使用默认目录
     if save_dir is None:
         # 创建时间戳子目录，避免覆盖之前的结果
@@ -85,14 +90,25 @@ def test_preprocessing_steps(image_path, save_dir=None):
     print(f"已保存原始图像: {original_save_path}")
     
     # 测试每个预处理步骤
-    steps = [
-        ("白平衡 (White Balance)", white_balance, "white_balance"),
-        ("光照归一化 (Light Normalization)", light_normalization, "light_normalization"),
-        ("色彩校正 (Color Correction)", color_correction, "color_correction"),
-        ("阴影去除增强 (Retinex Enhancement)", retinex_enhancement, "retinex_enhancement"),
-        ("伽马校正 (Gamma Correction)", lambda img: gamma_correction(img, gamma=1.2), "gamma_correction"),
-        ("完整预处理流程 (Complete Pipeline)", preprocess_image, "complete_pipeline")
-    ]
+    if profile is None:
+        steps = [
+            ("白平衡 (White Balance)", white_balance, "white_balance"),
+            ("光照归一化 (Light Normalization)", light_normalization, "light_normalization"),
+            ("色彩校正 (Color Correction)", color_correction, "color_correction"),
+            ("阴影去除增强 (Retinex Enhancement)", retinex_enhancement, "retinex_enhancement"),
+            ("伽马校正 (Gamma Correction)", lambda img: gamma_correction(img, gamma=1.2), "gamma_correction"),
+            ("完整预处理流程 (Complete Pipeline)", preprocess_image, "complete_pipeline")
+        ]
+    else:
+        # 按配置方案中的步骤和参数逐一测试
+        print(f"使用预处理方案: {profile.name} (指纹 {profile.fingerprint[:12]})")
+        mask = load_mask(image_path, original.shape) if profile.needs_mask else None
+        steps = [(f"{stage} {params}" if params else stage,
+                  lambda img, stage=stage, params=params: run_stage(stage, img, mask, **params),
+                  f"{index:02d}_{stage}")
+                 for index, (stage, params) in enumerate(profile.stages, 1)]
+        steps.append((f"完整预处理流程 (Profile {profile.name})", lambda img: profile.apply(img, mask),
+                      f"profile_{profile.name}"))
     
     # 创建一个HTML报告文件
     report_path = save_dir / "processing_report.html"
@@ -114,6 +130,7 @@ def test_preprocessing_steps(image_path, save_dir=None):
         <body>
             <h1>舌诊图像预处理结果对比</h1>
             <p>原始图像: {image_path}</p>
+            <p>预处理方案: {profile.name + " (" + profile.fingerprint + ")" if profile else "默认"}</p>
             <p>处理时间: {timestamp}</p>
             
         """)
@@ -162,10 +179,12 @@ def main():
     parser = argparse.ArgumentParser(description="测试舌诊图像预处理步骤并保存对比结果")
     parser.add_argument("image_path", help="测试图像的路径")
     parser.add_argument("--save_dir", help="保存处理后图像的目录（默认：data/preprocessing_results/时间戳）", default=None)
+    parser.add_argument("--profile", default=None,
+                        help=f"预处理方案名称（{', '.join(registered_profiles())}）或方案文件（.json/.yaml/.py）")
     
     args = parser.parse_args()
     
-    test_preprocessing_steps(args.image_path, args.save_dir)
+    test_preprocessing_steps(args.image_path, args.save_dir, args.profile)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
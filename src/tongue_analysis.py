@@ -1,4 +1,3 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -7,8 +6,14 @@ import os
 import sys
 import logging
 import io
+import argparse
 from datetime import datetime
 
+from phenotype_cache import load_phenotype_table, DEFAULT_PHENOTYPE_CACHE
+from feature_store import open_feature_store, feature_tables, DEFAULT_FEATURE_STORE
+from column_stats import (ColumnStatsCache, compute_column_stats, describe_frame, label_counts,
+                          DEFAULT_STATS_CACHE)
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -24,12 +29,20 @@ plt.rcParams['axes.unicode_minus'] = False     # 用来正常显示负号
 class TongueDataAnalyzer:
     """舌诊数据分析类"""
     
-    def __init__(self, data_dir="data/TonguExpertDatabase"):
+    def __init__(self, data_dir="data/TonguExpertDatabase", cache_dir=DEFAULT_PHENOTYPE_CACHE,
+                 feature_store_dir=DEFAULT_FEATURE_STORE, stats_cache=DEFAULT_STATS_CACHE, workers=None,
+                 chunk_rows=None):
         """
         初始化函数
         
         参数:
             data_dir (str): 数据目录路径
+            cache_dir (str): 表型数据二进制缓存目录（None 表示每次直接解析TSV）
+            feature_store_dir (str): 特征矩阵（所有特征表按SID拼接）的存储目录
+            stats_cache (str): 列统计缓存文件（按源文件哈希失效；None 表示不缓存）
+            workers (int): 并行计算列统计的进程数（None 或 1 表示在当前进程计算）
+            chunk_rows (int): 流式模式的分块行数；设置后按块读取各表并用可合并的摘要计算统计，
+                内存占用与表的大小无关（None 表示整表加载、精确计算）
         """
         self.data_dir = Path(data_dir)
         logger.info(f"使用数据目录: {self.data_dir.absolute()}")
@@ -43,6 +56,13 @@ class TongueDataAnalyzer:
             logger.error(f"Phenotypes目录不存在: {self.phenotypes_dir.absolute()}")
             raise FileNotFoundError(f"Phenotypes目录不存在: {self.phenotypes_dir.absolute()}")
             
+        self.cache_dir = cache_dir
+        self.feature_store_dir = feature_store_dir
+        self.feature_store = None
+        self.stats_cache = stats_cache
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.column_stats = None  # 表名 -> 列统计，见 compute_statistics
         self.manual_labels = None
         self.predict_labels = None
         self.features = None
@@ -63,10 +83,7 @@ class TongueDataAnalyzer:
             logger.error(f"手动标注文件不存在: {manual_labels_path}")
             raise FileNotFoundError(f"手动标注文件不存在: {manual_labels_path}")
             
-        self.manual_labels = pd.read_csv(
-            manual_labels_path,
-            sep='\t'
-        )
+        self.manual_labels = load_phenotype_table(manual_labels_path, self.cache_dir)
         self.log(f"手动标注数据形状: {self.manual_labels.shape}")
         
         # 加载预测的标签
@@ -75,53 +92,54 @@ class TongueDataAnalyzer:
             logger.error(f"预测标签文件不存在: {predict_labels_path}")
             raise FileNotFoundError(f"预测标签文件不存在: {predict_labels_path}")
             
-        self.predict_labels = pd.read_csv(
-            predict_labels_path,
-            sep='\t'
-        )
+        self.predict_labels = load_phenotype_table(predict_labels_path, self.cache_dir)
         self.log(f"预测标签数据形状: {self.predict_labels.shape}")
         
-        # 加载特征数据
-        feature_files = {
-            'color': 'P11_Tg_Color.txt',
-            'shape': 'P12_Tg_Shape.txt',
-            'texture': 'P13_Tg_Texture.txt',
-            'cnn': 'P14_Tg_CNN.txt'
-        }
-        
+        # 加载特征数据：目录中所有 P1x-P5x 特征表按SID拼接成一个内存映射的 float32 矩阵，
+        # 每个表的特征是其中连续的列（零拷贝视图）
         self.features = {}
-        for feature_type, filename in feature_files.items():
-            feature_path = self.phenotypes_dir / filename
-            try:
-                if not feature_path.exists():
-                    logger.warning(f"特征文件不存在: {feature_path}")
-                    continue
-                    
-                self.features[feature_type] = pd.read_csv(
-                    feature_path,
-                    sep='\t'
-                )
-                self.log(f"{feature_type}特征数据形状: {self.features[feature_type].shape}")
-            except Exception as e:
-                logger.error(f"加载{feature_type}特征数据时出错: {str(e)}")
+        try:
+            self.feature_store = open_feature_store(self.phenotypes_dir, self.feature_store_dir, self.cache_dir)
+        except Exception as e:
+            logger.error(f"加载特征数据时出错: {str(e)}")
+            return
+        self.log(f"特征矩阵形状: {self.feature_store.shape}")
+        for feature_type in self.feature_store.tables():
+            self.features[feature_type] = self.feature_store.frame(feature_type)
+            self.log(f"{feature_type}特征数据形状: {self.features[feature_type].shape}")
+    
+    def compute_statistics(self):
+        """
+        计算各表的列统计（数值列的 describe() 统计量、标签列的频数分布）
+        
+        每个表一次向量化计算，结果按源文件哈希缓存，只重新计算内容变化的表；
+        workers > 1 时各表在多个进程中并行计算。流式模式下各表按块读取，
+        每块计算矩统计、分位数摘要和标签计数摘要后合并，workers > 1 时各块并行计算。
+        """
+        paths = [self.phenotypes_dir / "L1_Labels_Manual.txt", self.phenotypes_dir / "L2_Labels_Predict.txt"]
+        paths = [path for path in paths if path.exists()] + feature_tables(self.phenotypes_dir)
+        self.column_stats = compute_column_stats(paths, ColumnStatsCache(self.stats_cache), self.cache_dir,
+                                                 self.workers, self.chunk_rows)
     
     def analyze_labels_distribution(self):
         """分析标签分布情况"""
         self.log("\n=== 标签分布分析 ===")
+        if self.column_stats is None:
+            self.compute_statistics()
         
-        if self.manual_labels is not None:
+        if "L1_Labels_Manual" in self.column_stats:
             self.log("\n手动标注的标签分布:")
-            for col in self.manual_labels.columns[1:]:  # 跳过SID列
+            for col in self.column_stats["L1_Labels_Manual"]["labels"]:
                 self.log(f"\n{col}的分布:")
-                self.log(self.manual_labels[col].value_counts(dropna=False))
+                self.log(label_counts(self.column_stats["L1_Labels_Manual"], col))
         else:
             logger.warning("手动标注数据未加载，无法分析分布")
         
-        if self.predict_labels is not None:
+        if "L2_Labels_Predict" in self.column_stats:
             self.log("\n预测标签的分布:")
-            for col in self.predict_labels.columns[1:]:  # 跳过SID列
+            for col in self.column_stats["L2_Labels_Predict"]["labels"]:
                 self.log(f"\n{col}的分布:")
-                self.log(self.predict_labels[col].value_counts(dropna=False))
+                self.log(label_counts(self.column_stats["L2_Labels_Predict"], col))
         else:
             logger.warning("预测标签数据未加载，无法分析分布")
     
@@ -129,13 +147,16 @@ class TongueDataAnalyzer:
         """分析特征数据的基本统计信息"""
         self.log("\n=== 特征数据分析 ===")
         
-        if not self.features:
+        feature_types = [path.stem for path in feature_tables(self.phenotypes_dir)]
+        if not feature_types:
             logger.warning("特征数据未加载或为空，无法分析特征")
             return
+        if self.column_stats is None:
+            self.compute_statistics()
             
-        for feature_type, df in self.features.items():
+        for feature_type in feature_types:
             self.log(f"\n{feature_type}特征的基本统计信息:")
-            self.log(df.describe())
+            self.log(describe_frame(self.column_stats[feature_type]))
     
     def save_analysis_results(self, output_dir="./results"):
         """保存分析结果到文件"""
@@ -158,7 +179,11 @@ class TongueDataAnalyzer:
     def run_analysis(self):
         """运行完整的分析流程"""
         try:
-            self.load_data()
+            if self.chunk_rows is None:
+                self.load_data()
+            else:
+                # 流式模式不整表加载数据，统计直接从分块计算
+                self.log(f"流式模式：每块 {self.chunk_rows} 行")
             self.analyze_labels_distribution()
             self.analyze_features()
             output_file = self.save_analysis_results()
@@ -169,8 +194,21 @@ class TongueDataAnalyzer:
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="舌诊表型数据分析")
+    parser.add_argument("--data-dir", type=str, default="data/TonguExpertDatabase",
+                      help="数据目录路径")
+    parser.add_argument("--workers", type=int, default=None,
+                      help="并行计算列统计的进程数")
+    parser.add_argument("--no-stats-cache", action="store_true",
+                      help="不使用列统计缓存，全部重新计算")
+    parser.add_argument("--stream", type=int, default=None, metavar="ROWS",
+                      help="流式模式：按每块 ROWS 行分块读取各表，内存占用有界")
+    
+    args = parser.parse_args()
+    
     try:
-        analyzer = TongueDataAnalyzer()
+        analyzer = TongueDataAnalyzer(args.data_dir, workers=args.workers, chunk_rows=args.stream,
+                                      stats_cache=None if args.no_stats_cache else DEFAULT_STATS_CACHE)
         analyzer.run_analysis()
     except Exception as e:
         logger.error(f"程序运行出错: {str(e)}")